@@ -0,0 +1,474 @@
+"""パイプラインの各段階のベンチマーク.
+
+合成した設定(組み合わせ数と飛行時間を変えたもの)で以下の段階を実行し、スループットとピークメモリを記録する.
+
+- product: generate_dicts_product (組み合わせの生成)
+- render: generate_param_xml (XMLのレンダリング)
+- simulate: run_jsb (エンジンプール、1プロセス)
+- simulate_script: run_jsb (スクリプトを毎回読み込む既定の実行、1プロセス)
+- simulate_batch: run_jsb_group (一括積分エンジンでまとめて積分、1プロセス)
+- calculate_aoa, get_extrema_analysis, summarize_output_info_df (集計)
+- kml: KMLGenerator (着地点ポリゴンの生成と保存)
+
+シミュレーションと集計は組み合わせのうち先頭の --max-runs 件だけを実行する.
+ピークメモリは tracemalloc で計測した呼び出し元プロセスのPythonのヒープと、プロセスの最大RSS.
+JSBSimのC++側とXMLのレンダリングのワーカーのメモリは最大RSSにのみ現れる(ワーカーは含まない).
+
+使い方 (リポジトリのルートで実行する):
+    uv run benchmarks/bench_pipeline.py --sizes 1 64 --save-baseline benchmarks/baseline.json
+    uv run benchmarks/bench_pipeline.py --sizes 1 64 --baseline benchmarks/baseline.json
+"""
+
+import argparse
+import gc
+import json
+import logging
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections.abc import Callable
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import Any
+
+import jsbsim
+import numpy as np
+import pandas as pd
+from omegaconf import DictConfig, ListConfig, OmegaConf
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+# src/main.py と同じく src 以下を import できるようにする
+sys.path.insert(0, str(REPO_ROOT / "src"))
+
+from trajecsim.jsbsim_support.generate_param_xml import generate_param_xml  # noqa: E402
+from trajecsim.jsbsim_support.jsb_runner import run_jsb, run_jsb_group  # noqa: E402
+from trajecsim.jsbsim_support.param_generator.parameter_product import generate_dicts_product  # noqa: E402
+from trajecsim.jsbsim_support.param_generator.yaml_loader import (  # noqa: E402
+    convert_omegaconf_to_schema,
+    load_csv_to_dict,
+    load_yaml_parameters,
+)
+from trajecsim.jsbsim_support.schemas.batch_engine import BatchEngineSchema  # noqa: E402
+from trajecsim.util.kml_generator import KMLGenerator  # noqa: E402
+from trajecsim.util.summarize import calculate_aoa, get_extrema_analysis, summarize_output_info_df  # noqa: E402
+from trajecsim.util.telemetry import max_rss_mb  # noqa: E402
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_CONFIG = REPO_ROOT / "data/input/landed_area.yaml"
+TEMPLATE_DIR = REPO_ROOT / "src/trajecsim/jsbsim_support/param-xml-template"
+DEFAULT_SIZES = [1, 64, 1000, 10000]
+# 短い飛行は燃焼と上昇の途中まで. 長い飛行は設定ファイルのまま(着地まで)
+FLIGHTS = {"short": 10.0, "full": None}
+# 合成した組み合わせの風速の範囲[m/s]
+WIND_SPEED_RANGE = (0.0, 8.0)
+# 飛行時間に依存しない段階は、この名前でまとめて1回だけ計測する
+ANY_FLIGHT = "any"
+# これより短い時間はばらつきが大きいので、基準との比較に使わない[s]
+MIN_COMPARED_SECONDS = 0.05
+
+
+def _factor_grid(size: int) -> tuple[int, int]:
+    """組み合わせ数を、なるべく正方形に近い風向 x 風速の格子に分ける."""
+    num_dirs = max(divisor for divisor in range(1, math.isqrt(size) + 1) if size % divisor == 0)
+    return num_dirs, size // num_dirs
+
+
+def _absolute_path(value: Any) -> Any:  # noqa: ANN401
+    """リポジトリのルートからの相対パスを絶対パスにする. 作業ディレクトリを変えても読み込めるようにする."""
+    if isinstance(value, str) and value and (REPO_ROOT / value).exists():
+        return str(REPO_ROOT / value)
+    return value
+
+
+def make_synthetic_config(base: DictConfig | ListConfig, size: int, flight: str) -> DictConfig:
+    """組み合わせ数が size になる設定を作る.
+
+    スイープしているパラメータは最後の値に固定し、地上風の風向と風速だけを size 件の格子にする.
+
+    Args:
+        base (DictConfig | ListConfig): 元の設定.
+        size (int): 組み合わせの数.
+        flight (str): 飛行時間 (FLIGHTS のキー).
+
+    Returns:
+        DictConfig: 合成した設定.
+    """
+    sections = {}
+    for section in ("launch", "rocket", "simulation"):
+        values = OmegaConf.to_container(base[section], resolve=True)
+        sections[section] = {
+            key: _absolute_path(value[-1] if isinstance(value, list) and value else value)
+            for key, value in values.items()
+        }
+
+    num_dirs, num_speeds = _factor_grid(size)
+    sections["launch"]["ground_wind_dir"] = np.linspace(0.0, 360.0, num_dirs, endpoint=False).tolist()
+    sections["launch"]["ground_wind_speed"] = np.linspace(*WIND_SPEED_RANGE, num_speeds).tolist()
+    if FLIGHTS[flight] is not None:
+        sections["simulation"]["flight_duration"] = FLIGHTS[flight]
+    return OmegaConf.create(sections)
+
+
+def measure(
+    stage: str,
+    size: int,
+    flight: str,
+    items: int,
+    func: Callable[[], Any],
+    repeat: int,
+    trace_memory: bool,
+) -> tuple[dict[str, Any], Any]:
+    """段階を実行して、時間とメモリを計測する.
+
+    時間は repeat 回のうち最短のもの. メモリは時間に影響しないように別に1回実行して計測する.
+
+    Args:
+        stage (str): 段階の名前.
+        size (int): 組み合わせの数.
+        flight (str): 飛行時間.
+        items (int): 1回の実行で処理する件数. スループットの計算に使う.
+        func (Callable[[], Any]): 計測する処理.
+        repeat (int): 時間を計測する回数.
+        trace_memory (bool): ピークメモリを計測する.
+
+    Returns:
+        tuple[dict[str, Any], Any]: 計測結果と、最後の実行の戻り値.
+    """
+    timings = []
+    result = None
+    for _ in range(repeat):
+        gc.collect()
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        result = func()
+        timings.append((time.perf_counter() - start_wall, time.process_time() - start_cpu))
+    wall_seconds, cpu_seconds = min(timings)
+
+    peak_mb = None
+    if trace_memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            result = func()
+            peak_mb = tracemalloc.get_traced_memory()[1] / 1024**2
+        finally:
+            tracemalloc.stop()
+
+    record = {
+        "stage": stage,
+        "size": size,
+        "flight": flight,
+        "items": items,
+        "wall_seconds": wall_seconds,
+        "cpu_seconds": cpu_seconds,
+        "items_per_second": items / wall_seconds if wall_seconds > 0 else math.inf,
+        "peak_mb": peak_mb,
+        "max_rss_mb": max_rss_mb(),
+    }
+    LOGGER.info(
+        f"{stage:<26} n={size:<6} {flight:<5} {items:>6}件 {wall_seconds:9.3f}s "
+        f"{record['items_per_second']:10.1f}件/s "
+        f"peak {'-' if peak_mb is None else f'{peak_mb:.1f}MB'}"
+    )
+    return record, result
+
+
+def _product_input(config: DictConfig) -> dict[str, dict[str, Any]]:
+    """generate_param_xml と同じく、CSVを読み込んだ組み合わせの入力を作る."""
+    rocket_schema, simulation_schema, launch_schema = convert_omegaconf_to_schema(config)
+    return {
+        "rocket": load_csv_to_dict(rocket_schema.model_dump()),
+        "simulation": load_csv_to_dict(simulation_schema.model_dump()),
+        "launch": load_csv_to_dict(launch_schema.model_dump()),
+    }
+
+
+def _landing_points(size: int) -> pd.DataFrame:
+    """KMLの着地点ポリゴン用に、風向 x 風速の格子上の合成した着地点を作る."""
+    num_dirs, num_speeds = _factor_grid(size)
+    wind_dir, wind_speed = np.meshgrid(
+        np.linspace(0.0, 360.0, num_dirs, endpoint=False), np.linspace(*WIND_SPEED_RANGE, num_speeds), indexing="ij"
+    )
+    # 風下に風速に比例して流される (1m/s あたり約100m)
+    offset_deg = 1e-3 * wind_speed.ravel()
+    return pd.DataFrame(
+        {
+            ("launch", "ground_wind_dir"): wind_dir.ravel(),
+            ("launch", "ground_wind_speed"): wind_speed.ravel(),
+            "landed_latitude": 40.24 - offset_deg * np.cos(np.radians(wind_dir.ravel())),
+            "landed_longitude": 140.01 - offset_deg * np.sin(np.radians(wind_dir.ravel())),
+        }
+    )
+
+
+def run_benchmarks(
+    config_path: Path, sizes: list[int], flights: list[str], max_runs: int, repeat: int, trace_memory: bool
+) -> list[dict[str, Any]]:
+    """全段階のベンチマークを実行する.
+
+    Args:
+        config_path (Path): 元にする設定ファイル.
+        sizes (list[int]): 組み合わせの数.
+        flights (list[str]): 飛行時間 (FLIGHTS のキー).
+        max_runs (int): シミュレーションと集計を行う組み合わせの最大数.
+        repeat (int): 時間を計測する回数.
+        trace_memory (bool): ピークメモリを計測する.
+
+    Returns:
+        list[dict[str, Any]]: 計測結果.
+    """
+    base_config = load_yaml_parameters(config_path)
+    records = []
+    cwd = Path.cwd()
+    with tempfile.TemporaryDirectory(prefix="trajecsim-bench-") as work_dir:
+        work_root = Path(work_dir)
+        # generate_param_xml は作業ディレクトリの temp 以下に出力する
+        os.chdir(work_root)
+        try:
+            records.extend(_run_sizes(base_config, sizes, flights, max_runs, repeat, trace_memory, work_root))
+        finally:
+            os.chdir(cwd)
+    return records
+
+
+def _run_sizes(
+    base_config: DictConfig | ListConfig,
+    sizes: list[int],
+    flights: list[str],
+    max_runs: int,
+    repeat: int,
+    trace_memory: bool,
+    work_root: Path,
+) -> list[dict[str, Any]]:
+    """組み合わせの数ごとに全段階を計測する."""
+    records = []
+    for size in sizes:
+        product_input = _product_input(make_synthetic_config(base_config, size, flights[0]))
+        record, _ = measure(
+            "product",
+            size,
+            ANY_FLIGHT,
+            size,
+            lambda product_input=product_input: generate_dicts_product(product_input),
+            repeat,
+            trace_memory,
+        )
+        records.append(record)
+
+        landing_df = _landing_points(size)
+        kml_path = work_root / "kml" / f"landing_{size}.kml"
+        kml_path.parent.mkdir(parents=True, exist_ok=True)
+
+        def save_landing_kml(landing_df: pd.DataFrame = landing_df, kml_path: Path = kml_path) -> None:
+            kml_generator = KMLGenerator()
+            group_keys = [("launch", "ground_wind_speed")]
+            kml_generator.generate_grouped_points_polygons(landing_df.groupby(group_keys))
+            kml_generator.save(kml_path)
+
+        record, _ = measure("kml", size, ANY_FLIGHT, size, save_landing_kml, repeat, trace_memory)
+        records.append(record)
+
+        for flight in flights:
+            records.extend(_run_flight_stages(base_config, size, flight, max_runs, repeat, trace_memory, work_root))
+    return records
+
+
+def _run_flight_stages(
+    base_config: DictConfig | ListConfig,
+    size: int,
+    flight: str,
+    max_runs: int,
+    repeat: int,
+    trace_memory: bool,
+    work_root: Path,
+) -> list[dict[str, Any]]:
+    """飛行時間に依存する段階(レンダリング、シミュレーション、集計)を計測する."""
+    config = make_synthetic_config(base_config, size, flight)
+    records = []
+    record, simulation_df = measure(
+        "render", size, flight, size, lambda: generate_param_xml(config, TEMPLATE_DIR), repeat, trace_memory
+    )
+    records.append(record)
+
+    run_df = simulation_df.iloc[:max_runs]
+    num_runs = len(run_df)
+    output_dir = work_root / "raw_result" / f"{size}_{flight}"
+
+    def simulate(*, engine_pool: bool) -> pd.DataFrame:
+        results = [
+            run_jsb(run_df.loc[index], output_dir, engine_pool=engine_pool, save_csv=False) for index in run_df.index
+        ]
+        return pd.DataFrame(results, index=run_df.index)
+
+    # エンジンプールと、スクリプトを毎回読み込む既定の実行
+    for stage, engine_pool in (("simulate", True), ("simulate_script", False)):
+        record, results_df = measure(
+            stage,
+            size,
+            flight,
+            num_runs,
+            lambda engine_pool=engine_pool: simulate(engine_pool=engine_pool),
+            repeat,
+            trace_memory,
+        )
+        record["simulated_seconds"] = float(sum(trajectory["Time"][-1] for trajectory in results_df["trajectory"]))
+        records.append(record)
+
+    def simulate_batch() -> list[pd.Series]:
+        batch_engine = BatchEngineSchema()
+        calls = [
+            (run_jsb, (run_df.loc[index], output_dir), {"save_csv": False, "batch_engine": batch_engine})
+            for index in run_df.index
+        ]
+        return run_jsb_group(calls, [run_df.loc[index] for index in run_df.index], batch_engine=batch_engine)
+
+    record, batch_results = measure("simulate_batch", size, flight, num_runs, simulate_batch, repeat, trace_memory)
+    record["simulated_seconds"] = float(sum(result["trajectory"]["Time"][-1] for result in batch_results))
+    records.append(record)
+
+    rows = [row for _, row in pd.concat([run_df, results_df], axis=1).iterrows()]
+    summary_dir = work_root / "summary" / f"{size}_{flight}"
+    stages: list[tuple[str, Callable[[pd.Series], Any]]] = [
+        ("calculate_aoa", calculate_aoa),
+        ("get_extrema_analysis", get_extrema_analysis),
+        ("summarize_output_info_df", lambda row: summarize_output_info_df(row, summary_dir)),
+    ]
+    for stage, func in stages:
+        record, _ = measure(
+            stage, size, flight, num_runs, lambda func=func: [func(row) for row in rows], repeat, trace_memory
+        )
+        records.append(record)
+    return records
+
+
+def _environment() -> dict[str, Any]:
+    """計測した環境の情報."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],  # noqa: S607
+            cwd=REPO_ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "created_at": datetime.now(UTC).isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "jsbsim": jsbsim.__version__,
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+    }
+
+
+def _case_key(record: dict[str, Any]) -> tuple[str, int, str]:
+    return record["stage"], record["size"], record["flight"]
+
+
+def compare_with_baseline(
+    records: list[dict[str, Any]], baseline: dict[str, Any], tolerance: float
+) -> list[dict[str, Any]]:
+    """基準の計測結果と比較し、悪化したものを返す.
+
+    時間は1件あたり、メモリはピークを比較する. 基準の (1 + tolerance) 倍を超えたら悪化とする.
+    時間が MIN_COMPARED_SECONDS より短い段階は、時間を比較しない.
+
+    Args:
+        records (list[dict[str, Any]]): 今回の計測結果.
+        baseline (dict[str, Any]): 基準の計測結果 (このスクリプトの出力).
+        tolerance (float): 許容する増加の割合.
+
+    Returns:
+        list[dict[str, Any]]: 悪化した項目.
+    """
+    baseline_records = {_case_key(record): record for record in baseline["results"]}
+    regressions = []
+    for record in records:
+        base = baseline_records.get(_case_key(record))
+        if base is None:
+            continue
+        metrics = {"peak_mb": (base["peak_mb"], record["peak_mb"])}
+        if max(base["wall_seconds"], record["wall_seconds"]) >= MIN_COMPARED_SECONDS:
+            metrics["seconds_per_item"] = (
+                base["wall_seconds"] / base["items"],
+                record["wall_seconds"] / record["items"],
+            )
+        for metric, (base_value, value) in metrics.items():
+            if base_value is None or value is None or base_value <= 0:
+                continue
+            ratio = value / base_value
+            LOGGER.info(f"{record['stage']:<26} n={record['size']:<6} {record['flight']:<5} {metric:<16} x{ratio:.2f}")
+            if ratio > 1 + tolerance:
+                regressions.append(
+                    {
+                        "stage": record["stage"],
+                        "size": record["size"],
+                        "flight": record["flight"],
+                        "metric": metric,
+                        "baseline": base_value,
+                        "value": value,
+                        "ratio": ratio,
+                    }
+                )
+    return regressions
+
+
+def get_arguments() -> argparse.Namespace:
+    """コマンドライン引数を取得する."""
+    parser = argparse.ArgumentParser(description="パイプラインの各段階のベンチマーク")
+    parser.add_argument("--config", type=Path, default=DEFAULT_CONFIG, help="元にする設定ファイル")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="組み合わせの数")
+    parser.add_argument("--flights", nargs="+", choices=list(FLIGHTS), default=list(FLIGHTS), help="飛行時間")
+    parser.add_argument("--max-runs", type=int, default=8, help="シミュレーションと集計を行う組み合わせの最大数")
+    parser.add_argument("--repeat", type=int, default=1, help="時間を計測する回数 (最短の時間を使う)")
+    parser.add_argument(
+        "--memory", action=argparse.BooleanOptionalAction, default=True, help="ピークメモリを計測する"
+    )
+    parser.add_argument(
+        "--output", type=Path, default=REPO_ROOT / "benchmarks/results/latest.json", help="計測結果の出力先"
+    )
+    parser.add_argument("--save-baseline", type=Path, help="計測結果を基準として保存する")
+    parser.add_argument("--baseline", type=Path, help="比較する基準の計測結果")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="基準に対して許容する増加の割合")
+    return parser.parse_args()
+
+
+def main() -> int:
+    """ベンチマークを実行し、基準と比較する. 悪化した場合は1を返す."""
+    args = get_arguments()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    # パイプラインのログは計測結果の表示の邪魔になるので抑える
+    logging.getLogger("trajecsim").setLevel(logging.WARNING)
+    LOGGER.setLevel(logging.INFO)
+
+    records = run_benchmarks(args.config, args.sizes, args.flights, args.max_runs, args.repeat, args.memory)
+    report = {"environment": _environment(), "results": records}
+    for path in [args.output, args.save_baseline]:
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+            LOGGER.info(f"計測結果を保存しました: {path}")
+
+    if args.baseline is None:
+        return 0
+    regressions = compare_with_baseline(records, json.loads(args.baseline.read_text()), args.tolerance)
+    for regression in regressions:
+        LOGGER.warning(
+            f"悪化: {regression['stage']} n={regression['size']} {regression['flight']} {regression['metric']} "
+            f"{regression['baseline']:.4g} -> {regression['value']:.4g} (x{regression['ratio']:.2f})"
+        )
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
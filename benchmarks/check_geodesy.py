@@ -0,0 +1,68 @@
+"""trajecsim.util.geodesy の計算を geopy.distance.geodesic と比べる.
+
+射点の周りにランダムな地点を作り、geodesic_offsets の距離と南北・東西方向の距離が
+geopy で1点ずつ計算した値と許容誤差以内で一致するかを確認する.
+
+使い方 (リポジトリのルートで実行する):
+    uv run benchmarks/check_geodesy.py --points 1000 --radius-km 50
+"""
+
+import argparse
+import logging
+import sys
+from pathlib import Path
+
+import geopy.distance
+import numpy as np
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+# src/main.py と同じく src 以下を import できるようにする
+sys.path.insert(0, str(REPO_ROOT / "src"))
+
+from trajecsim.util.geodesy import geodesic_offsets  # noqa: E402
+
+LOGGER = logging.getLogger(__name__)
+
+
+def get_arguments() -> argparse.Namespace:
+    """コマンドライン引数を取得する."""
+    parser = argparse.ArgumentParser(description="geodesic_offsets を geopy と比べる")
+    parser.add_argument("--points", type=int, default=1000, help="比べる地点の数")
+    parser.add_argument("--radius-km", type=float, default=50.0, help="基準点からの最大距離[km]")
+    parser.add_argument("--tolerance-m", type=float, default=1e-3, help="許容誤差[m]")
+    parser.add_argument("--seed", type=int, default=0, help="乱数のシード")
+    return parser.parse_args()
+
+
+def geopy_offsets(lat0: float, lon0: float, lat: float, lon: float) -> tuple[float, float, float]:
+    """距離と南北・東西方向の距離[m]を geopy で計算する. 符号は北・東を正とする."""
+    distance = geopy.distance.geodesic((lat0, lon0), (lat, lon)).meters
+    lat_distance = geopy.distance.geodesic((lat0, lon0), (lat, lon0)).meters
+    lon_distance = geopy.distance.geodesic((lat0, lon0), (lat0, lon)).meters
+    return distance, np.copysign(lat_distance, lat - lat0), np.copysign(lon_distance, lon - lon0)
+
+
+def main() -> int:
+    """距離ごとに geopy との差の最大値を表示する. 許容誤差を超えた場合は1を返す."""
+    args = get_arguments()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    rng = np.random.default_rng(args.seed)
+    lat0 = rng.uniform(-80.0, 80.0, args.points)
+    lon0 = rng.uniform(-180.0, 180.0, args.points)
+    # 1度あたり約111km として、基準点の周りの地点を作る
+    spread = args.radius_km / 111.0
+    lat = np.clip(lat0 + rng.uniform(-spread, spread, args.points), -89.9, 89.9)
+    lon = lon0 + rng.uniform(-spread, spread, args.points) / np.cos(np.radians(lat0))
+
+    offsets = geodesic_offsets(lat0, lon0, lat, lon)
+    expected = np.array([geopy_offsets(*point) for point in zip(lat0, lon0, lat, lon, strict=True)])
+    failed = False
+    for i, column in enumerate(["distance_m", "lat_diff_m", "lon_diff_m"]):
+        error = np.abs(offsets[column] - expected[:, i]).max()
+        failed |= error > args.tolerance_m
+        LOGGER.info(f"{column}: geopy との差の最大値 {error:.3e} m")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,20 +1,51 @@
 """メインのシミュレーション実行スクリプト"""
 
 import argparse
+import math
 import os
+from collections.abc import Hashable, Iterator
+from functools import partial
 from pathlib import Path
+from shutil import rmtree
+from typing import Any
 
 import pandas as pd
-from joblib import Parallel, delayed
-from tqdm import tqdm
+from joblib import delayed
 
-from trajecsim.jsbsim_support.generate_param_xml import generate_param_xml
-from trajecsim.jsbsim_support.jsb_runner import run_jsb
-from trajecsim.jsbsim_support.param_generator.yaml_loader import load_yaml_parameters
-from trajecsim.util.create_chart import create_time_series_plots
-from trajecsim.util.kml_generator import KMLGenerator
-from trajecsim.util.logger import setup_logging, tqdm_joblib
-from trajecsim.util.summarize import calculate_aoa, get_extrema_analysis, summarize_output_info_df
+from trajecsim.jsbsim_support.engine_pool import get_model_key
+from trajecsim.jsbsim_support.generate_param_xml import generate_param_xml, render_param_combinations
+from trajecsim.jsbsim_support.jsb_runner import (
+    check_batch_engine,
+    check_descent_fast_forward,
+    group_by_flight_prefix,
+    run_jsb,
+    run_jsb_and_analyze,
+    run_jsb_group,
+)
+from trajecsim.jsbsim_support.output_properties import resolve_output_properties
+from trajecsim.jsbsim_support.param_generator.yaml_loader import (
+    convert_omegaconf_to_misc_schema,
+    load_yaml_parameters,
+)
+from trajecsim.jsbsim_support.result_cache import ResultCache
+from trajecsim.jsbsim_support.run_manifest import MANIFEST_DIR_NAME, RunManifest, compute_fingerprint
+from trajecsim.jsbsim_support.schemas.batch_engine import BatchEngineSchema
+from trajecsim.jsbsim_support.schemas.chart import ChartSchema
+from trajecsim.jsbsim_support.schemas.misc import MiscSchema
+from trajecsim.jsbsim_support.trajectory_store import TrajectoryStoreWriter
+from trajecsim.util.adaptive_sampling import ADAPTIVE_DIR_NAME, run_adaptive_sampling
+from trajecsim.util.executor import Executor, create_executor
+from trajecsim.util.geofence import evaluate_landing_geofence
+from trajecsim.util.logger import setup_logging
+from trajecsim.util.summarize import save_group_results
+from trajecsim.util.surrogate import SURROGATE_DIR_NAME, run_surrogate
+from trajecsim.util.telemetry import (
+    PROFILE_FILE_NAME,
+    TELEMETRY_FILE_NAME,
+    get_telemetry,
+    merge_profiles,
+    run_with_stages,
+)
 
 
 def get_arguments() -> argparse.Namespace:
@@ -48,10 +79,149 @@ def get_arguments() -> argparse.Namespace:
         default=False,
         help="Output charts",
     )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Resume an interrupted sweep in output_dir, skipping the combinations that have already finished",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Profile the workers with cProfile and merge the results into output_dir/profile.prof",
+    )
     return parser.parse_args()
 
 
-def main(config_file_path: str | Path, output_dir: str | Path, template_dir: str | Path, chart_output: bool) -> None:
+def _iter_result_groups(
+    simulation_df: pd.DataFrame, result_each: list[str]
+) -> Iterator[tuple[str, Any, pd.DataFrame]]:
+    """result_eachのキーごとに、パラメータの値でグループ分けした組み合わせを返す."""
+    for result_key in result_each:
+        result_keys = [col for col in simulation_df.columns if result_key in col]
+        for group_key, group_df in simulation_df.groupby(result_keys):
+            yield result_key, group_key, group_df
+
+
+def _dispatch_groups(
+    combinations_df: pd.DataFrame, misc: MiscSchema, batch_engine: BatchEngineSchema | None, num_workers: int
+) -> list[list[Hashable]]:
+    """組み合わせを1つのタスク(run_jsb_group)で実行するグループに分ける.
+
+    一括積分エンジンでは batch_size ごとに、エンジンプールで share_flight_prefix の場合は飛行の前半を共有できる
+    組み合わせごとにまとめる. それ以外は1つずつ実行する.
+
+    Args:
+        combinations_df (pd.DataFrame): 実行する組み合わせ (param_dir を含む).
+        misc (MiscSchema): 実行方法の設定.
+        batch_engine (BatchEngineSchema | None): 一括積分エンジンの設定. JSBSimの場合はNone.
+        num_workers (int): ワーカーの数.
+
+    Returns:
+        list[list[Hashable]]: 組み合わせのグループ.
+    """
+    dispatch_index = combinations_df.index
+    if batch_engine is not None:
+        # ワーカーが余らないように、組み合わせが少ない場合は min_batch_size まで小さく分ける
+        min_batch_size = max(1, min(batch_engine.min_batch_size, batch_engine.batch_size))
+        batch_size = max(min_batch_size, min(batch_engine.batch_size, math.ceil(len(dispatch_index) / num_workers)))
+        return [list(dispatch_index[start : start + batch_size]) for start in range(0, len(dispatch_index), batch_size)]
+    if not misc.engine_pool:
+        return [[index] for index in dispatch_index]
+    # 同じ機体モデルの組み合わせが同じワーカーで連続して実行されるように並べ替える
+    model_keys = combinations_df[("param_dir", "")].map(get_model_key)
+    dispatch_index = model_keys.sort_values(kind="stable").index
+    if not misc.share_flight_prefix:
+        return [[index] for index in dispatch_index]
+    # 飛行の前半が同じ組み合わせは同じタスクで実行し、前半を共有する
+    return group_by_flight_prefix(
+        combinations_df.loc[dispatch_index],
+        model_keys,
+        max_group_size=max(1, math.ceil(len(dispatch_index) / (num_workers * 4))),
+    )
+
+
+def _simulate_additional_combinations(
+    combinations_df: pd.DataFrame,
+    template_dir: str | Path,
+    output_dir: Path,
+    analysis_output_dir: Path,
+    misc: MiscSchema,
+    executor: Executor,
+    output_properties: list[str],
+    result_cache: ResultCache | None,
+    batch_engine: BatchEngineSchema | None,
+    chart: ChartSchema | None,
+    profile_dir: Path | None,
+    desc: str,
+) -> pd.DataFrame:
+    """スイープの後で追加した組み合わせ(適応的なスイープ、サロゲートモデルの改良)のXMLを生成して実行し、
+    組み合わせと結果を返す.
+
+    スイープと同じ設定とタスクの分け方で実行する. result_eachを指定した場合は集計もするが、
+    集計結果は analysis_output_dir に保存する. desc は進捗の表示.
+    """
+    combinations_df = render_param_combinations(
+        combinations_df, template_dir, output_properties=output_properties, executor=executor
+    )
+    num_workers = misc.executor.n_jobs or os.cpu_count() or 1
+    dispatch_groups = _dispatch_groups(combinations_df, misc, batch_engine, num_workers)
+    settings = {
+        "engine_pool": misc.engine_pool,
+        "result_cache": result_cache,
+        "descent_fast_forward": misc.descent_fast_forward,
+        "output_properties": output_properties,
+        "batch_engine": batch_engine,
+    }
+    if misc.result_each:
+        analysis_output_dirs = [analysis_output_dir]
+        calls = {
+            index: delayed(run_jsb_and_analyze)(
+                combinations_df.loc[index],
+                output_dir / "raw_result",
+                analysis_output_dirs,
+                save_csv=misc.save_raw_csv,
+                chart=chart,
+                keep_trajectory=misc.trajectory_store != "none",
+                flight_path=misc.flight_path,
+                flight_path_tolerance_m=misc.flight_path_tolerance_m,
+                **settings,
+            )
+            for index in combinations_df.index
+        }
+    else:
+        calls = {
+            index: delayed(run_jsb)(
+                combinations_df.loc[index], output_dir / "raw_result", save_csv=misc.save_raw_csv, **settings
+            )
+            for index in combinations_df.index
+        }
+    tasks = [
+        delayed(run_with_stages)(
+            run_jsb_group,
+            [calls[index] for index in group],
+            [combinations_df.loc[index] for index in group],
+            profile_dir=profile_dir,
+            **settings,
+        )
+        for group in dispatch_groups
+    ]
+    telemetry = get_telemetry()
+    run_results = []
+    for group_results, worker_stages in executor.run(tasks, desc=desc):
+        telemetry.merge_worker_stages(worker_stages)
+        run_results.extend(group_results)
+    results_df = pd.DataFrame(run_results, index=[index for group in dispatch_groups for index in group])
+    return pd.concat([combinations_df, results_df.reindex(combinations_df.index)], axis=1)
+
+
+def main(
+    config_file_path: str | Path,
+    output_dir: str | Path,
+    template_dir: str | Path,
+    chart_output: bool,
+    profile: bool = False,
+    resume: bool = False,
+) -> None:
     """メイン関数"""
     output_dir = Path(output_dir)
     if not output_dir.exists():
@@ -59,18 +229,25 @@ def main(config_file_path: str | Path, output_dir: str | Path, template_dir: str
 
     logger = setup_logging(output_dir / "log.txt")
     logger.info(f"シミュレーションを開始します: {config_file_path}")
+    telemetry = get_telemetry()
+    # ワーカーごとのプロファイルの出力先. 前回の結果と混ざらないように削除する
+    profile_dir = output_dir / "profile" if profile else None
+    if profile_dir is not None:
+        rmtree(profile_dir, ignore_errors=True)
 
     logger.info(f"パラメータを {config_file_path} から読み込みます")
 
     try:
-        params = load_yaml_parameters(config_file_path)
+        with telemetry.stage("config_load"):
+            params = load_yaml_parameters(config_file_path)
+            misc = convert_omegaconf_to_misc_schema(params)
     except FileNotFoundError:
         logger.exception(f"パラメータファイルが見つかりません: {config_file_path}")
         raise
 
     all_params_keys = list(params.launch.keys()) + list(params.simulation.keys()) + list(params.rocket.keys())
-    kml_group_by = params.misc.kml_group_by
-    result_each = params.misc.result_each
+    kml_group_by = misc.kml_group_by
+    result_each = misc.result_each
 
     if not all(group_key in all_params_keys for group_key in kml_group_by):
         invalid_keys = [key for key in kml_group_by if key not in all_params_keys]
@@ -81,103 +258,308 @@ def main(config_file_path: str | Path, output_dir: str | Path, template_dir: str
         logger.exception(f"result_eachキーが不正です: {invalid_keys}")
         raise ValueError(invalid_keys)
 
-    simulation_df = generate_param_xml(params, template_dir)
+    if misc.adaptive_sampling.enabled and not params.launch.get("range_kmz"):
+        logger.error("適応的なスイープには保安域(launch.range_kmz)が必要です")
+        raise ValueError("range_kmz")
+
+    try:
+        output_properties = resolve_output_properties(bool(result_each), misc.output_properties)
+    except ValueError:
+        logger.exception("output_propertiesが不正です")
+        raise
+    logger.info(f"出力するプロパティ: {output_properties}")
+
+    executor = create_executor(misc.executor)
+    logger.info(f"並列実行の方法: {misc.executor.backend}")
+    # 一括積分エンジンを使う場合はその設定. JSBSimの場合はNone
+    batch_engine = misc.batch_engine if misc.simulation_engine == "batch" else None
+    logger.info(f"シミュレーションエンジン: {misc.simulation_engine}")
+    # 時系列のグラフの設定. グラフを出力しない場合はNone
+    chart = misc.chart if chart_output else None
+
+    # 組み合わせごとの進捗を記録し、中断した場合は --resume で残りだけを実行する
+    manifest = RunManifest(
+        output_dir / MANIFEST_DIR_NAME,
+        compute_fingerprint(
+            params,
+            sampling=misc.sampling.model_dump(),
+            output_properties=output_properties,
+            engine_pool=misc.engine_pool,
+            descent_fast_forward=misc.descent_fast_forward,
+            simulation_engine=misc.simulation_engine,
+            batch_engine=None
+            if batch_engine is None
+            else batch_engine.model_dump(exclude={"batch_size", "min_batch_size", "check"}),
+            result_each=result_each,
+            save_raw_csv=misc.save_raw_csv,
+            chart=None if chart is None else chart.model_dump(),
+            flight_path=misc.flight_path,
+            flight_path_tolerance_m=misc.flight_path_tolerance_m,
+        ),
+        keep_trajectories=misc.trajectory_store != "none",
+    )
+    simulation_df = None
+    recorded_fingerprint = manifest.read_fingerprint() if resume else None
+    if recorded_fingerprint is None:
+        if resume:
+            logger.warning(f"再開するスイープの記録がないため、最初から実行します: {manifest.manifest_dir}")
+        manifest.reset()
+    elif recorded_fingerprint != manifest.fingerprint:
+        logger.error("設定が中断したスイープと異なるため再開できません. --resume を外して実行してください")
+        raise ValueError(recorded_fingerprint)
+    else:
+        simulation_df = manifest.load_combinations()
+    if simulation_df is None:
+        simulation_df = generate_param_xml(
+            params, template_dir, sampling=misc.sampling, output_properties=output_properties, executor=executor
+        )
+        manifest.save_combinations(simulation_df)
+    else:
+        logger.info(f"レンダリング済みのXMLを使います: {len(simulation_df)}件")
     # Clear output directory
 
     output_dir.mkdir(parents=True, exist_ok=True)
-    logger.info("シミュレーションを実行します")
-    with tqdm_joblib(tqdm(desc="シミュレーションを実行中🚀", total=len(simulation_df))):
-        results = Parallel(n_jobs=os.cpu_count())(
-            delayed(run_jsb)(row, output_dir / "raw_result") for _, row in simulation_df.iterrows()
-        )
 
-    results_df = pd.DataFrame(results, index=simulation_df.index)
-    simulation_df = pd.concat([simulation_df, results_df], axis=1)
+    # result_eachのグループごとの出力先. 集計はシミュレーションを実行したワーカー内で行う
+    analysis_output_dirs: dict[Any, list[Path]] = {index: [] for index in simulation_df.index}
+    for result_key, group_key, group_df in _iter_result_groups(simulation_df, result_each):
+        for index in group_df.index:
+            analysis_output_dirs[index].append(output_dir / result_key / str(group_key))
 
-    logger.info("シミュレーションの結果を集計します")
+    result_cache = ResultCache(misc.result_cache_dir, misc.result_cache_max_mb) if misc.result_cache else None
 
-    for result_key in tqdm(result_each, desc="シミュレーションの結果を集計中"):
-        result_keys = [col for col in simulation_df.columns if result_key in col]
-        result_df = simulation_df.groupby(result_keys)
-        for group_key, group_df in result_df:
-            result_output_dir = output_dir / result_key / str(group_key)
-            if not result_output_dir.exists():
-                result_output_dir.mkdir(parents=True, exist_ok=True)
-            tqdm.pandas(
-                desc=f"AoAを計算中: {result_key} = {group_key}",
-                total=len(group_df),
-                leave=False,
-            )
-            group_df.progress_apply(
-                calculate_aoa,
-                axis=1,
-            )
-            tqdm.pandas(
-                desc=f"シミュレーションの結果を集計中: {result_key} = {group_key}",
-                total=len(group_df),
-                leave=False,
-            )
-            group_df = pd.concat(
-                [
-                    group_df,
-                    group_df.progress_apply(
-                        summarize_output_info_df,
-                        axis=1,
-                        output_dir=result_output_dir,
-                    ),
-                ],
-                axis=1,
-            )
+    finished_results = manifest.load_results(simulation_df.index) if resume else {}
+    dispatch_index = simulation_df.index[~simulation_df.index.isin(list(finished_results))]
+    if finished_results:
+        logger.info(f"中断したスイープを再開します: 完了 {len(finished_results)}件, 残り {len(dispatch_index)}件")
 
-            extrema_results = group_df.progress_apply(
-                get_extrema_analysis,
-                axis=1,
+    logger.info("シミュレーションを実行します")
+    num_workers = misc.executor.n_jobs or os.cpu_count() or 1
+    dispatch_groups = _dispatch_groups(simulation_df.loc[dispatch_index], misc, batch_engine, num_workers)
+    if batch_engine is not None:
+        logger.info(f"一括積分する組み合わせをまとめました: {len(dispatch_index)}件, {len(dispatch_groups)}タスク")
+    elif misc.engine_pool and misc.share_flight_prefix:
+        logger.info(
+            f"飛行の前半を共有する組み合わせをまとめました: {len(dispatch_index)}件, {len(dispatch_groups)}タスク"
+        )
+    with telemetry.stage("simulation"):
+        if result_each:
+            member_calls = {
+                index: delayed(manifest.record)(
+                    index,
+                    "analysed",
+                    run_jsb_and_analyze,
+                    simulation_df.loc[index],
+                    output_dir / "raw_result",
+                    analysis_output_dirs[index],
+                    engine_pool=misc.engine_pool,
+                    save_csv=misc.save_raw_csv,
+                    chart=chart,
+                    keep_trajectory=misc.trajectory_store != "none",
+                    result_cache=result_cache,
+                    descent_fast_forward=misc.descent_fast_forward,
+                    output_properties=output_properties,
+                    batch_engine=batch_engine,
+                    flight_path=misc.flight_path,
+                    flight_path_tolerance_m=misc.flight_path_tolerance_m,
+                )
+                for index in dispatch_index
+            }
+        else:
+            member_calls = {
+                index: delayed(manifest.record)(
+                    index,
+                    "simulated",
+                    run_jsb,
+                    simulation_df.loc[index],
+                    output_dir / "raw_result",
+                    engine_pool=misc.engine_pool,
+                    save_csv=misc.save_raw_csv,
+                    result_cache=result_cache,
+                    descent_fast_forward=misc.descent_fast_forward,
+                    output_properties=output_properties,
+                    batch_engine=batch_engine,
+                )
+                for index in dispatch_index
+            }
+        tasks = [
+            delayed(run_with_stages)(
+                run_jsb_group,
+                [member_calls[index] for index in group],
+                [simulation_df.loc[index] for index in group],
+                engine_pool=misc.engine_pool,
+                result_cache=result_cache,
+                descent_fast_forward=misc.descent_fast_forward,
+                output_properties=output_properties,
+                batch_engine=batch_engine,
+                profile_dir=profile_dir,
             )
+            for group in dispatch_groups
+        ]
+        results = executor.run(tasks, desc="シミュレーションを実行中🚀")
+    run_results = []
+    for group_results, worker_stages in results:
+        telemetry.merge_worker_stages(worker_stages)
+        run_results.extend(group_results)
 
-            extrema_df = pd.concat(
-                [df for df in extrema_results if isinstance(df, pd.DataFrame) and not df.empty], ignore_index=True
+    results_df = pd.DataFrame(
+        run_results + list(finished_results.values()),
+        index=[*(index for group in dispatch_groups for index in group), *finished_results],
+    ).reindex(simulation_df.index)
+    engine_start_counts = results_df["engine_start"].value_counts()
+    logger.info(
+        f"シミュレーションが完了しました: ウォームスタート {engine_start_counts.get('warm', 0)}件, "
+        f"コールドスタート {engine_start_counts.get('cold', 0)}件, "
+        f"前半を共有 {engine_start_counts.get('branch', 0)}件, 一括積分 {engine_start_counts.get('batch', 0)}件"
+    )
+    if batch_engine is None and misc.descent_fast_forward and misc.descent_fast_forward_check > 0:
+        check_index = simulation_df.index[: misc.descent_fast_forward_check]
+        with telemetry.stage("descent_fast_forward_check"):
+            check_tasks = [
+                delayed(run_with_stages)(
+                    check_descent_fast_forward,
+                    simulation_df.loc[index],
+                    output_dir / "raw_result",
+                    engine_pool=misc.engine_pool,
+                    result_cache=result_cache,
+                    output_properties=output_properties,
+                    profile_dir=profile_dir,
+                )
+                for index in check_index
+            ]
+            check_results = executor.run(check_tasks, desc="降下の早送りを検証中")
+        landing_errors = [landing_error for landing_error, _ in check_results]
+        for _, worker_stages in check_results:
+            telemetry.merge_worker_stages(worker_stages)
+        max_landing_error = max(landing_errors)
+        logger.info(f"降下の早送りの着地点の差: 最大 {max_landing_error:.2f}m ({len(landing_errors)}件)")
+        if max_landing_error > misc.descent_fast_forward_tolerance_m:
+            logger.warning(
+                f"降下の早送りの着地点の差が許容値 {misc.descent_fast_forward_tolerance_m}m を超えています. "
+                "descent_fast_forward を無効にしてください"
             )
-
-            if chart_output:
-                group_df.progress_apply(
-                    create_time_series_plots,
-                    axis=1,
+    if batch_engine is not None and batch_engine.check > 0:
+        check_index = simulation_df.index[: batch_engine.check]
+        with telemetry.stage("batch_engine_check"):
+            check_tasks = [
+                delayed(run_with_stages)(
+                    check_batch_engine,
+                    simulation_df.loc[index],
+                    output_dir / "raw_result",
+                    batch_engine,
+                    engine_pool=misc.engine_pool,
+                    result_cache=result_cache,
+                    output_properties=output_properties,
+                    profile_dir=profile_dir,
                 )
-
-            logger.info("シミュレーションの結果を保存します")
-            summary_columns = [
-                "max_altitude",
-                "max_speed",
-                "landed_latitude",
-                "landed_longitude",
-                "max_pressure",
-                "launch_clear_speed",
+                for index in check_index
             ]
-            group_df[summary_columns].to_csv(result_output_dir / "summary.csv", index=False)
-            group_df.select_dtypes(include=["number"]).to_csv(result_output_dir / "simulation_params.csv", index=False)
-
-            # Export complete extrema_df with all columns
-            extrema_df.to_csv(
-                result_output_dir / "extrema.csv",
-                index=False,
-                float_format="%.6f",  # Use 6 decimal places for float values
-                encoding="utf-8",  # Ensure proper encoding
+            check_results = executor.run(check_tasks, desc="一括積分エンジンを検証中")
+        landing_errors = [landing_error for landing_error, _ in check_results]
+        for _, worker_stages in check_results:
+            telemetry.merge_worker_stages(worker_stages)
+        max_landing_error = max(landing_errors)
+        logger.info(f"一括積分エンジンとJSBSimの着地点の差: 最大 {max_landing_error:.2f}m ({len(landing_errors)}件)")
+        if max_landing_error > batch_engine.check_tolerance_m:
+            logger.warning(
+                f"一括積分エンジンとJSBSimの着地点の差が許容値 {batch_engine.check_tolerance_m}m を超えています. "
+                "simulation_engine を jsbsim にするか、batch_engine.time_step を小さくしてください"
             )
+    if result_cache is not None:
+        cache_hits = int(results_df["cache_hit"].sum())
+        logger.info(f"結果のキャッシュ: ヒット {cache_hits}件, ミス {len(results_df) - cache_hits}件")
+        evicted = result_cache.evict()
+        if evicted:
+            logger.info(f"キャッシュの上限を超えたため、古い結果を{evicted}件削除しました")
+    simulation_df = pd.concat([simulation_df, results_df], axis=1)
 
-            logger.info("KMLファイルを生成します")
-            for kml_group_key in kml_group_by:
-                kml_generator = KMLGenerator()
-                group_keys = [col for col in group_df.columns if kml_group_key in col]
-                grouped_by_group_key = group_df.groupby(group_keys)
-                kml_generator.generate_grouped_points_polygons(grouped_by_group_key)
-                representation_df = grouped_by_group_key.first()
-                kmz_path = representation_df[("launch", "range_kmz")].iloc[0]
-                if not kmz_path.exists():
-                    continue
+    if misc.trajectory_store != "none":
+        logger.info(f"シミュレーションの出力を保存します: {output_dir / 'trajectories'}")
+        with (
+            telemetry.stage("trajectory_store"),
+            TrajectoryStoreWriter(
+                output_dir / "trajectories", misc.trajectory_store, misc.trajectory_dtype
+            ) as trajectory_store,
+        ):
+            for index, trajectory in results_df["trajectory"].items():
+                trajectory_store.write(index, trajectory)
 
-                kml_output_path = result_output_dir / f"result_{kml_group_key}.kml"
-                kml_generator.save(kml_output_path)
+    if result_each and misc.geofence:
+        # スイープのすべての着地点をまとめて保安域と比べ、summary.csv に加える
+        with telemetry.stage("geofence"):
+            geofence_df = evaluate_landing_geofence(simulation_df, flight_path=misc.geofence_flight_path)
+        simulation_df = pd.concat([simulation_df, geofence_df], axis=1)
 
+    logger.info("シミュレーションの結果を集計します")
+    # グループごとの集計は独立しているので、シミュレーションと同じようにプロセスを並列に使う
+    # 時系列データは集計に不要なので、ワーカーに送らない
+    aggregation_df = simulation_df.drop(columns=["trajectory", "run_metrics"])
+    result_groups = [
+        (group_df, output_dir / result_key / str(group_key))
+        for result_key, group_key, group_df in _iter_result_groups(aggregation_df, result_each)
+    ]
+    with telemetry.stage("aggregation"):
+        group_tasks = [
+            delayed(run_with_stages)(
+                save_group_results, group_df, result_output_dir, kml_group_by, chart, profile_dir=profile_dir
+            )
+            for group_df, result_output_dir in result_groups
+        ]
+        group_results = executor.run(group_tasks, desc="シミュレーションの結果を集計中")
+    for _, worker_stages in group_results:
+        telemetry.merge_worker_stages(worker_stages)
+    logger.info(f"シミュレーションの結果を保存しました: {len(result_groups)}グループ")
+    simulate_additional = partial(
+        _simulate_additional_combinations,
+        template_dir=template_dir,
+        output_dir=output_dir,
+        misc=misc,
+        executor=executor,
+        output_properties=output_properties,
+        result_cache=result_cache,
+        batch_engine=batch_engine,
+        chart=chart,
+        profile_dir=profile_dir,
+    )
+    # 適応的なスイープやサロゲートモデルで追加した組み合わせを含む結果
+    sample_df = simulation_df
+    if misc.adaptive_sampling.enabled:
+        logger.info("保安域の境界付近に組み合わせを追加します")
+        with telemetry.stage("adaptive_sampling"):
+            sample_df = run_adaptive_sampling(
+                sample_df,
+                misc.adaptive_sampling,
+                output_dir,
+                simulate=partial(
+                    simulate_additional,
+                    analysis_output_dir=output_dir / ADAPTIVE_DIR_NAME / "refined",
+                    desc="保安域の境界付近の組み合わせを実行中",
+                ),
+            )
+    if misc.surrogate.enabled:
+        logger.info("粗い格子の結果からサロゲートモデルを作ります")
+        with telemetry.stage("surrogate"):
+            run_surrogate(
+                sample_df,
+                misc.surrogate,
+                output_dir,
+                simulate=partial(
+                    simulate_additional,
+                    analysis_output_dir=output_dir / SURROGATE_DIR_NAME / "refined",
+                    desc="サロゲートモデルの標本点を追加中",
+                ),
+            )
+    manifest.write_summary(simulation_df.index)
+
+    report_path = telemetry.write_report(
+        output_dir / TELEMETRY_FILE_NAME,
+        {str(index): run_metrics for index, run_metrics in results_df["run_metrics"].items()},
+        extra={"config_file": str(config_file_path), "num_combinations": len(simulation_df)},
+    )
+    logger.info(f"処理時間の計測結果を保存しました: {report_path}")
+    if profile_dir is not None:
+        profile_path = merge_profiles(profile_dir, output_dir / PROFILE_FILE_NAME)
+        logger.info(f"ワーカーのプロファイルをまとめました: {profile_path}")
 
 if __name__ == "__main__":
     # コマンドライン引数を取得
@@ -187,4 +569,4 @@ if __name__ == "__main__":
     output_dir = args.output_dir
     template_dir = args.template_dir
     chart_output = args.chart_output
-    main(config_file_path, output_dir, template_dir, chart_output)
+    main(config_file_path, output_dir, template_dir, chart_output, args.profile, args.resume)
@@ -0,0 +1,729 @@
+"""多数の機体をNumPyの配列でまとめて積分する一括積分エンジン.
+
+JSBSimは1つのプロセスで1機ずつ積分するため、ステップごとのオーバーヘッドが組み合わせの数だけかかる.
+このエンジンはN機の状態を配列として持ち、すべての機体を同じ時刻で同時に(lockstepで)積分する.
+
+機体モデルは pq_rocket.xml.j2 と同じ: CD0(迎角)とCDmach(マッハ数)のテーブル、揚力・横力・ピッチ・ヨー・ロールの係数、
+推力と燃料の残量のテーブル、パラシュートの抗力、燃料の消費による質量・重心・慣性モーメントの変化.
+イベント(離床、ランチャー離脱、燃焼終了、頂点、パラシュート展開、着地、上空風)は pq_simulation.xml.j2 と同じ条件で、
+機体ごとのマスクとして扱う. 出力はJSBSimと同じ列(output_properties.OUTPUT_PROPERTIES)の Trajectory なので、
+サマリーや極値分析はJSBSimの場合と同じものを使える.
+
+JSBSimとの違い:
+- 地球は射点の接平面(北・東・下)として扱う. 重力は正規重力で、地球の自転はコリオリ力だけを考慮する.
+- 大気は1976年米国標準大気. 積分は4次のルンゲ・クッタ法で、時間刻みは全機体で共通.
+- 地面との接触(ground_reactions)は扱わない. 着地の判定はJSBSimと同じ高度で行う.
+"""
+
+import logging
+import time
+from typing import Any
+
+import numpy as np
+import numpy.typing as npt
+
+from trajecsim.jsbsim_support.engine_pool import (
+    APOGEE_V_DOWN_FPS,
+    BURNOUT_CONTENTS_LBS,
+    DESCENT_PHASE,
+    INITIAL_AGL_M,
+    LANDED_AGL_FT,
+    METER_TO_FEET,
+    PARACHUTE_NOT_DEPLOYED_TIME,
+    get_output_rates,
+)
+from trajecsim.jsbsim_support.generate_param_xml import derive_simulation_parameters
+from trajecsim.jsbsim_support.output_properties import ANALYSIS_OUTPUTS, OUTPUT_PROPERTIES
+from trajecsim.jsbsim_support.schemas.batch_engine import BatchEngineSchema
+from trajecsim.jsbsim_support.trajectory import Trajectory
+from trajecsim.util.geodesy import geocentric_to_geodetic_latitude, geodetic_to_geocentric_latitude, offset_to_degrees
+
+LOGGER = logging.getLogger(__name__)
+
+# 一括積分で実行した (エンジンプールの warm/cold/branch に対応する起動種別)
+BATCH_START = "batch"
+
+FEET_TO_METER = 0.3048
+KG_TO_LBS = 2.20462
+# pq_rocket.xml.j2 が CD0 テーブルの迎角に掛ける係数. テーブルの値は度として変換される
+CD0_TABLE_ANGLE_FACTOR = 0.0174533
+# 機体座標系でのパラシュートの取り付け位置[m] (pq_rocket.xml.j2 の parachute の location)
+PARACHUTE_LOCATION = (10.0, 0.0, 0.0)
+# 迎角と横滑り角を計算する対気速度の下限 (JSBSimの FGAuxiliary と同じ. 1e-6 ft^2/s^2 と 0.001 ft/s)
+ALPHA_MIN_SPEED_SQ = 1e-6 * FEET_TO_METER**2
+BETA_MIN_SPEED = 0.001 * FEET_TO_METER
+
+# WGS84の正規重力(Somigliana)と、高度による減少[1/s^2]
+NORMAL_GRAVITY_EQUATOR = 9.7803253359
+NORMAL_GRAVITY_K = 0.00193185265241
+WGS84_E_SQ = 0.00669437999013
+FREE_AIR_GRADIENT = 3.086e-6
+EARTH_ROTATION_RATE = 7.292115e-5
+
+# 1976年米国標準大気. 層の下端のジオポテンシャル高度[m]と温度減率[K/m]
+STANDARD_GRAVITY = 9.80665
+GAS_CONSTANT_AIR = 287.05287
+HEAT_CAPACITY_RATIO = 1.4
+GEOPOTENTIAL_EARTH_RADIUS = 6356766.0
+_LAYER_ALTITUDE = np.array([0.0, 11000.0, 20000.0, 32000.0, 47000.0, 51000.0, 71000.0])
+_LAYER_LAPSE = np.array([-0.0065, 0.0, 0.001, 0.0028, 0.0, -0.0028, -0.002])
+
+
+def _layer_bases() -> tuple[npt.NDArray[np.float64], npt.NDArray[np.float64]]:
+    """標準大気の層の下端の温度[K]と圧力[Pa]."""
+    temperatures = [288.15]
+    pressures = [101325.0]
+    for i in range(len(_LAYER_ALTITUDE) - 1):
+        thickness = _LAYER_ALTITUDE[i + 1] - _LAYER_ALTITUDE[i]
+        top_temperature = temperatures[i] + _LAYER_LAPSE[i] * thickness
+        if _LAYER_LAPSE[i] == 0:
+            ratio = np.exp(-STANDARD_GRAVITY * thickness / (GAS_CONSTANT_AIR * temperatures[i]))
+        else:
+            ratio = (temperatures[i] / top_temperature) ** (STANDARD_GRAVITY / (GAS_CONSTANT_AIR * _LAYER_LAPSE[i]))
+        temperatures.append(top_temperature)
+        pressures.append(pressures[i] * ratio)
+    return np.array(temperatures), np.array(pressures)
+
+
+_LAYER_TEMPERATURE, _LAYER_PRESSURE = _layer_bases()
+
+
+def standard_atmosphere(altitude_m: npt.NDArray[np.float64]) -> tuple[npt.NDArray[np.float64], npt.NDArray[np.float64]]:
+    """1976年米国標準大気(JSBSimの標準大気と同じモデル)の密度と音速.
+
+    Args:
+        altitude_m (npt.NDArray[np.float64]): 海抜高度[m].
+
+    Returns:
+        tuple[npt.NDArray[np.float64], npt.NDArray[np.float64]]: 密度[kg/m^3]と音速[m/s].
+    """
+    geopotential = GEOPOTENTIAL_EARTH_RADIUS * altitude_m / (GEOPOTENTIAL_EARTH_RADIUS + altitude_m)
+    layer = np.clip(np.searchsorted(_LAYER_ALTITUDE, geopotential, side="right") - 1, 0, len(_LAYER_ALTITUDE) - 1)
+    base_temperature = _LAYER_TEMPERATURE[layer]
+    lapse = _LAYER_LAPSE[layer]
+    height = geopotential - _LAYER_ALTITUDE[layer]
+    temperature = base_temperature + lapse * height
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        pressure = _LAYER_PRESSURE[layer] * np.where(
+            lapse == 0,
+            np.exp(-STANDARD_GRAVITY * height / (GAS_CONSTANT_AIR * base_temperature)),
+            (base_temperature / temperature) ** (STANDARD_GRAVITY / (GAS_CONSTANT_AIR * lapse)),
+        )
+    density = pressure / (GAS_CONSTANT_AIR * temperature)
+    return density, np.sqrt(HEAT_CAPACITY_RATIO * GAS_CONSTANT_AIR * temperature)
+
+
+class BatchTables:
+    """機体ごとに異なる1次元のテーブルをまとめて線形補間する. 範囲外は端の値を使う (JSBSimのテーブルと同じ).
+
+    テーブルごとに独立変数をずらして1つの昇順の配列につなげ、全機体の区間を1回の searchsorted で探す.
+    """
+
+    def __init__(self, tables: list[Any]) -> None:
+        """初期化
+
+        Args:
+            tables (list[Any]): 機体ごとのテーブル. 各行は (独立変数, 値, ...). テンプレートと同じく独立変数で並べ替え、
+                同じ独立変数の行は最初のものを使う.
+        """
+        unique_tables: dict[bytes, int] = {}
+        arrays: list[npt.NDArray[np.float64]] = []
+        codes = []
+        for table in tables:
+            array = np.asarray(table, dtype=float)
+            array = array[np.argsort(array[:, 0], kind="stable")]
+            array = array[np.unique(array[:, 0], return_index=True)[1]]
+            key = array.tobytes() + bytes(array.shape[1])
+            if key not in unique_tables:
+                unique_tables[key] = len(arrays)
+                arrays.append(array)
+            codes.append(unique_tables[key])
+        self.codes = np.array(codes, dtype=np.intp)
+        # 最後の行を繰り返して同じ行数にする (区間を探すために2行以上にする)
+        self._length = max(2, *(len(array) for array in arrays))
+        padded = np.stack(
+            [np.concatenate([array, np.repeat(array[-1:], self._length - len(array), axis=0)]) for array in arrays]
+        )
+        self._start = padded[:, 0, 0]
+        self._end = padded[:, -1, 0]
+        stride = float(np.max(self._end - self._start)) + 1.0
+        self._offset = np.arange(len(arrays)) * stride - self._start
+        self._x = (padded[:, :, 0] + self._offset[:, np.newaxis]).ravel()
+        self._values = padded[:, :, 1:].reshape(-1, padded.shape[2] - 1).T
+
+    def __call__(self, value: npt.NDArray[np.float64] | float, codes: npt.NDArray[np.intp]) -> npt.NDArray[np.float64]:
+        """補間する.
+
+        Args:
+            value (npt.NDArray[np.float64] | float): 機体ごとの独立変数.
+            codes (npt.NDArray[np.intp]): 機体ごとのテーブルの番号 (codes の要素).
+
+        Returns:
+            npt.NDArray[np.float64]: 値の列ごと x 機体ごとの補間した値.
+        """
+        x = np.minimum(np.maximum(value, self._start[codes]), self._end[codes]) + self._offset[codes]
+        row_start = codes * self._length
+        index = np.searchsorted(self._x, x, side="right") - 1
+        index = np.minimum(np.maximum(index, row_start), row_start + self._length - 2)
+        x0 = self._x[index]
+        x1 = self._x[index + 1]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            weight = np.where(x1 > x0, (x - x0) / (x1 - x0), 0.0)
+        v0 = self._values[:, index]
+        return v0 + weight * (self._values[:, index + 1] - v0)
+
+
+def _structural_to_body(offset: npt.NDArray[np.float64]) -> npt.NDArray[np.float64]:
+    """機体の構造座標系(機首から後方がx)の位置の差を、機体座標系(前方がx)に変換する."""
+    return np.stack([-offset[0], offset[1], -offset[2]])
+
+
+def _point_mass_inertia(mass: npt.NDArray[np.float64], offset: npt.NDArray[np.float64]) -> npt.NDArray[np.float64]:
+    """重心から offset (機体座標系) の位置にある質点の、重心まわりの慣性テンソル (3 x 3 x 機体)."""
+    inertia = -mass * offset[:, np.newaxis] * offset[np.newaxis, :]
+    diagonal = mass * np.sum(offset**2, axis=0)
+    for i in range(3):
+        inertia[i, i] += diagonal
+    return inertia
+
+
+def _cross(a: npt.NDArray[np.float64], b: npt.NDArray[np.float64]) -> npt.NDArray[np.float64]:
+    """3 x 機体 のベクトルの外積 (np.cross より呼び出しのオーバーヘッドが小さい)."""
+    return np.array([a[1] * b[2] - a[2] * b[1], a[2] * b[0] - a[0] * b[2], a[0] * b[1] - a[1] * b[0]])
+
+
+def _inverse_3x3(matrix: npt.NDArray[np.float64]) -> npt.NDArray[np.float64]:
+    """3 x 3 x 機体 の行列の逆行列を余因子から計算する."""
+    cofactor = np.empty_like(matrix)
+    for i in range(3):
+        for j in range(3):
+            rows = [k for k in range(3) if k != j]
+            columns = [k for k in range(3) if k != i]
+            cofactor[i, j] = (-1) ** (i + j) * (
+                matrix[rows[0], columns[0]] * matrix[rows[1], columns[1]]
+                - matrix[rows[0], columns[1]] * matrix[rows[1], columns[0]]
+            )
+    determinant = np.sum(matrix[0] * cofactor[:, 0], axis=0)
+    return cofactor / determinant
+
+
+def _quaternion_from_euler(
+    roll: npt.NDArray[np.float64], pitch: npt.NDArray[np.float64], yaw: npt.NDArray[np.float64]
+) -> npt.NDArray[np.float64]:
+    """オイラー角[rad]から、機体座標系から北・東・下への回転を表すクォータニオンを作る."""
+    cr, sr = np.cos(roll / 2), np.sin(roll / 2)
+    cp, sp = np.cos(pitch / 2), np.sin(pitch / 2)
+    cy, sy = np.cos(yaw / 2), np.sin(yaw / 2)
+    return np.stack(
+        [
+            cr * cp * cy + sr * sp * sy,
+            sr * cp * cy - cr * sp * sy,
+            cr * sp * cy + sr * cp * sy,
+            cr * cp * sy - sr * sp * cy,
+        ]
+    )
+
+
+def _body_to_ned(quaternion: npt.NDArray[np.float64]) -> npt.NDArray[np.float64]:
+    """クォータニオンから、機体座標系から北・東・下への回転行列 (3 x 3 x 機体) を作る."""
+    q0, q1, q2, q3 = quaternion
+    return np.array(
+        [
+            [1 - 2 * (q2 * q2 + q3 * q3), 2 * (q1 * q2 - q0 * q3), 2 * (q1 * q3 + q0 * q2)],
+            [2 * (q1 * q2 + q0 * q3), 1 - 2 * (q1 * q1 + q3 * q3), 2 * (q2 * q3 - q0 * q1)],
+            [2 * (q1 * q3 - q0 * q2), 2 * (q2 * q3 + q0 * q1), 1 - 2 * (q1 * q1 + q2 * q2)],
+        ]
+    )
+
+
+class _BatchFlight:
+    """N機をまとめて積分する. 配列の最後の軸が機体で、着地した機体は配列から取り除く."""
+
+    def __init__(
+        self,
+        members: list[tuple[str, dict[str, Any], dict[str, Any], dict[str, Any]]],
+        settings: BatchEngineSchema,
+        output_properties: list[str],
+    ) -> None:
+        launch_params = [member[1] for member in members]
+        rocket_params = [member[2] for member in members]
+        simulation_params = [member[3] for member in members]
+        self.settings = settings
+        self.output_properties = output_properties
+
+        def column(params: list[dict[str, Any]], key: str) -> npt.NDArray[np.float64]:
+            return np.array([param[key] for param in params], dtype=float)
+
+        def vector(params: list[dict[str, Any]], prefix: str, suffix: str = "") -> npt.NDArray[np.float64]:
+            return np.stack([column(params, f"{prefix}{axis}{suffix}") for axis in ("x", "y", "z")])
+
+        self.tables = {
+            "thrust": BatchTables([rocket["thrust_table"] for rocket in rocket_params]),
+            "fuel_remaining": BatchTables([rocket["fuel_remaining_table"] for rocket in rocket_params]),
+            "cd0": BatchTables(
+                [np.asarray(rocket["cd0_table"], dtype=float) * [CD0_TABLE_ANGLE_FACTOR, 1] for rocket in rocket_params]
+            ),
+            "cdmach": BatchTables([rocket["cdmach_table"] for rocket in rocket_params]),
+            # 風テーブルの列は (高度[m], 風速[m/s], 風向[deg])
+            "wind": BatchTables([simulation["winds_table"] for simulation in simulation_params]),
+        }
+        # 慣性乗積はJSBSimと同じく符号を反転して慣性テンソルに入れる
+        ixx, iyy, izz, ixy, ixz, iyz = (
+            column(rocket_params, f"inertia_{axes}") for axes in ("xx", "yy", "zz", "xy", "xz", "yz")
+        )
+        inertia = np.array([[ixx, -ixy, -ixz], [-ixy, iyy, -iyz], [-ixz, -iyz, izz]])
+        elevation = column(launch_params, "elevation")
+        launch_latitude = geocentric_to_geodetic_latitude(column(launch_params, "latitude"), elevation + INITIAL_AGL_M)
+        dense_rates, descent_rates = zip(
+            *(get_output_rates(simulation) for simulation in simulation_params), strict=True
+        )
+        num_rockets = len(members)
+        self.arrays: dict[str, npt.NDArray[Any]] = {
+            "index": np.arange(num_rockets),
+            # 機体: 空虚質量と重心・慣性テンソル、酸化剤タンクと燃料のグレイン (JSBSimのタンク0と1)
+            "empty_mass": column(rocket_params, "dry_weight") - column(rocket_params, "fuel_contents"),
+            "empty_cg": vector(rocket_params, "cg_"),
+            "empty_inertia": inertia,
+            "oxidizer_mass": column(rocket_params, "tank_contents"),
+            "oxidizer_capacity": column(rocket_params, "tank_capacity"),
+            "oxidizer_location": vector(rocket_params, "tank_"),
+            "oxidizer_drain": vector(rocket_params, "tank_drain_"),
+            "oxidizer_radius": column(rocket_params, "tank_radius"),
+            # 燃料の消費量はテーブルの残量に (fuel_contents - fuel_after_burn) を掛けたもの (pq_rocket.xml.j2 と同じ)
+            "grain_mass": column(rocket_params, "fuel_contents") - column(rocket_params, "fuel_after_burn"),
+            "grain_capacity": column(rocket_params, "fuel_capacity"),
+            "grain_location": vector(rocket_params, "fuel_"),
+            "grain_drain": vector(rocket_params, "fuel_drain_"),
+            "grain_radius": column(rocket_params, "fuel_radius"),
+            "grain_length": column(rocket_params, "fuel_length"),
+            "grain_density": column(rocket_params, "fuel_density") * 1000,
+            "thruster": vector(rocket_params, "thruster_"),
+            "aero_rp": vector(rocket_params, "cp_"),
+            # 空力係数
+            "area": column(rocket_params, "projected_frontal_area"),
+            "span": column(rocket_params, "wing_span"),
+            "chord": column(rocket_params, "wing_chord"),
+            "diameter": column(rocket_params, "diameter"),
+            "lift_alpha": column(rocket_params, "lift_coefficient_alpha"),
+            "side_beta": column(rocket_params, "side_coefficient_beta"),
+            "roll_damping": column(rocket_params, "roll_damping_coefficient"),
+            "pitch_alpha": column(rocket_params, "pitch_coefficient_alpha"),
+            "pitch_damping": column(rocket_params, "pitch_damping_coefficient"),
+            "yaw_beta": column(rocket_params, "yaw_coefficient_beta"),
+            "yaw_damping": column(rocket_params, "yaw_damping_coefficient"),
+            "parachute_area": column(simulation_params, "parachute_area"),
+            "parachute_drag": column(rocket_params, "parachute_drag_coefficient"),
+            "deploy_rate": 1 / (column(simulation_params, "parachute_full_deploy_time") + 0.00000001),
+            "deploy_delay": column(simulation_params, "parachute_deploy_delay"),
+            # 射場とシミュレーションの設定
+            "elevation": elevation,
+            "launch_latitude": launch_latitude,
+            "launch_longitude": column(launch_params, "longitude"),
+            "launcher_height_ft": column(simulation_params, "launcher_height") * METER_TO_FEET,
+            "earth_rate": EARTH_ROTATION_RATE
+            * np.stack(
+                [np.cos(np.radians(launch_latitude)), np.zeros(num_rockets), -np.sin(np.radians(launch_latitude))]
+            ),
+            "gravity": NORMAL_GRAVITY_EQUATOR
+            * (1 + NORMAL_GRAVITY_K * np.sin(np.radians(launch_latitude)) ** 2)
+            / np.sqrt(1 - WGS84_E_SQ * np.sin(np.radians(launch_latitude)) ** 2),
+            "flight_duration": column(simulation_params, "flight_duration"),
+            # JSBSimでは simulation.time_step の10ステップ目の時刻に達するステップで forces/hold-down が外れる
+            "release_time": column(simulation_params, "time_step") * 9,
+            "dense_interval": 1 / np.array(dense_rates, dtype=float),
+            "descent_interval": 1 / np.array(descent_rates, dtype=float),
+            **{f"{name}_table": table.codes for name, table in self.tables.items()},
+            # 状態: 射点からの位置(北・東・下)[m], 対地速度[m/s], 姿勢のクォータニオン, 角速度[rad/s]
+            "state": np.concatenate(
+                [
+                    np.zeros((6, num_rockets)),
+                    _quaternion_from_euler(
+                        np.radians(column(launch_params, "roll")),
+                        np.radians(column(launch_params, "pitch")),
+                        np.radians(column(launch_params, "yaw")),
+                    ),
+                    np.zeros((3, num_rockets)),
+                ]
+            ),
+            "phase": np.zeros(num_rockets, dtype=int),
+            "apogee_reached": np.zeros(num_rockets, dtype=bool),
+            "deploy_time": np.full(num_rockets, PARACHUTE_NOT_DEPLOYED_TIME),
+            "wind": np.zeros((3, num_rockets)),
+            "next_output_time": 1 / np.array(dense_rates, dtype=float),
+            "steps": np.zeros(num_rockets, dtype=int),
+        }
+
+    def _compact(self, keep: npt.NDArray[np.bool_]) -> None:
+        """keep の機体だけを残す."""
+        self.arrays = {name: array[..., keep] for name, array in self.arrays.items()}
+
+    def _mass_properties(self, sim_time: float) -> dict[str, npt.NDArray[np.float64]]:
+        """時刻 sim_time の質量、重心、慣性テンソルとその逆行列、酸化剤の残量[kg]を計算する."""
+        a = self.arrays
+        fuel_remaining = np.clip(self.tables["fuel_remaining"](sim_time, a["fuel_remaining_table"])[0], 0.0, 1.0)
+        oxidizer = fuel_remaining * a["oxidizer_mass"]
+        grain = fuel_remaining * a["grain_mass"]
+        # タンクの重心は残量に応じて排出口との間を移動する (JSBSimの FGTank と同じ)
+        oxidizer_location = a["oxidizer_drain"] + oxidizer / a["oxidizer_capacity"] * (
+            a["oxidizer_location"] - a["oxidizer_drain"]
+        )
+        grain_location = a["grain_drain"] + grain / a["grain_capacity"] * (a["grain_location"] - a["grain_drain"])
+        mass = a["empty_mass"] + oxidizer + grain
+        cg = (a["empty_mass"] * a["empty_cg"] + oxidizer * oxidizer_location + grain * grain_location) / mass
+        inertia = (
+            a["empty_inertia"]
+            + _point_mass_inertia(a["empty_mass"], _structural_to_body(a["empty_cg"] - cg))
+            + _point_mass_inertia(oxidizer, _structural_to_body(oxidizer_location - cg))
+            + _point_mass_inertia(grain, _structural_to_body(grain_location - cg))
+        )
+        # 酸化剤は球、燃料のグレインは中空の円柱として、それ自体の慣性モーメントを加える
+        oxidizer_inertia = 0.4 * oxidizer * a["oxidizer_radius"] ** 2
+        with np.errstate(divide="ignore", invalid="ignore"):
+            grain_volume_per_length = np.nan_to_num(grain / (a["grain_density"] * np.pi * a["grain_length"]))
+        radius_sum = 2 * a["grain_radius"] ** 2 - np.minimum(grain_volume_per_length, a["grain_radius"] ** 2)
+        inertia[0, 0] += oxidizer_inertia + 0.5 * grain * radius_sum
+        lateral = oxidizer_inertia + grain * (3 * radius_sum + a["grain_length"] ** 2) / 12
+        inertia[1, 1] += lateral
+        inertia[2, 2] += lateral
+        return {
+            "mass": mass,
+            "cg": cg,
+            "inertia": inertia,
+            "inertia_inverse": _inverse_3x3(inertia),
+            "oxidizer": oxidizer,
+            # 重心から見た空力中心、パラシュート、推力の位置 (機体座標系)
+            "aero_arm": _structural_to_body(a["aero_rp"] - cg),
+            "parachute_arm": _structural_to_body(np.array(PARACHUTE_LOCATION)[:, np.newaxis] - cg),
+            "thruster_arm": _structural_to_body(a["thruster"] - cg),
+        }
+
+    def _derivatives(
+        self,
+        state: npt.NDArray[np.float64],
+        sim_time: float,
+        masses: dict[str, npt.NDArray[np.float64]],
+        outputs: bool = False,
+    ) -> tuple[npt.NDArray[np.float64], dict[str, npt.NDArray[np.float64]]]:
+        """状態の時間微分を計算する. outputs がTrueの場合は出力するプロパティの値も返す."""
+        a = self.arrays
+        velocity = state[3:6]
+        quaternion = state[6:10]
+        rate = state[10:13]
+        body_to_ned = _body_to_ned(quaternion)
+        u, v, w = np.einsum("jin,jn->in", body_to_ned, velocity - a["wind"])
+        uw_sq = u * u + w * w
+        airspeed = np.sqrt(uw_sq + v * v)
+        alpha = np.where(uw_sq >= ALPHA_MIN_SPEED_SQ, np.arctan2(w, u), 0.0)
+        beta = np.where(airspeed > BETA_MIN_SPEED, np.arctan2(v, np.sqrt(uw_sq)), 0.0)
+        altitude = a["elevation"] + INITIAL_AGL_M - state[2]
+        density, sound_speed = standard_atmosphere(altitude)
+        qbar = 0.5 * density * airspeed**2
+        mach = airspeed / sound_speed
+
+        # パラシュートの展開度(fcs/parachute_reef_pos_norm)と、それに応じて小さくなる機体の代表面積(metrics/Sw-sqft)
+        deploy = a["deploy_rate"] * (sim_time - a["deploy_time"])
+        reef = np.minimum(np.maximum(deploy, 0.0), 1.0)
+        qbar_area = qbar * a["area"] * (1 - reef)
+        drag_coefficient = (
+            self.tables["cd0"](alpha, a["cd0_table"])[0] + self.tables["cdmach"](mach, a["cdmach_table"])[0]
+        )
+        drag = qbar_area * drag_coefficient
+        side = qbar_area * a["side_beta"] * beta
+        lift = qbar_area * a["lift_alpha"] * alpha
+        parachute_drag = qbar * a["parachute_area"] * reef * a["parachute_drag"]
+
+        # 風軸の力 (-抗力, 横力, -揚力) を機体軸に変換する (JSBSimの Tw2b)
+        ca, sa, cb, sb = np.cos(alpha), np.sin(alpha), np.cos(beta), np.sin(beta)
+        aero_force = np.array(
+            [
+                -ca * cb * drag - ca * sb * side + sa * lift,
+                -sb * drag + cb * side,
+                -sa * cb * drag - sa * sb * side - ca * lift,
+            ]
+        )
+        parachute_force = -parachute_drag * np.array([ca * cb, sb, sa * cb])
+        thrust = np.maximum(self.tables["thrust"](sim_time, a["thrust_table"])[0], 0.0)
+        force = aero_force + parachute_force
+        force[0] += thrust
+
+        p, q, r = rate
+        with np.errstate(divide="ignore", invalid="ignore"):
+            half_inverse_speed = np.where(airspeed > 0, 0.5 / airspeed, 0.0)
+        aero_moment = np.array(
+            [
+                # ロールの減衰は直径[m]をそのままフィートとして掛けている (pq_rocket.xml.j2 と同じ値にする)
+                qbar * a["area"] * a["diameter"] * FEET_TO_METER * p * a["roll_damping"],
+                qbar_area
+                * a["chord"]
+                * (a["pitch_alpha"] * alpha + a["pitch_damping"] * a["chord"] * half_inverse_speed * q),
+                qbar_area * a["span"] * (a["yaw_beta"] * beta + a["yaw_damping"] * a["span"] * half_inverse_speed * r),
+            ]
+        )
+        thruster_arm = masses["thruster_arm"]
+        moment = (
+            aero_moment
+            + _cross(masses["aero_arm"], aero_force)
+            + _cross(masses["parachute_arm"], parachute_force)
+        )
+        # 推力は機体軸のx方向
+        moment[1] += thruster_arm[2] * thrust
+        moment[2] -= thruster_arm[1] * thrust
+        angular_momentum = np.einsum("ijn,jn->in", masses["inertia"], rate)
+        rate_dot = np.einsum("ijn,jn->in", masses["inertia_inverse"], moment - _cross(rate, angular_momentum))
+        gravity = a["gravity"] - FREE_AIR_GRADIENT * altitude
+        velocity_dot = np.einsum("ijn,jn->in", body_to_ned, force / masses["mass"])
+        velocity_dot[2] += gravity
+        velocity_dot -= 2 * _cross(a["earth_rate"], velocity)
+        # ランチャー上で固定されている間(forces/hold-down)は動かない
+        released = sim_time >= a["release_time"]
+        velocity_dot *= released
+        rate_dot *= released
+
+        q0, q1, q2, q3 = quaternion
+        quaternion_dot = 0.5 * np.array(
+            [
+                -q1 * p - q2 * q - q3 * r,
+                q0 * p + q2 * r - q3 * q,
+                q0 * q + q3 * p - q1 * r,
+                q0 * r + q1 * q - q2 * p,
+            ]
+        )
+        derivatives = np.concatenate([velocity, velocity_dot, quaternion_dot, rate_dot])
+        if not outputs:
+            return derivatives, {}
+
+        # 機体軸の加速度 (accelerations/udot-ft_sec2): 比推力と重力の機体軸成分から、回転による見かけの項を引く
+        ground_velocity = np.einsum("jin,jn->in", body_to_ned, velocity)
+        udot = (
+            force[0] / masses["mass"]
+            + body_to_ned[2, 0] * gravity
+            - (q * ground_velocity[2] - r * ground_velocity[1])
+        ) * released
+        lat_diff, lon_diff = offset_to_degrees(a["launch_latitude"], state[0], state[1])
+        values = {
+            "Latitude": geodetic_to_geocentric_latitude(a["launch_latitude"] + lat_diff, altitude),
+            "Longitude": a["launch_longitude"] + lon_diff,
+            "Altitude": altitude,
+            "Angle of Attack": alpha,
+            "Angle of Sideslip": beta,
+            "Acceleration": udot,
+            "Thrust": thrust,
+            "True Velocity": airspeed,
+            "Ground Velocity": np.hypot(velocity[0], velocity[1]),
+            # Pitch と Roll の列は attitude/phi-rad と attitude/theta-rad (output_properties と同じ)
+            "Pitch": np.degrees(np.arctan2(body_to_ned[2, 1], body_to_ned[2, 2])),
+            "Roll": np.degrees(-np.arcsin(np.clip(body_to_ned[2, 0], -1.0, 1.0))),
+            "Yaw": np.degrees(np.arctan2(body_to_ned[1, 0], body_to_ned[0, 0])) % 360.0,
+            "Dynamic Pressure": qbar,
+            "parachute_deploy_gain": reef,
+            "Mach": mach,
+            "Mass": masses["mass"],
+            "CG X": masses["cg"][0],
+            "Roll Rate": np.degrees(p),
+            "Pitch Rate": np.degrees(q),
+            "Yaw Rate": np.degrees(r),
+            "Descent Rate": velocity[2],
+            "Air Density": density,
+        }
+        return derivatives, values
+
+    def _step(self, sim_time: float, dt: float, masses: dict[str, npt.NDArray[np.float64]]) -> None:
+        """4次のルンゲ・クッタ法で1ステップ積分する. 質量と風はステップの間は一定とする (JSBSimと同じ)."""
+        state = self.arrays["state"]
+        k1 = self._derivatives(state, sim_time, masses)[0]
+        k2 = self._derivatives(state + dt / 2 * k1, sim_time + dt / 2, masses)[0]
+        k3 = self._derivatives(state + dt / 2 * k2, sim_time + dt / 2, masses)[0]
+        k4 = self._derivatives(state + dt * k3, sim_time + dt, masses)[0]
+        state = state + dt / 6 * (k1 + 2 * k2 + 2 * k3 + k4)
+        state[6:10] /= np.linalg.norm(state[6:10], axis=0)
+        self.arrays["state"] = state
+
+    def run(self) -> list[tuple[Trajectory, int]]:
+        """全機体が着地するか、飛行時間(flight_duration)を超えるまで積分する.
+
+        Returns:
+            list[tuple[Trajectory, int]]: 機体ごとの出力と積分のステップ数. members と同じ順.
+        """
+        num_rockets = len(self.arrays["index"])
+        steps = np.zeros(num_rockets, dtype=int)
+        # 出力した時刻の機体と行. 最後に機体ごとに分ける
+        output_blocks: list[tuple[npt.NDArray[Any], npt.NDArray[np.float64]]] = []
+        sim_time = 0.0
+        due: npt.NDArray[np.bool_] = np.ones(num_rockets, dtype=bool)
+        finishing = np.zeros(num_rockets, dtype=bool)
+        while True:
+            a = self.arrays
+            # 終了する機体は、終了時点の状態を出力してから取り除く (engine_pool.append_final_state と同じ)
+            finishing |= sim_time > a["flight_duration"]
+            record = due | finishing
+            if record.any():
+                _, values = self._derivatives(a["state"], sim_time, self._mass_properties(sim_time), outputs=True)
+                columns = [values[name][record] for name in self.output_properties]
+                rows = np.column_stack([np.full(np.count_nonzero(record), sim_time), *columns])
+                output_blocks.append((a["index"][record], rows))
+            if finishing.any():
+                steps[a["index"][finishing]] = a["steps"][finishing]
+                self._compact(~finishing)
+                a = self.arrays
+                if not len(a["index"]):
+                    break
+
+            # pq_simulation.xml.j2 のイベント. 前のステップの状態から判定する
+            masses = self._mass_properties(sim_time)
+            h_agl_ft = (INITIAL_AGL_M - a["state"][2]) * METER_TO_FEET
+            phase = a["phase"]
+            phase[(phase == 0) & (h_agl_ft > a["launcher_height_ft"])] = 1
+            phase[(phase == 1) & (masses["oxidizer"] * KG_TO_LBS < BURNOUT_CONTENTS_LBS)] = 2
+            reef = a["deploy_rate"] * (sim_time - a["deploy_time"])
+            phase[(phase == 2) & (reef >= 1)] = DESCENT_PHASE
+            # 着地の直前は time_step に戻し、着地の判定の後の1ステップで地面の下まで進みすぎないようにする
+            descent_step = self.settings.descent_time_step
+            approaching = h_agl_ft < 2 * descent_step * np.maximum(a["state"][5], 0.0) * METER_TO_FEET
+            dt = descent_step if np.all(phase >= DESCENT_PHASE) and not approaching.any() else self.settings.time_step
+            next_time = sim_time + dt
+            apogee = ~a["apogee_reached"] & (a["state"][5] * METER_TO_FEET > APOGEE_V_DOWN_FPS)
+            a["deploy_time"] = np.where(apogee, next_time + a["deploy_delay"], a["deploy_time"])
+            a["apogee_reached"] |= apogee
+            landed = h_agl_ft <= LANDED_AGL_FT
+            # ランチャーより上でだけ風を更新する. 風向は風が吹いていく方位 (JSBSimの atmosphere/psiw-rad)
+            aloft = h_agl_ft > a["launcher_height_ft"]
+            if aloft.any():
+                wind_speed, wind_dir = self.tables["wind"](h_agl_ft / METER_TO_FEET, a["wind_table"])
+                wind_dir = np.radians(wind_dir)
+                wind = np.stack([wind_speed * np.cos(wind_dir), wind_speed * np.sin(wind_dir), np.zeros_like(wind_dir)])
+                a["wind"] = np.where(aloft, wind, a["wind"])
+
+            self._step(sim_time, dt, masses)
+            a["steps"] += 1
+            sim_time = next_time
+            # 時間刻みが変わっても出力の間隔は一定にする (engine_pool と同じ)
+            due = sim_time >= a["next_output_time"] - dt / 2
+            interval = np.where(phase >= DESCENT_PHASE, a["descent_interval"], a["dense_interval"])
+            skipped = np.maximum(np.ceil((sim_time + dt / 2 - a["next_output_time"]) / interval), 0)
+            a["next_output_time"] = np.where(due, a["next_output_time"] + skipped * interval, a["next_output_time"])
+            finishing = landed
+
+        indices = np.concatenate([index for index, _ in output_blocks])
+        rows = np.concatenate([block for _, block in output_blocks])
+        order = np.argsort(indices, kind="stable")
+        splits = np.cumsum(np.bincount(indices, minlength=num_rockets))[:-1]
+        columns = ["Time", *self.output_properties]
+        return [
+            (Trajectory(columns, data), int(steps[i]))
+            for i, data in enumerate(np.split(rows[order], splits))
+        ]
+
+
+def simulate_batch(
+    members: list[tuple[str, dict[str, Any], dict[str, Any], dict[str, Any]]],
+    settings: BatchEngineSchema,
+    output_properties: list[str] | None = None,
+) -> dict[str, tuple[Trajectory, str, int, float]]:
+    """組み合わせをまとめて積分する.
+
+    Args:
+        members (list[tuple[str, dict[str, Any], dict[str, Any], dict[str, Any]]]): 組み合わせごとの
+            (キー, 射場パラメータ, ロケットパラメータ, シミュレーションパラメータ). シミュレーションパラメータは
+            パラシュートの面積と展開にかかる時間 (derive_parachute_parameters) を含む.
+        settings (BatchEngineSchema): 一括積分エンジンの設定.
+        output_properties (list[str] | None): 出力するプロパティのキャプション. Noneの場合は集計に必要なもの.
+
+    Returns:
+        dict[str, tuple[Trajectory, str, int, float]]: キーごとの出力と起動種別(batch)、積分のステップ数、
+            積分の経過時間[s] (まとめて積分した時間を機体の数で割ったもの).
+    """
+    output_properties = ANALYSIS_OUTPUTS if output_properties is None else output_properties
+    unknown_outputs = [caption for caption in output_properties if caption not in OUTPUT_PROPERTIES]
+    if unknown_outputs:
+        raise ValueError(f"出力できないプロパティです: {unknown_outputs}")
+    start_wall = time.perf_counter()
+    flight = _BatchFlight(
+        [
+            (key, launch_param, rocket_param, {**simulation_param, **derive_simulation_parameters(launch_param)})
+            for key, launch_param, rocket_param, simulation_param in members
+        ],
+        settings,
+        output_properties,
+    )
+    results = flight.run()
+    wall_seconds = (time.perf_counter() - start_wall) / len(members)
+    return {
+        member[0]: (trajectory, BATCH_START, steps, wall_seconds)
+        for member, (trajectory, steps) in zip(members, results, strict=True)
+    }
+
+
+class BatchEngine:
+    """一括積分の結果を保持し、組み合わせごとの処理(run_jsb)に返す.
+
+    JSBEnginePool.prepare_branches と同じく、prepare でまとめて積分しておき、run で組み合わせごとに取り出す.
+    """
+
+    def __init__(self) -> None:
+        """初期化"""
+        self._prepared: dict[str, tuple[Trajectory, str, int, float]] = {}
+
+    def prepare(
+        self,
+        members: list[tuple[str, dict[str, Any], dict[str, Any], dict[str, Any]]],
+        settings: BatchEngineSchema,
+        output_properties: list[str] | None = None,
+    ) -> None:
+        """組み合わせをまとめて積分し、結果を run で返せるようにする.
+
+        Args:
+            members (list[tuple[str, dict[str, Any], dict[str, Any], dict[str, Any]]]): 組み合わせごとの
+                (レンダリング済みパラメータのディレクトリ, 射場パラメータ, ロケットパラメータ,
+                シミュレーションパラメータ).
+            settings (BatchEngineSchema): 一括積分エンジンの設定.
+            output_properties (list[str] | None): 出力するプロパティのキャプション.
+        """
+        self._prepared.update(simulate_batch(members, settings, output_properties))
+
+    def run(
+        self,
+        param_dir: str,
+        launch_param: dict[str, Any],
+        rocket_param: dict[str, Any],
+        simulation_param: dict[str, Any],
+        settings: BatchEngineSchema,
+        output_properties: list[str] | None = None,
+    ) -> tuple[Trajectory, str, int, float]:
+        """組み合わせ1つの結果を返す. prepare で積分済みでない場合は1機だけで積分する.
+
+        Args:
+            param_dir (str): レンダリング済みパラメータのディレクトリ.
+            launch_param (dict[str, Any]): 射場パラメータ.
+            rocket_param (dict[str, Any]): ロケットパラメータ.
+            simulation_param (dict[str, Any]): シミュレーションパラメータ.
+            settings (BatchEngineSchema): 一括積分エンジンの設定.
+            output_properties (list[str] | None): 出力するプロパティのキャプション.
+
+        Returns:
+            tuple[Trajectory, str, int, float]: 出力と起動種別(batch)、積分のステップ数、積分の経過時間[s].
+        """
+        prepared = self._prepared.pop(param_dir, None)
+        if prepared is not None:
+            return prepared
+        return simulate_batch([(param_dir, launch_param, rocket_param, simulation_param)], settings, output_properties)[
+            param_dir
+        ]
+
+    def discard_prepared(self) -> None:
+        """prepare で積分したが run で使われなかった結果を破棄する."""
+        self._prepared.clear()
+
+
+_BATCH_ENGINE: BatchEngine | None = None
+
+
+def get_batch_engine() -> BatchEngine:
+    """このプロセスの一括積分エンジンを取得する.
+
+    Returns:
+        BatchEngine: プロセスごとに1つの一括積分エンジン.
+    """
+    global _BATCH_ENGINE  # noqa: PLW0603
+    if _BATCH_ENGINE is None:
+        _BATCH_ENGINE = BatchEngine()
+    return _BATCH_ENGINE
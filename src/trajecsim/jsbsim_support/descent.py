@@ -0,0 +1,165 @@
+"""パラシュート降下の解析的な早送り.
+
+パラシュートの展開が完了し、終端速度で風に流されるだけの状態になったらJSBSimの積分を打ち切り、
+残りの降下を解析的に計算して着地までの出力を追加する.
+
+- 鉛直方向: 終端速度では抗力と重力が釣り合うので v * sqrt(rho) が一定. 密度は標準大気(対流圏)の比で変化させる.
+- 水平方向: 機体の速度は時定数 v / g の一次遅れで風の速度に近づく (終端速度の二次の抗力を線形化したもの).
+  風はJSBSimと同じく風テーブルを高度で線形補間する.
+"""
+
+import math
+from typing import Any
+
+import jsbsim
+import numpy as np
+
+from trajecsim.jsbsim_support.trajectory import Trajectory
+from trajecsim.util.geodesy import geodetic_to_geocentric_latitude, offset_to_degrees
+
+FEET_TO_METER = 0.3048
+GRAVITY = 9.80665
+
+# 降下が落ち着いたかを判定する間隔[s]と、その間の v * sqrt(rho) の相対変化の許容値
+SETTLE_CHECK_INTERVAL = 1.0
+SETTLE_TOLERANCE = 1e-4
+# 落ち着いたと判定する、風に対する水平方向の速度の上限[m/s]
+SETTLE_AIRSPEED_MPS = 0.5
+
+# 標準大気の対流圏の温度減率[K/m]と海面温度[K]. 密度は温度の4.2559乗に比例する
+LAPSE_RATE = 0.0065
+SEA_LEVEL_TEMPERATURE = 288.15
+DENSITY_EXPONENT = 4.2559
+# 降下時間を積分する高度の刻み[m]
+ALTITUDE_RESOLUTION_M = 0.5
+
+
+class DescentSettleDetector:
+    """パラシュート降下が終端速度に落ち着いたかを判定する."""
+
+    def __init__(self, check_interval: float = SETTLE_CHECK_INTERVAL, tolerance: float = SETTLE_TOLERANCE) -> None:
+        """初期化
+
+        Args:
+            check_interval (float): 判定の間隔[s].
+            tolerance (float): 判定の間隔の間の v * sqrt(rho) の相対変化の許容値.
+        """
+        self.check_interval = check_interval
+        self.tolerance = tolerance
+        self._next_check_time = 0.0
+        self._previous: float | None = None
+
+    def update(self, fdm: jsbsim.FGFDMExec) -> bool:
+        """ステップごとに呼び出し、降下が落ち着いたかを返す.
+
+        Args:
+            fdm (jsbsim.FGFDMExec): 積分中のFGFDMExec.
+
+        Returns:
+            bool: 積分を打ち切ってよい場合はTrue.
+        """
+        sim_time = fdm.get_sim_time()
+        if sim_time < self._next_check_time:
+            return False
+        self._next_check_time = sim_time + self.check_interval
+        if fdm["fcs/parachute_reef_pos_norm"] < 1 or fdm["velocities/v-down-fps"] <= 0:
+            self._previous = None
+            return False
+
+        settled_value = fdm["velocities/v-down-fps"] * math.sqrt(fdm["atmosphere/rho-slugs_ft3"])
+        previous, self._previous = self._previous, settled_value
+        airspeed_fps = math.hypot(
+            fdm["velocities/v-north-fps"] - fdm["atmosphere/wind-north-fps"],
+            fdm["velocities/v-east-fps"] - fdm["atmosphere/wind-east-fps"],
+        )
+        if previous is None or airspeed_fps * FEET_TO_METER > SETTLE_AIRSPEED_MPS:
+            return False
+        return abs(settled_value - previous) <= self.tolerance * settled_value
+
+
+def _density_ratio(altitude_m: np.ndarray, reference_altitude_m: float) -> np.ndarray:
+    """標準大気(対流圏)における、基準高度に対する密度の比."""
+    temperature = SEA_LEVEL_TEMPERATURE - LAPSE_RATE * altitude_m
+    reference_temperature = SEA_LEVEL_TEMPERATURE - LAPSE_RATE * reference_altitude_m
+    return (temperature / reference_temperature) ** DENSITY_EXPONENT
+
+
+def fast_forward_descent(
+    trajectory: Trajectory,
+    fdm: jsbsim.FGFDMExec,
+    simulation_param: dict[str, Any],
+    output_interval: float,
+) -> Trajectory:
+    """積分を打ち切った時点から着地までの出力を解析的に計算して追加する.
+
+    姿勢などの計算しない列は、打ち切った時点の値のままにする.
+
+    Args:
+        trajectory (Trajectory): 打ち切った時点までの出力.
+        fdm (jsbsim.FGFDMExec): 積分を打ち切ったFGFDMExec.
+        simulation_param (dict[str, Any]): シミュレーションパラメータ. winds_table と launcher_height を使う.
+        output_interval (float): 出力の間隔[s].
+
+    Returns:
+        Trajectory: 着地までの出力.
+    """
+    start_time = fdm.get_sim_time()
+    # 移動量は測地緯度で足し合わせ、出力(地心緯度)には高度を考慮して変換する
+    start_lat = fdm["position/lat-geod-deg"]
+    start_lon = fdm["position/long-gc-deg"]
+    start_altitude = fdm["position/h-sl-meters"]
+    start_agl = fdm["position/h-agl-ft"] * FEET_TO_METER
+    start_v_down = fdm["velocities/v-down-fps"] * FEET_TO_METER
+    elevation = start_altitude - start_agl
+
+    # 高度ごとの終端速度から、各高度に到達する時刻を求める
+    agl_grid = np.linspace(start_agl, 0.0, max(math.ceil(start_agl / ALTITUDE_RESOLUTION_M), 1) + 1)
+    v_down_grid = start_v_down / np.sqrt(_density_ratio(elevation + agl_grid, start_altitude))
+    slowness = 1 / v_down_grid
+    time_grid = np.concatenate([[0.0], np.cumsum(0.5 * (slowness[1:] + slowness[:-1]) * -np.diff(agl_grid))])
+    landing_time = start_time + time_grid[-1]
+
+    # 出力の時刻は打ち切るまでの出力の続き. 最後の行は着地の時刻
+    last_time = trajectory["Time"][-1] if len(trajectory) else start_time
+    first_time = last_time + output_interval * (math.floor((start_time - last_time) / output_interval) + 1)
+    output_time = np.append(np.arange(first_time, landing_time, output_interval), landing_time)
+    output_agl = np.interp(output_time - start_time, time_grid, agl_grid)
+    output_v_down = np.interp(output_time - start_time, time_grid, v_down_grid)
+
+    # 風に流される水平方向の移動量. ランチャーの高さ以下では風が更新されない (pq_simulation.xml.j2 と同じ)
+    winds = sorted({wind[0]: wind for wind in simulation_param["winds_table"]}.values())
+    wind_altitude = np.array([wind[0] for wind in winds], dtype=float)
+    lookup_agl = np.maximum(np.append(start_agl, output_agl), simulation_param["launcher_height"])
+    wind_speed = np.interp(lookup_agl, wind_altitude, [wind[1] for wind in winds])
+    wind_dir = np.radians(np.interp(lookup_agl, wind_altitude, [wind[2] for wind in winds]))
+    wind_north = (wind_speed * np.cos(wind_dir)).tolist()
+    wind_east = (wind_speed * np.sin(wind_dir)).tolist()
+    # 区間ごとに風を一定として一次遅れの式を厳密に解く
+    segment_time = np.diff(np.append(start_time, output_time))
+    decay = np.exp(-segment_time * GRAVITY / output_v_down).tolist()
+    velocity_north = [fdm["velocities/v-north-fps"] * FEET_TO_METER]
+    velocity_east = [fdm["velocities/v-east-fps"] * FEET_TO_METER]
+    for i, segment_decay in enumerate(decay):
+        velocity_north.append(wind_north[i] + (velocity_north[-1] - wind_north[i]) * segment_decay)
+        velocity_east.append(wind_east[i] + (velocity_east[-1] - wind_east[i]) * segment_decay)
+    north_m = np.cumsum(0.5 * (np.array(velocity_north[1:]) + velocity_north[:-1]) * segment_time)
+    east_m = np.cumsum(0.5 * (np.array(velocity_east[1:]) + velocity_east[:-1]) * segment_time)
+    lat_diff, lon_diff = offset_to_degrees(start_lat, north_m, east_m)
+
+    last_row = trajectory.data[-1] if len(trajectory) else np.full(len(trajectory.columns), np.nan)
+    tail = np.tile(last_row, (len(output_time), 1))
+    tail_columns = {
+        "Time": output_time,
+        "Latitude": geodetic_to_geocentric_latitude(start_lat + lat_diff, elevation + output_agl),
+        "Longitude": start_lon + lon_diff,
+        "Altitude": elevation + output_agl,
+        "Acceleration": np.zeros(len(output_time)),
+        "Thrust": np.zeros(len(output_time)),
+        "True Velocity": output_v_down,
+        "Ground Velocity": np.hypot(velocity_north[1:], velocity_east[1:]),
+        "Descent Rate": output_v_down,
+    }
+    for column, values in tail_columns.items():
+        if column in trajectory.columns:
+            tail[:, trajectory.columns.index(column)] = values
+    return Trajectory(trajectory.columns, np.vstack([trajectory.data, tail]))
@@ -0,0 +1,653 @@
+"""FGFDMExecをワーカー内で再利用するエンジンプール.
+
+機体モデル(pq_rocket.xml)はワーカーごとに一度だけ読み込み、射場・風・シミュレーションのパラメータだけが
+異なる組み合わせでは、初期条件をリセットしてプロパティツリーから値を注入する.
+pq_simulation.xml.j2のイベント(離床、頂点検出、上空風、着地)はPythonのステップループで再現する.
+ステップごとのプロパティの読み書きはプロパティノードを使い、文字列での検索を避ける.
+それでもステップごとのPythonの処理はスクリプトのイベントより遅く、機体モデルの読み込みを省いた分と相殺されるため、
+既定では使わない (misc.engine_pool).
+
+飛行の前半が同じ組み合わせ(風だけ、パラシュートだけが異なるもの)は prepare_branches でまとめて実行できる.
+共通部分を一度だけ積分し、分岐点(ランチャー離脱、頂点)で os.fork によりプロセスごと状態を複製して、
+異なる後半だけをそれぞれ積分する. JSBSimには状態を保存して復元するAPIがないため、fork を状態の複製に使う.
+"""
+
+import hashlib
+import logging
+import os
+import pickle
+import time
+import traceback
+from bisect import bisect_right
+from collections.abc import Callable, Hashable
+from functools import lru_cache
+from pathlib import Path
+from typing import Any
+
+import jsbsim
+import numpy as np
+
+from trajecsim.jsbsim_support.descent import DescentSettleDetector, fast_forward_descent
+from trajecsim.jsbsim_support.generate_param_xml import derive_simulation_parameters
+from trajecsim.jsbsim_support.output_properties import ANALYSIS_OUTPUTS, OUTPUT_PROPERTIES
+from trajecsim.jsbsim_support.trajectory import Trajectory, TrajectoryRecorder
+
+LOGGER = logging.getLogger(__name__)
+
+MODEL_NAME = "PQ_ROCKET"
+ROCKET_XML_PATH = Path("aircraft/PQ_ROCKET/pq_rocket.xml")
+WARM_START = "warm"
+COLD_START = "cold"
+# 共通の前半から分岐して実行した
+BRANCH_START = "branch"
+# 積分のステップ数. リセットしても0に戻らないため、実行前後の差を使う
+FRAME_PROPERTY = "simulation/frame"
+
+METER_TO_FEET = 3.280840
+DEG_TO_RAD = 0.0174533
+# 着地判定の高度[ft] (pq_simulation.xml.j2 の Landed イベントと同じ)
+LANDED_AGL_FT = 0.1
+# 頂点判定の降下速度[ft/s] (pq_simulation.xml.j2 の Apogee イベントと同じ)
+APOGEE_V_DOWN_FPS = 1.0
+# パラシュート展開前の展開時刻 (pq_simulation.xml.j2 と同じ)
+PARACHUTE_NOT_DEPLOYED_TIME = 100000000.0
+# パラシュートの面積と、展開にかかる時間の逆数 (pq_simulation.xml.j2 が設定し、pq_rocket.xml.j2 が使う)
+PARACHUTE_AREA_PROPERTY = "simulation/parachute-area-sqft"
+PARACHUTE_DEPLOY_RATE_PROPERTY = "simulation/parachute-deploy-rate"
+SQUARE_METER_TO_SQUARE_FEET = 10.7639104
+# 初期高度[m] (liftoff.xml.j2 と同じ)
+INITIAL_AGL_M = 0.1
+# 燃焼終了判定の燃料の残量[lbs] (pq_simulation.xml.j2 の Motor Burnout イベントと同じ)
+BURNOUT_CONTENTS_LBS = 0.1
+
+# 飛行フェーズ. pq_simulation.xml.j2 のイベントが FLIGHT_PHASE_PROPERTY にこの順番の番号を設定する
+# rail: ランチャー上, boost: ランチャー離脱から燃焼終了まで, coast: 燃焼終了からパラシュートの展開完了まで,
+# descent: パラシュート展開後の降下
+FLIGHT_PHASES = ("rail", "boost", "coast", "descent")
+FLIGHT_PHASE_PROPERTY = "simulation/flight-phase"
+DESCENT_PHASE = FLIGHT_PHASES.index("descent")
+
+# 分岐点と、分岐点より後にだけ影響するパラメータ. これ以外のパラメータと機体モデルが同じ組み合わせは前半を共有できる
+# 風はランチャー離脱より上でだけ設定され、パラシュートは頂点で展開時刻が決まるまで飛行に影響しない
+WIND_BRANCH = "wind"
+PARACHUTE_BRANCH = "parachute"
+BRANCH_LAUNCH_PARAMETERS = ("ground_wind_dir", "ground_wind_speed", "wind_power_factor")
+BRANCH_SIMULATION_PARAMETERS = ("parachute_deploy_delay", "parachute_area", "parachute_full_deploy_time")
+
+
+def get_phase_time_steps(simulation_param: dict[str, Any]) -> list[float]:
+    """飛行フェーズごとの時間刻みを取得する. 指定されていないフェーズはtime_stepを使う.
+
+    Args:
+        simulation_param (dict[str, Any]): シミュレーションパラメータ.
+
+    Returns:
+        list[float]: FLIGHT_PHASES の順の時間刻み[s].
+    """
+    time_step = simulation_param["time_step"]
+    return [simulation_param.get(f"{phase}_time_step", time_step) for phase in FLIGHT_PHASES]
+
+
+def get_output_rates(simulation_param: dict[str, Any]) -> tuple[float, float]:
+    """出力の頻度を取得する.
+
+    dense_output_rate を指定した場合は、パラシュート降下までのイベント(ランチャー離脱, 燃焼終了, 最大動圧, 頂点,
+    パラシュート展開)を含む区間をその頻度で、パラシュート降下中を output_rate で出力する.
+
+    Args:
+        simulation_param (dict[str, Any]): シミュレーションパラメータ.
+
+    Returns:
+        tuple[float, float]: パラシュート降下までと、パラシュート降下中の出力の頻度[Hz].
+    """
+    output_rate = simulation_param["output_rate"]
+    return simulation_param.get("dense_output_rate", output_rate), output_rate
+
+
+def get_model_key(param_dir: Path | str) -> str:
+    """機体モデルのキーを取得する. 機体XMLの内容が同じ組み合わせは同じキーになる.
+
+    Args:
+        param_dir (Path | str): レンダリング済みパラメータのディレクトリ.
+
+    Returns:
+        str: 機体XMLのハッシュ値.
+    """
+    rocket_xml = Path(param_dir) / ROCKET_XML_PATH
+    stat = rocket_xml.stat()
+    # 共有ディレクトリのハードリンクは同じファイルなので、ファイルごとに一度だけハッシュを計算する
+    return _hash_file(str(rocket_xml), stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+@lru_cache(maxsize=4096)
+def _hash_file(path: str, device: int, inode: int, mtime_ns: int, size: int) -> str:  # noqa: ARG001
+    """ファイルの内容のハッシュ値. デバイス、inode、更新時刻、サイズが同じ間はキャッシュを使う."""
+    return hashlib.sha256(Path(path).read_bytes()).hexdigest()
+
+
+class JSBEnginePool:
+    """ワーカープロセス内で機体モデルを読み込んだFGFDMExecを保持する."""
+
+    def __init__(self) -> None:
+        """初期化"""
+        self._fdm: jsbsim.FGFDMExec | None = None
+        self._model_key: str | None = None
+        self.warm_runs = 0
+        self.cold_runs = 0
+        # prepare_branches で実行済みの結果 (パラメータのディレクトリ: 結果)
+        self._prepared: dict[str, tuple[Trajectory, str, int, float]] = {}
+
+    def acquire(self, param_dir: Path) -> tuple[jsbsim.FGFDMExec, str]:
+        """機体モデルを読み込み済みのFGFDMExecを取得する.
+
+        機体XMLが前回の実行と同じならば再利用し、異なる場合のみ読み込み直す.
+
+        Args:
+            param_dir (Path): レンダリング済みパラメータのディレクトリ.
+
+        Returns:
+            tuple[jsbsim.FGFDMExec, str]: FGFDMExecと起動種別(warm/cold).
+        """
+        model_key = get_model_key(param_dir)
+        if self._fdm is not None and model_key == self._model_key:
+            self.warm_runs += 1
+            return self._fdm, WARM_START
+
+        fdm = jsbsim.FGFDMExec(str(param_dir))
+        fdm.set_debug_level(0)
+        if not fdm.load_model(MODEL_NAME):
+            raise RuntimeError(f"機体モデルの読み込みに失敗しました: {param_dir}")
+        self._fdm = fdm
+        self._model_key = model_key
+        self.cold_runs += 1
+        return fdm, COLD_START
+
+    def run(
+        self,
+        param_dir: Path,
+        launch_param: dict[str, Any],
+        simulation_param: dict[str, Any],
+        descent_fast_forward: bool = False,
+        output_properties: list[str] | None = None,
+    ) -> tuple[Trajectory, str, int, float]:
+        """シミュレーションを実行する. prepare_branches で実行済みの場合はその結果を返す.
+
+        Args:
+            param_dir (Path): レンダリング済みパラメータのディレクトリ.
+            launch_param (dict[str, Any]): 射場パラメータ.
+            simulation_param (dict[str, Any]): シミュレーションパラメータ. パラシュートの面積と展開にかかる時間
+                (derive_parachute_parameters)を含む.
+            descent_fast_forward (bool): パラシュート降下が落ち着いたら着地までを解析的に計算する.
+            output_properties (list[str] | None): 出力するプロパティのキャプション. Noneの場合は集計に必要なもの.
+
+        Returns:
+            tuple[Trajectory, str, int, float]: 出力データと起動種別(warm/cold/branch)、積分のステップ数、
+                積分の経過時間[s].
+        """
+        prepared = self._prepared.pop(str(param_dir), None)
+        if prepared is not None:
+            return prepared
+        start_wall = time.perf_counter()
+        fdm, start_type = self._start(param_dir, launch_param, simulation_param)
+        output_properties = ANALYSIS_OUTPUTS if output_properties is None else output_properties
+        start_frame = fdm[FRAME_PROPERTY]
+        trajectory = _run_flight(
+            fdm,
+            {**simulation_param, **derive_simulation_parameters(launch_param)},
+            output_properties,
+            descent_fast_forward,
+        )
+        return trajectory, start_type, int(fdm[FRAME_PROPERTY] - start_frame), time.perf_counter() - start_wall
+
+    def _start(
+        self, param_dir: Path, launch_param: dict[str, Any], simulation_param: dict[str, Any]
+    ) -> tuple[jsbsim.FGFDMExec, str]:
+        """機体モデルを読み込み済みのFGFDMExecに初期条件を設定する."""
+        fdm, start_type = self.acquire(param_dir)
+        _set_initial_conditions(fdm, launch_param, simulation_param)
+        if start_type == WARM_START:
+            fdm.reset_to_initial_conditions(0)
+        else:
+            fdm.run_ic()
+        return fdm, start_type
+
+    def prepare_branches(
+        self,
+        members: list[tuple[Path, dict[str, Any], dict[str, Any]]],
+        descent_fast_forward: bool = False,
+        output_properties: list[str] | None = None,
+    ) -> None:
+        """飛行の前半が同じ組み合わせをまとめて実行し、結果を run で返せるようにする.
+
+        共通の前半を一度だけ積分し、風が異なる組み合わせはランチャー離脱で、パラシュートが異なる組み合わせは
+        頂点で fork して後半を積分する. 組み合わせは get_flight_prefix_key が同じでなければならない.
+
+        Args:
+            members (list[tuple[Path, dict[str, Any], dict[str, Any]]]): 組み合わせごとの
+                (レンダリング済みパラメータのディレクトリ, 射場パラメータ, シミュレーションパラメータ).
+            descent_fast_forward (bool): パラシュート降下が落ち着いたら着地までを解析的に計算する.
+            output_properties (list[str] | None): 出力するプロパティのキャプション. Noneの場合は集計に必要なもの.
+
+        Raises:
+            ValueError: 飛行の前半が異なる組み合わせが含まれている場合.
+        """
+        prefix_keys = {get_flight_prefix_key(*member) for member in members}
+        if len(prefix_keys) > 1:
+            raise ValueError(f"飛行の前半が異なる組み合わせは分岐できません: {[str(member[0]) for member in members]}")
+        branch_members = [
+            (str(param_dir), {**simulation_param, **derive_simulation_parameters(launch_param)})
+            for param_dir, launch_param, simulation_param in members
+        ]
+        param_dir, launch_param, simulation_param = members[0]
+        start_wall = time.perf_counter()
+        fdm, start_type = self._start(param_dir, launch_param, simulation_param)
+        output_properties = ANALYSIS_OUTPUTS if output_properties is None else output_properties
+        branches = _FlightBranches(fdm, branch_members, start_type, start_wall)
+        try:
+            trajectory = _run_flight(
+                fdm, branch_members[0][1], output_properties, descent_fast_forward, branches=branches
+            )
+            results = branches.finish(trajectory)
+        except BaseException:
+            # 分岐したプロセスでは、親プロセスに例外を伝えて終了する
+            branches.fail(traceback.format_exc())
+            raise
+        self._prepared.update(results)
+
+    def discard_prepared(self) -> None:
+        """prepare_branches で実行したが run で使われなかった結果を破棄する."""
+        self._prepared.clear()
+
+
+def get_flight_prefix_key(
+    param_dir: Path | str, launch_param: dict[str, Any], simulation_param: dict[str, Any]
+) -> Hashable:
+    """飛行の前半(分岐点より前)に影響する、機体モデルとパラメータのキー. 同じキーの組み合わせは前半を共有できる.
+
+    Args:
+        param_dir (Path | str): レンダリング済みパラメータのディレクトリ.
+        launch_param (dict[str, Any]): 射場パラメータ.
+        simulation_param (dict[str, Any]): シミュレーションパラメータ.
+
+    Returns:
+        Hashable: キー.
+    """
+    return (
+        get_model_key(param_dir),
+        tuple(sorted((key, value) for key, value in launch_param.items() if key not in BRANCH_LAUNCH_PARAMETERS)),
+        tuple(
+            sorted((key, value) for key, value in simulation_param.items() if key not in BRANCH_SIMULATION_PARAMETERS)
+        ),
+    )
+
+
+def _set_initial_conditions(
+    fdm: jsbsim.FGFDMExec, launch_param: dict[str, Any], simulation_param: dict[str, Any]
+) -> None:
+    """liftoff.xml.j2 と pq_simulation.xml.j2 の初期値をプロパティツリーに注入する."""
+    fdm.set_dt(simulation_param["time_step"])
+    fdm["ic/lat-gc-deg"] = launch_param["latitude"]
+    fdm["ic/long-gc-deg"] = launch_param["longitude"]
+    fdm["ic/terrain-elevation-ft"] = launch_param["elevation"] * METER_TO_FEET
+    fdm["ic/h-agl-ft"] = INITIAL_AGL_M * METER_TO_FEET
+    fdm["ic/u-fps"] = 0.0
+    fdm["ic/v-fps"] = 0.0
+    fdm["ic/w-fps"] = 0.0
+    fdm["ic/p-rad_sec"] = 0.0
+    fdm["ic/q-rad_sec"] = 0.0
+    fdm["ic/r-rad_sec"] = 0.0
+    fdm["ic/phi-deg"] = launch_param["roll"]
+    fdm["ic/theta-deg"] = launch_param["pitch"]
+    fdm["ic/psi-true-deg"] = launch_param["yaw"]
+    fdm["ic/vw-fps"] = 0.0
+    fdm["forces/hold-down"] = 1
+    fdm["simulation/parachute_deploy_time"] = PARACHUTE_NOT_DEPLOYED_TIME
+    fdm["atmosphere/wind-mag-fps"] = 0.0
+    fdm["atmosphere/psiw-rad"] = 0.0
+    _set_parachute(fdm, simulation_param)
+
+
+def _set_parachute(fdm: jsbsim.FGFDMExec, simulation_param: dict[str, Any]) -> None:
+    """パラシュートの面積と展開にかかる時間をプロパティツリーに注入する (pq_simulation.xml.j2 と同じ値)."""
+    fdm[PARACHUTE_AREA_PROPERTY] = simulation_param["parachute_area"] * SQUARE_METER_TO_SQUARE_FEET
+    fdm[PARACHUTE_DEPLOY_RATE_PROPERTY] = 1 / (simulation_param["parachute_full_deploy_time"] + 0.00000001)
+
+
+class _WindProfile:
+    """風テーブルを高度[ft]で線形補間する. テーブルの範囲外は端の値を使う (JSBSimのテーブルと同じ)."""
+
+    def __init__(self, winds_table: list[tuple[float, float, float]]) -> None:
+        winds = sorted({wind[0]: wind for wind in winds_table}.values())
+        self.altitude_ft = [wind[0] * METER_TO_FEET for wind in winds]
+        self.dir_rad = [wind[2] * DEG_TO_RAD for wind in winds]
+        self.speed_fps = [wind[1] * METER_TO_FEET for wind in winds]
+
+    def lookup(self, h_agl_ft: float) -> tuple[float, float]:
+        """高度[ft]における風向[rad]と風速[ft/s]を返す."""
+        index = bisect_right(self.altitude_ft, h_agl_ft)
+        if index == 0:
+            return self.dir_rad[0], self.speed_fps[0]
+        if index == len(self.altitude_ft):
+            return self.dir_rad[-1], self.speed_fps[-1]
+        ratio = (h_agl_ft - self.altitude_ft[index - 1]) / (self.altitude_ft[index] - self.altitude_ft[index - 1])
+        return (
+            self.dir_rad[index - 1] + ratio * (self.dir_rad[index] - self.dir_rad[index - 1]),
+            self.speed_fps[index - 1] + ratio * (self.speed_fps[index] - self.speed_fps[index - 1]),
+        )
+
+
+class _FlightBranches:
+    """飛行の前半を共有する組み合わせを、分岐点で fork して受け持つ.
+
+    分岐点では、このプロセスが受け持つ組み合わせを後半のパラメータでグループに分け、先頭以外のグループごとに
+    子プロセスを作って結果を待つ. 子プロセスは分岐点の状態から積分を続け、結果をパイプで返して終了する.
+    親プロセスは先頭のグループを受け持って積分を続ける. 同時に実行するプロセスは常に1つだけ.
+    """
+
+    def __init__(
+        self,
+        fdm: jsbsim.FGFDMExec,
+        members: list[tuple[str, dict[str, Any]]],
+        start_type: str,
+        start_wall: float,
+    ) -> None:
+        """初期化
+
+        Args:
+            fdm (jsbsim.FGFDMExec): 積分するFGFDMExec.
+            members (list[tuple[str, dict[str, Any]]]): 組み合わせごとの(パラメータのディレクトリ, シミュレーション
+                パラメータ). 先頭の組み合わせのパラメータで積分を始める.
+            start_type (str): 起動種別(warm/cold).
+            start_wall (float): 積分を始めた時刻 (time.perf_counter).
+        """
+        self.fdm = fdm
+        self.members = members
+        self.start_type = start_type
+        self.start_wall = start_wall
+        self.start_frame = fdm[FRAME_PROPERTY]
+        # 子プロセスの結果を待っていた時間. このプロセスの経過時間から除く
+        self.waiting_seconds = 0.0
+        self.results: dict[str, tuple[Trajectory, str, int, float]] = {}
+        self._split_points: set[str] = set()
+        # 親プロセスへのパイプ. 子プロセスでのみ設定される
+        self._parent_fd: int | None = None
+
+    def is_split(self, branch: str) -> bool:
+        """分岐点を通過済みか."""
+        return branch in self._split_points
+
+    def split(self, branch: str) -> dict[str, Any]:
+        """分岐点でプロセスを分岐する.
+
+        Args:
+            branch (str): 分岐点 (WIND_BRANCH, PARACHUTE_BRANCH).
+
+        Returns:
+            dict[str, Any]: このプロセスが続きを積分する組み合わせのシミュレーションパラメータ.
+        """
+        self._split_points.add(branch)
+        groups: dict[Hashable, list[tuple[str, dict[str, Any]]]] = {}
+        for member in self.members:
+            groups.setdefault(_BRANCH_KEYS[branch](member[1]), []).append(member)
+        first_group, *other_groups = groups.values()
+        for group in other_groups:
+            if self._fork(group):
+                break
+        else:
+            self.members = first_group
+        simulation_param = self.members[0][1]
+        _set_parachute(self.fdm, simulation_param)
+        return simulation_param
+
+    def _fork(self, group: list[tuple[str, dict[str, Any]]]) -> bool:
+        """子プロセスを作る. 子プロセスではTrueを返し、親プロセスでは子プロセスの結果を受け取ってFalseを返す."""
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            self.members = group
+            self.start_type = BRANCH_START
+            self.start_wall = time.perf_counter()
+            self.start_frame = self.fdm[FRAME_PROPERTY]
+            self.waiting_seconds = 0.0
+            self.results = {}
+            self._parent_fd = write_fd
+            return True
+
+        os.close(write_fd)
+        start_wait = time.perf_counter()
+        with os.fdopen(read_fd, "rb") as pipe:
+            data = pipe.read()
+        os.waitpid(pid, 0)
+        self.waiting_seconds += time.perf_counter() - start_wait
+        if not data:
+            raise RuntimeError("分岐したシミュレーションが結果を返さずに終了しました")
+        status, payload = pickle.loads(data)  # noqa: S301
+        if status == "error":
+            raise RuntimeError(f"分岐したシミュレーションに失敗しました:\n{payload}")
+        self.results.update(payload)
+        return False
+
+    def finish(self, trajectory: Trajectory) -> dict[str, tuple[Trajectory, str, int, float]]:
+        """積分が終わったら、受け持った組み合わせと子プロセスの結果をまとめる. 子プロセスでは親に返して終了する.
+
+        Args:
+            trajectory (Trajectory): このプロセスで積分した出力.
+
+        Returns:
+            dict[str, tuple[Trajectory, str, int, float]]: パラメータのディレクトリごとの結果.
+        """
+        steps = int(self.fdm[FRAME_PROPERTY] - self.start_frame)
+        wall_seconds = time.perf_counter() - self.start_wall - self.waiting_seconds
+        # 分岐点より後のパラメータも同じ組み合わせは、同じ出力を使う
+        for i, (param_dir, _) in enumerate(self.members):
+            if i == 0:
+                self.results[param_dir] = (trajectory, self.start_type, steps, wall_seconds)
+            else:
+                self.results[param_dir] = (trajectory, BRANCH_START, 0, 0.0)
+        if self._parent_fd is not None:
+            self._exit("ok", self.results)
+        return self.results
+
+    def fail(self, error_traceback: str) -> None:
+        """子プロセスで例外が発生した場合に、親プロセスに伝えて終了する. 最初のプロセスでは何もしない."""
+        if self._parent_fd is not None:
+            self._exit("error", error_traceback)
+
+    def _exit(self, status: str, payload: object) -> None:
+        assert self._parent_fd is not None  # noqa: S101
+        try:
+            with os.fdopen(self._parent_fd, "wb") as pipe:
+                pipe.write(pickle.dumps((status, payload)))
+        finally:
+            # 親プロセスの後処理(atexit、バッファのフラッシュ)を子プロセスで実行しない
+            os._exit(0)
+
+
+# 分岐点ごとに、組み合わせをグループに分けるキー
+_BRANCH_KEYS: dict[str, Callable[[dict[str, Any]], Hashable]] = {
+    WIND_BRANCH: lambda simulation_param: tuple(map(tuple, simulation_param["winds_table"])),
+    PARACHUTE_BRANCH: lambda simulation_param: (
+        simulation_param["parachute_area"],
+        simulation_param["parachute_full_deploy_time"],
+        simulation_param["parachute_deploy_delay"],
+    ),
+}
+
+
+class OutputSampler:
+    """出力するプロパティを一定の時間間隔でメモリ上に記録する.
+
+    パラシュート降下までは dense_output_rate、降下中は output_rate の間隔で記録する (get_output_rates).
+    時間刻みが変わっても出力の間隔は一定にする. プロパティはノードを保持しておき、文字列で検索しない.
+    """
+
+    def __init__(self, fdm: jsbsim.FGFDMExec, output_properties: list[str], simulation_param: dict[str, Any]) -> None:
+        """初期化. 現在の状態を最初の行として記録する.
+
+        Args:
+            fdm (jsbsim.FGFDMExec): 積分するFGFDMExec.
+            output_properties (list[str]): 出力するプロパティのキャプション.
+            simulation_param (dict[str, Any]): シミュレーションパラメータ. 出力の頻度を使う.
+        """
+        self.fdm = fdm
+        property_manager = fdm.get_property_manager()
+        self._outputs = [
+            (property_manager.get_node(OUTPUT_PROPERTIES[caption][0]), OUTPUT_PROPERTIES[caption][2])
+            for caption in output_properties
+        ]
+        self.dense_output_interval, self.descent_output_interval = (
+            1 / rate for rate in get_output_rates(simulation_param)
+        )
+        self.recorder = TrajectoryRecorder(["Time", *output_properties])
+        self.recorder.append(self.sample())
+        self._next_output_time = self.dense_output_interval
+
+    def sample(self) -> list[float]:
+        """出力するプロパティの現在値を取得する."""
+        return [self.fdm.get_sim_time(), *(node.get_double_value() * factor for node, factor in self._outputs)]
+
+    def update(self, dt: float, phase: int) -> None:
+        """ステップごとに呼び出し、出力の時刻になっていれば記録する.
+
+        Args:
+            dt (float): 直前のステップの時間刻み[s].
+            phase (int): 飛行フェーズ (FLIGHT_PHASES の番号).
+        """
+        sim_time = self.fdm.get_sim_time()
+        if sim_time < self._next_output_time - dt / 2:
+            return
+        self.recorder.append(self.sample())
+        output_interval = self.descent_output_interval if phase >= DESCENT_PHASE else self.dense_output_interval
+        while self._next_output_time < sim_time + dt / 2:
+            self._next_output_time += output_interval
+
+    def finish(self) -> Trajectory:
+        """記録を終了してTrajectoryを返す."""
+        return self.recorder.finish()
+
+
+def _run_flight(
+    fdm: jsbsim.FGFDMExec,
+    simulation_param: dict[str, Any],
+    output_properties: list[str],
+    descent_fast_forward: bool = False,
+    branches: _FlightBranches | None = None,
+) -> Trajectory:
+    """pq_simulation.xml.j2 のイベントを再現しながら積分し、出力をメモリ上に記録する.
+
+    branches を指定した場合は、分岐点でパラメータの異なる組み合わせごとにプロセスを分岐し、
+    このプロセスが受け持つ組み合わせのパラメータで続きを積分する.
+    """
+    time_step = simulation_param["time_step"]
+    flight_duration = simulation_param["flight_duration"]
+    phase_time_steps = get_phase_time_steps(simulation_param)
+    liftoff_time = time_step * 10
+    launcher_height_ft = simulation_param["launcher_height"] * METER_TO_FEET
+
+    wind_profile = _WindProfile(simulation_param["winds_table"])
+    descent_detector = DescentSettleDetector() if descent_fast_forward else None
+    sampler = OutputSampler(fdm, output_properties, simulation_param)
+    property_manager = fdm.get_property_manager()
+    h_agl_node = property_manager.get_node("position/h-agl-ft")
+    v_down_node = property_manager.get_node("velocities/v-down-fps")
+    wind_dir_node = property_manager.get_node("atmosphere/psiw-rad")
+    wind_speed_node = property_manager.get_node("atmosphere/wind-mag-fps")
+    phase_conditions = _flight_phase_conditions(fdm, launcher_height_ft)
+
+    lifted_off = False
+    apogee_reached = False
+    phase = 0
+    dt = phase_time_steps[phase]
+    fdm.set_dt(dt)
+    while fdm.get_sim_time() <= flight_duration:
+        # 前のステップの状態から飛行フェーズを進め、このステップの時間刻みを決める
+        while phase < DESCENT_PHASE and phase_conditions[phase]():
+            phase += 1
+        if phase_time_steps[phase] != dt:
+            dt = phase_time_steps[phase]
+            fdm.set_dt(dt)
+
+        # FGFDMExec::Run と同じく、時刻を進めてからイベントを評価し、その後モデルを計算する
+        sim_time = fdm.get_sim_time() + dt
+        if not lifted_off and sim_time >= liftoff_time:
+            fdm["forces/hold-down"] = 0
+            lifted_off = True
+        if not apogee_reached and v_down_node.get_double_value() > APOGEE_V_DOWN_FPS:
+            if branches is not None:
+                simulation_param = branches.split(PARACHUTE_BRANCH)
+                wind_profile = _WindProfile(simulation_param["winds_table"])
+            fdm["simulation/parachute_deploy_time"] = sim_time + simulation_param["parachute_deploy_delay"]
+            apogee_reached = True
+
+        h_agl_ft = h_agl_node.get_double_value()
+        landed = h_agl_ft <= LANDED_AGL_FT
+        if h_agl_ft > launcher_height_ft:
+            if branches is not None and not branches.is_split(WIND_BRANCH):
+                simulation_param = branches.split(WIND_BRANCH)
+                wind_profile = _WindProfile(simulation_param["winds_table"])
+            wind_dir_rad, wind_speed_fps = wind_profile.lookup(h_agl_ft)
+            wind_dir_node.set_double_value(wind_dir_rad)
+            wind_speed_node.set_double_value(wind_speed_fps)
+
+        fdm.run()
+        sampler.update(dt, phase)
+        if landed:
+            break
+        if descent_detector is not None and descent_detector.update(fdm):
+            return fast_forward_descent(sampler.finish(), fdm, simulation_param, sampler.descent_output_interval)
+
+    return append_final_state(sampler.finish(), fdm)
+
+
+def _flight_phase_conditions(fdm: jsbsim.FGFDMExec, launcher_height_ft: float) -> list[Callable[[], bool]]:
+    """飛行フェーズごとに、次のフェーズに進む条件. pq_simulation.xml.j2 の飛行フェーズのイベントと同じ条件."""
+    property_manager = fdm.get_property_manager()
+    h_agl_node = property_manager.get_node("position/h-agl-ft")
+    contents_node = property_manager.get_node("propulsion/tank[0]/contents-lbs")
+    reef_node = property_manager.get_node("fcs/parachute_reef_pos_norm")
+    return [
+        lambda: h_agl_node.get_double_value() > launcher_height_ft,
+        lambda: contents_node.get_double_value() < BURNOUT_CONTENTS_LBS,
+        lambda: reef_node.get_double_value() >= 1,
+    ]
+
+
+def sample_output(fdm: jsbsim.FGFDMExec, output_properties: list[str]) -> list[float]:
+    """出力するプロパティの現在値を取得する."""
+    values = [fdm.get_sim_time()]
+    for caption in output_properties:
+        prop, _, factor = OUTPUT_PROPERTIES[caption]
+        values.append(fdm[prop] * factor)
+    return values
+
+
+def append_final_state(trajectory: Trajectory, fdm: jsbsim.FGFDMExec) -> Trajectory:
+    """最後のステップが出力の時刻でなかった場合に、終了時点(着地)の状態を出力に追加する.
+
+    Args:
+        trajectory (Trajectory): 出力.
+        fdm (jsbsim.FGFDMExec): 積分を終了したFGFDMExec.
+
+    Returns:
+        Trajectory: 終了時点の状態を含む出力.
+    """
+    if len(trajectory) and trajectory["Time"][-1] >= fdm.get_sim_time() - 1e-9:
+        return trajectory
+    final_state = sample_output(fdm, trajectory.columns[1:])
+    return Trajectory(trajectory.columns, np.vstack([trajectory.data, final_state]))
+
+
+_ENGINE_POOL: JSBEnginePool | None = None
+
+
+def get_engine_pool() -> JSBEnginePool:
+    """このプロセスのエンジンプールを取得する.
+
+    Returns:
+        JSBEnginePool: プロセスごとに1つのエンジンプール.
+    """
+    global _ENGINE_POOL  # noqa: PLW0603
+    if _ENGINE_POOL is None:
+        _ENGINE_POOL = JSBEnginePool()
+    return _ENGINE_POOL
@@ -2,26 +2,54 @@
 
 import logging
 import math
+from collections.abc import Hashable, Iterable, Sequence
 from os import cpu_count
 from pathlib import Path
+from shutil import rmtree
+from typing import Any
 
+import numpy as np
 import pandas as pd
+from joblib import delayed
 from omegaconf import DictConfig
 from tqdm import tqdm
-from tqdm.contrib.concurrent import process_map as tqdm_process_map
 
+from trajecsim.jsbsim_support.output_properties import ANALYSIS_OUTPUTS, render_output_properties
 from trajecsim.jsbsim_support.param_generator.fuel_table import generate_fuel_remaining_table
-from trajecsim.jsbsim_support.param_generator.parameter_product import generate_dicts_product
-from trajecsim.jsbsim_support.param_generator.wind_table import generate_wind_table
+from trajecsim.jsbsim_support.param_generator.parameter_product import (
+    DEFAULT_CHUNK_SIZE,
+    count_combinations,
+    iter_dicts_product_chunks,
+)
+from trajecsim.jsbsim_support.param_generator.sampling import iter_sampled_chunks
+from trajecsim.jsbsim_support.param_generator.wind_table import generate_wind_table, generate_wind_tables
 from trajecsim.jsbsim_support.param_generator.xml_renderer import render_and_save_xml_files
 from trajecsim.jsbsim_support.param_generator.yaml_loader import (
     convert_omegaconf_to_schema,
     load_csv_to_dict,
 )
+from trajecsim.jsbsim_support.run_manifest import RENDERED_MARKER_NAME
+from trajecsim.jsbsim_support.schemas.sampling import SamplingSchema
+from trajecsim.util.executor import Executor, LocalExecutor
+from trajecsim.util.telemetry import get_telemetry
 
 LOGGER = logging.getLogger(__name__)
 GRAVITY_ACCELERATION = 9.80665
 AIR_DENSITY = 1.225
+RENDERED_PARAM_DIR = Path("temp/jsbsim/param-generated-xml")
+# レンダリング結果を内容ごとに一度だけ保存するディレクトリ. 組み合わせごとのディレクトリにはハードリンクを置く
+SHARED_DIR_NAME = "_shared"
+# 組み合わせのDataFrameのうち、パラメータの列の1段目
+PARAMETER_SECTIONS = ("rocket", "simulation", "launch")
+# パラシュートの面積と展開にかかる時間の計算に使うロケットパラメータ
+PARACHUTE_PARAMETERS = (
+    "parachute_area",
+    "terminal_velocity",
+    "dry_weight",
+    "fuel_contents",
+    "parachute_drag_coefficient",
+    "parachute_full_deploy_time",
+)
 
 
 def _tuple_to_str_optional(val: tuple[float, ...] | float) -> str:
@@ -30,45 +58,155 @@ def _tuple_to_str_optional(val: tuple[float, ...] | float) -> str:
     return "_".join(map(str, val))
 
 
-def _process_parameter_combination(args: tuple[int, pd.Series, dict[str, str], Path, Path]) -> tuple[int, Path]:
-    """個別のパラメータ組み合わせを処理する関数"""
-    index, row, templates, rendered_param_dir, unitconversions_template_path = args
-    output_dir = rendered_param_dir / f"{index}"
-    if not output_dir.exists():
-        output_dir.mkdir(parents=True, exist_ok=True)
+def derive_simulation_parameters(launch_param: dict[str, Any]) -> dict[str, Any]:
+    """射場パラメータから導出されるシミュレーションパラメータを計算する.
 
-    rocket_param = row["rocket"].to_dict()
-    simulation_param = row["simulation"].to_dict()
-    launch_param = row["launch"].to_dict()
+    Args:
+        launch_param (dict[str, Any]): 射場パラメータ.
 
-    # ランチャーの高さを計算
+    Returns:
+        dict[str, Any]: ランチャーの高さ(launcher_height)と風テーブル(winds_table).
+    """
     # ランチャーの高さは、ランチャーの長さとピッチの角度から計算される
-    simulation_param["launcher_height"] = launch_param["elevation"] + launch_param["launcher_length"] * math.sin(
+    launcher_height = launch_param["elevation"] + launch_param["launcher_length"] * math.sin(
         launch_param["pitch"] * math.pi / 180,
     )
-    # 風テーブルの生成
-    simulation_param["winds_table"] = generate_wind_table(
+    winds_table = generate_wind_table(
         launch_param["ground_wind_dir"],
         launch_param["ground_wind_speed"],
         launch_param["elevation"],
         launch_param["wind_power_factor"],
     )
+    return {"launcher_height": launcher_height, "winds_table": winds_table}
+
+
+def compute_parachute_parameters(rocket_df: pd.DataFrame) -> tuple[np.ndarray, np.ndarray]:
+    """パラシュートの面積と展開にかかる時間を計算する.
+
+    parachute_area が指定されていない場合は、終端速度(terminal_velocity)から面積を計算する.
+    面積が0の場合は展開しない(展開にかかる時間を十分に長くする).
+
+    Args:
+        rocket_df (pd.DataFrame): ロケットパラメータ.
 
-    # パラシュートの面積を計算
-    if rocket_param.get("parachute_area") is None:
-        rocket_param["parachute_area"] = (
-            (
+    Returns:
+        tuple[np.ndarray, np.ndarray]: パラシュートの面積[m^2]と展開にかかる時間[s].
+    """
+    if "parachute_area" in rocket_df.columns:
+        parachute_area = rocket_df["parachute_area"].to_numpy(dtype=float)
+    else:
+        terminal_velocity = rocket_df["terminal_velocity"].to_numpy(dtype=float)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            parachute_area = np.where(
+                terminal_velocity != 0,
                 2
-                * (rocket_param["dry_weight"] - rocket_param["fuel_contents"])
+                * (rocket_df["dry_weight"].to_numpy(dtype=float) - rocket_df["fuel_contents"].to_numpy(dtype=float))
                 * GRAVITY_ACCELERATION
-                / (rocket_param["terminal_velocity"] ** 2 * rocket_param["parachute_drag_coefficient"] * AIR_DENSITY)
+                / (
+                    terminal_velocity**2
+                    * rocket_df["parachute_drag_coefficient"].to_numpy(dtype=float)
+                    * AIR_DENSITY
+                ),
+                0.0,
             )
-            if rocket_param.get("terminal_velocity") != 0
-            else 0
-        )
-    rocket_param["parachute_full_deploy_time"] = (
-        1e10 if rocket_param["parachute_area"] < 10e-5 else rocket_param["parachute_full_deploy_time"]
+    parachute_full_deploy_time = np.where(
+        parachute_area < 10e-5, 1e10, rocket_df["parachute_full_deploy_time"].to_numpy(dtype=float)
     )
+    return parachute_area, parachute_full_deploy_time
+
+
+def derive_parachute_parameters(rocket_param: dict[str, Any]) -> dict[str, Any]:
+    """組み合わせ1つのパラシュートのパラメータを計算する. エンジンプールで使う.
+
+    Args:
+        rocket_param (dict[str, Any]): ロケットパラメータ.
+
+    Returns:
+        dict[str, Any]: パラシュートの面積(parachute_area)と展開にかかる時間(parachute_full_deploy_time).
+    """
+    rocket_df = pd.DataFrame([{key: rocket_param[key] for key in PARACHUTE_PARAMETERS if key in rocket_param}])
+    parachute_area, parachute_full_deploy_time = compute_parachute_parameters(rocket_df)
+    return {
+        "parachute_area": float(parachute_area[0]),
+        "parachute_full_deploy_time": float(parachute_full_deploy_time[0]),
+    }
+
+
+def derive_chunk_parameters(
+    chunk_df: pd.DataFrame,
+) -> list[tuple[dict[str, Any], dict[str, Any], dict[str, Any]]]:
+    """組み合わせのブロックについて、導出されるパラメータをまとめて計算する.
+
+    ランチャーの高さ、風テーブル、パラシュートの面積を列ごとに計算し、組み合わせごとのパラメータに追加する.
+    風テーブルはブロック内で重複しない射場条件ごとに一度だけ計算する.
+
+    Args:
+        chunk_df (pd.DataFrame): パラメータの組み合わせ.
+
+    Returns:
+        list[tuple[dict[str, Any], dict[str, Any], dict[str, Any]]]: 組み合わせごとの
+            ロケット・シミュレーション・射場パラメータ.
+    """
+    rocket_df = chunk_df["rocket"]
+    launch_df = chunk_df["launch"]
+
+    # ランチャーの高さは、ランチャーの長さとピッチの角度から計算される
+    launcher_height = (
+        launch_df["elevation"].to_numpy(dtype=float)
+        + launch_df["launcher_length"].to_numpy(dtype=float)
+        * np.sin(launch_df["pitch"].to_numpy(dtype=float) * np.pi / 180)
+    ).tolist()
+
+    wind_keys = launch_df[["ground_wind_dir", "ground_wind_speed", "elevation", "wind_power_factor"]]
+    wind_codes, unique_wind_keys = pd.factorize(pd.MultiIndex.from_frame(wind_keys))
+    unique_wind_keys = unique_wind_keys.to_frame(index=False).to_numpy(dtype=float)
+    winds_tables = [
+        [tuple(wind) for wind in table]
+        for table in generate_wind_tables(*unique_wind_keys.T).tolist()
+    ]
+
+    parachute_area, parachute_full_deploy_time = compute_parachute_parameters(rocket_df)
+    parachute_area = parachute_area.tolist()
+    parachute_full_deploy_time = parachute_full_deploy_time.tolist()
+
+    params = []
+    for i, (rocket_param, simulation_param, launch_param) in enumerate(
+        zip(
+            rocket_df.to_dict("records"),
+            chunk_df["simulation"].to_dict("records"),
+            launch_df.to_dict("records"),
+            strict=True,
+        )
+    ):
+        rocket_param["parachute_area"] = parachute_area[i]
+        rocket_param["parachute_full_deploy_time"] = parachute_full_deploy_time[i]
+        # パラシュートは機体モデルではなくシミュレーションのプロパティとして設定する
+        simulation_param["parachute_area"] = parachute_area[i]
+        simulation_param["parachute_full_deploy_time"] = parachute_full_deploy_time[i]
+        simulation_param["launcher_height"] = launcher_height[i]
+        simulation_param["winds_table"] = winds_tables[wind_codes[i]]
+        params.append((rocket_param, simulation_param, launch_param))
+    return params
+
+
+def _process_parameter_combination(
+    args: tuple[str, dict[str, Any], dict[str, Any], dict[str, Any], dict[str, str], Path, Path],
+) -> tuple[str, Path]:
+    """個別のパラメータ組み合わせのXMLファイルを生成する関数"""
+    (
+        index,
+        rocket_param,
+        simulation_param,
+        launch_param,
+        templates,
+        rendered_param_dir,
+        unitconversions_template_path,
+    ) = args
+    shared_dir = rendered_param_dir / SHARED_DIR_NAME
+    output_dir = rendered_param_dir / f"{index}"
+    if not output_dir.exists():
+        output_dir.mkdir(parents=True, exist_ok=True)
+
     # XMLファイルの生成
     render_and_save_xml_files(
         output_dir,
@@ -79,16 +217,36 @@ def _process_parameter_combination(args: tuple[int, pd.Series, dict[str, str], P
         simulation_param,
         launch_param,
         unitconversions_template_path,
+        shared_dir=shared_dir,
     )
     return index, output_dir
 
 
-def generate_param_xml(params: DictConfig, template_dir: Path | str) -> pd.DataFrame:
+def _process_parameter_combinations(
+    args_list: list[tuple[str, dict[str, Any], dict[str, Any], dict[str, Any], dict[str, str], Path, Path]],
+) -> list[tuple[str, Path]]:
+    """複数のパラメータ組み合わせのXMLファイルを生成する. ワーカーに送る1つのタスクの単位."""
+    return [_process_parameter_combination(args) for args in args_list]
+
+
+def generate_param_xml(
+    params: DictConfig,
+    template_dir: Path | str,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    sampling: SamplingSchema | None = None,
+    output_properties: list[str] | None = None,
+    executor: Executor | None = None,
+) -> pd.DataFrame:
     """Generate parameter XML files for the simulation.
 
     Args:
         params (DictConfig): The parameters to generate the XML files.
         template_dir (Path | str): The path to the template directory.
+        chunk_size (int): The number of combinations generated and rendered at once.
+        sampling (SamplingSchema | None): How to draw the combinations. All combinations (grid) if None.
+        output_properties (list[str] | None): The captions of the logged properties. The ones the analyses
+            need if None.
+        executor (Executor | None): Where the XML files are rendered. The local processes if None.
 
     Returns:
         pd.DataFrame: DataFrame containing all parameter combinations.
@@ -100,62 +258,173 @@ def generate_param_xml(params: DictConfig, template_dir: Path | str) -> pd.DataF
         raise
 
     LOGGER.info("テンプレートファイルを読み込みます")
-    template_dir = Path(template_dir)
-    aircraft_dir = Path("aircraft/PQ_ROCKET")
-
-    try:
-        templates = {
-            "rocket": (template_dir / aircraft_dir / "pq_rocket.xml.j2").read_text(),
-            "simulation": (template_dir / "pq_simulation.xml.j2").read_text(),
-            "launch": (template_dir / aircraft_dir / "liftoff.xml.j2").read_text(),
-        }
-    except FileNotFoundError:
-        LOGGER.exception(f"テンプレートファイルが見つかりません: {template_dir}")
-        raise
+    templates = _load_templates(Path(template_dir))
 
     LOGGER.info("csvファイルの読み込みを行います")
+    telemetry = get_telemetry()
     try:
-        rocket_params = load_csv_to_dict(rocket_params_schema.model_dump())
-        simulation_params = load_csv_to_dict(simulation_params_schema.model_dump())
-        launch_params = load_csv_to_dict(launch_params_schema.model_dump())
+        with telemetry.stage("csv_load"):
+            rocket_params = load_csv_to_dict(rocket_params_schema.model_dump())
+            simulation_params = load_csv_to_dict(simulation_params_schema.model_dump())
+            launch_params = load_csv_to_dict(launch_params_schema.model_dump())
     except FileNotFoundError:
         LOGGER.exception("テンプレートで指定された、csvファイルが見つかりません")
         raise
 
     # 燃料テーブルの生成
     if not rocket_params.get("fuel_remaining_table"):
-        rocket_params["fuel_remaining_table"] = [
-            generate_fuel_remaining_table(thrust_table) for thrust_table in rocket_params["thrust_table"]
-        ]
-
-    # パラメータの組み合わせを生成
-    LOGGER.info("パラメータの組み合わせを生成します")
-    all_parameter_products = generate_dicts_product(
-        {
-            "rocket": rocket_params,
-            "simulation": simulation_params,
-            "launch": launch_params,
-        },
-    )
+        with telemetry.stage("csv_load"):
+            rocket_params["fuel_remaining_table"] = [
+                generate_fuel_remaining_table(thrust_table) for thrust_table in rocket_params["thrust_table"]
+            ]
+
+    # パラメータの組み合わせをブロックごとに生成し、XMLファイルを生成する
+    product_input = {
+        "rocket": rocket_params,
+        "simulation": simulation_params,
+        "launch": launch_params,
+    }
+    if sampling is None or sampling.method == "grid":
+        num_combinations = count_combinations(product_input)
+        chunks = iter_dicts_product_chunks(product_input, chunk_size)
+        LOGGER.info(f"パラメータの組み合わせを生成します: {num_combinations}件")
+    else:
+        num_combinations = sampling.num_samples
+        chunks = iter_sampled_chunks(product_input, sampling, chunk_size)
+        LOGGER.info(
+            f"パラメータの組み合わせをサンプリングします: {sampling.method}, {num_combinations}件 "
+            f"(全組み合わせは{count_combinations(product_input)}件)"
+        )
 
     LOGGER.info("XMLファイルの生成を行います")
-    rendered_param_dir = Path("temp/jsbsim/param-generated-xml")
-    unitconversions_template_path = template_dir / "unitconversions.xml"
-    args_list = [
-        (index, row, templates, rendered_param_dir, unitconversions_template_path)
-        for index, row in tqdm(all_parameter_products.iterrows(), desc="パラメータの組み合わせを生成中")
-    ]
+    # 前回のスイープの共有ファイルは使わない (既存のハードリンクは削除しても影響を受けない)
+    rmtree(RENDERED_PARAM_DIR / SHARED_DIR_NAME, ignore_errors=True)
+    # 上書きするので、前回のスイープを再開するときにXMLを使わないようにする
+    (RENDERED_PARAM_DIR / RENDERED_MARKER_NAME).unlink(missing_ok=True)
 
-    results = tqdm_process_map(
-        _process_parameter_combination,
-        args_list,
-        max_workers=cpu_count(),
-        total=len(args_list),
-        desc="XMLファイルを生成中",
+    all_parameter_products = _render_chunks(
+        chunks, num_combinations, templates, Path(template_dir), output_properties, executor
     )
 
-    # 結果をDataFrameに反映
-    for index, output_dir in results:
-        all_parameter_products.loc[index, "param_dir"] = output_dir
+    num_shared_files = len(list((RENDERED_PARAM_DIR / SHARED_DIR_NAME).iterdir()))
+    LOGGER.info(f"XMLファイルを生成しました: {num_combinations * 4}件 (重複を除いて{num_shared_files}件)")
 
     return all_parameter_products
+
+
+def render_param_combinations(
+    combinations_df: pd.DataFrame,
+    template_dir: Path | str,
+    output_properties: list[str] | None = None,
+    executor: Executor | None = None,
+) -> pd.DataFrame:
+    """指定した組み合わせのXMLファイルを、スイープのXMLと同じディレクトリに追加で生成する.
+
+    サロゲートモデルの改良のように、スイープの後で組み合わせを追加して実行する場合に使う.
+
+    Args:
+        combinations_df (pd.DataFrame): 組み合わせ. 列は generate_param_xml の戻り値の rocket, simulation, launch の列.
+        template_dir (Path | str): テンプレートのディレクトリ.
+        output_properties (list[str] | None): 出力するプロパティのキャプション. Noneの場合は集計に必要なもの.
+        executor (Executor | None): XMLを生成する場所. Noneの場合はこのマシンのプロセス.
+
+    Returns:
+        pd.DataFrame: 組み合わせに param_dir の列を加えたもの.
+    """
+    templates = _load_templates(Path(template_dir))
+    chunk_df = combinations_df[[column for column in combinations_df.columns if column[0] in PARAMETER_SECTIONS]]
+    return _render_chunks(
+        [chunk_df.copy()], len(chunk_df), templates, Path(template_dir), output_properties, executor
+    )
+
+
+def derive_combinations(
+    combinations_df: pd.DataFrame, base_index: Sequence[Hashable], overrides: pd.DataFrame, name_prefix: str
+) -> pd.DataFrame:
+    """既存の組み合わせの一部のパラメータを置き換えた組み合わせを作る. render_param_combinations に渡す.
+
+    Args:
+        combinations_df (pd.DataFrame): 既存の組み合わせ. 結果の列を含んでもよい.
+        base_index (Sequence[Hashable]): 元にする組み合わせのインデックス.
+        overrides (pd.DataFrame): 置き換えるパラメータの値. 列は (セクション名, パラメータ名). base_indexと同じ順.
+        name_prefix (str): 組み合わせの名前 (インデックス) の接頭辞. 名前は f"{name_prefix}_{番号}".
+
+    Returns:
+        pd.DataFrame: 組み合わせ. 列は rocket, simulation, launch の列.
+    """
+    parameter_columns = [
+        column
+        for column in combinations_df.columns
+        if isinstance(column, tuple) and column[0] in PARAMETER_SECTIONS
+    ]
+    derived_df = combinations_df.loc[list(base_index), parameter_columns].copy()
+    derived_df.columns = pd.MultiIndex.from_tuples(parameter_columns)
+    for column in overrides.columns:
+        derived_df[column] = overrides[column].to_numpy()
+    derived_df.index = pd.Index([f"{name_prefix}_{i}" for i in range(len(derived_df))])
+    return derived_df
+
+
+def _load_templates(template_dir: Path) -> dict[str, str]:
+    """テンプレートファイルを読み込む."""
+    aircraft_dir = Path("aircraft/PQ_ROCKET")
+    try:
+        return {
+            "rocket": (template_dir / aircraft_dir / "pq_rocket.xml.j2").read_text(),
+            "simulation": (template_dir / "pq_simulation.xml.j2").read_text(),
+            "launch": (template_dir / aircraft_dir / "liftoff.xml.j2").read_text(),
+        }
+    except FileNotFoundError:
+        LOGGER.exception(f"テンプレートファイルが見つかりません: {template_dir}")
+        raise
+
+
+def _render_chunks(
+    chunks: Iterable[pd.DataFrame],
+    num_combinations: int,
+    templates: dict[str, str],
+    template_dir: Path,
+    output_properties: list[str] | None,
+    executor: Executor | None,
+) -> pd.DataFrame:
+    """組み合わせのブロックごとにXMLファイルを生成し、param_dir の列を加えてまとめる."""
+    rendered_param_dir = RENDERED_PARAM_DIR
+    unitconversions_template_path = template_dir / "unitconversions.xml"
+    # 出力するプロパティは全組み合わせで共通
+    rendered_outputs = render_output_properties(ANALYSIS_OUTPUTS if output_properties is None else output_properties)
+
+    executor = executor or LocalExecutor()
+    max_workers = cpu_count() or 1
+    telemetry = get_telemetry()
+    chunk_dfs = []
+    with tqdm(total=num_combinations, desc="XMLファイルを生成中") as progress:
+        # 組み合わせの生成(product)とXMLのレンダリング(render)の時間は別々に記録する
+        for chunk_df in telemetry.iterate("product", chunks):
+            with telemetry.stage("product"):
+                args_list = [
+                    (
+                        index,
+                        rocket_param,
+                        {**simulation_param, "output_properties": rendered_outputs},
+                        launch_param,
+                        templates,
+                        rendered_param_dir,
+                        unitconversions_template_path,
+                    )
+                    for index, (rocket_param, simulation_param, launch_param) in zip(
+                        chunk_df.index, derive_chunk_parameters(chunk_df), strict=True
+                    )
+                ]
+            with telemetry.stage("render"):
+                batch_size = max(1, len(args_list) // (max_workers * 4))
+                tasks = [
+                    delayed(_process_parameter_combinations)(args_list[start : start + batch_size])
+                    for start in range(0, len(args_list), batch_size)
+                ]
+                output_dirs = [output_dir for batch in executor.run(tasks) for _, output_dir in batch]
+            progress.update(len(args_list))
+            # 結果をDataFrameに反映
+            chunk_df[("param_dir", "")] = output_dirs
+            chunk_dfs.append(chunk_df)
+
+    return pd.concat(chunk_dfs)
@@ -1,27 +1,72 @@
 """JSBSimのシミュレーションを実行する."""
 
 import logging
+import math
+import os
+import time
+from collections.abc import Hashable
 from os import PathLike, environ
 from pathlib import Path
-from shutil import copy
-from typing import Any
+from typing import Any, Literal
 
 import jsbsim
 import pandas as pd
 
+from trajecsim.jsbsim_support.batch_engine import get_batch_engine
+from trajecsim.jsbsim_support.descent import DescentSettleDetector, fast_forward_descent
+from trajecsim.jsbsim_support.engine_pool import (
+    BRANCH_LAUNCH_PARAMETERS,
+    BRANCH_SIMULATION_PARAMETERS,
+    COLD_START,
+    FLIGHT_PHASE_PROPERTY,
+    FRAME_PROPERTY,
+    OutputSampler,
+    append_final_state,
+    get_engine_pool,
+    get_phase_time_steps,
+)
+from trajecsim.jsbsim_support.generate_param_xml import derive_parachute_parameters, derive_simulation_parameters
+from trajecsim.jsbsim_support.output_properties import ANALYSIS_OUTPUTS
+from trajecsim.jsbsim_support.result_cache import ResultCache
+from trajecsim.jsbsim_support.schemas.batch_engine import BatchEngineSchema
+from trajecsim.jsbsim_support.schemas.chart import ChartSchema
+from trajecsim.jsbsim_support.trajectory import Trajectory
+from trajecsim.util.executor import Task
+from trajecsim.util.geodesy import geodesic_distance
+from trajecsim.util.summarize import DEFAULT_FLIGHT_PATH_TOLERANCE_M, analyze_trajectory
+from trajecsim.util.telemetry import get_telemetry
+
 # Get the directory where this script is located
 WORKING_DIR = Path("temp/")
 LOGGER = logging.getLogger(__name__)
 
 
 def run_jsb(
-    simulation_param_df: pd.Series | dict[str, Any], output_dir: PathLike[Any] | str, file_name_prefix: str = ""
+    simulation_param_df: pd.Series | dict[str, Any],
+    output_dir: PathLike[Any] | str,
+    file_name_prefix: str = "",
+    *,
+    engine_pool: bool = False,
+    save_csv: bool = True,
+    result_cache: ResultCache | None = None,
+    descent_fast_forward: bool = False,
+    output_properties: list[str] | None = None,
+    batch_engine: BatchEngineSchema | None = None,
 ) -> pd.Series:
     """JSBSimのシミュレーションを実行する.
 
+    出力はメモリ上のTrajectoryとして返す. CSVファイルへの保存は任意.
+
     Args:
         simulation_param_df (pd.Series | dict[str, Any]): シミュレーションパラメータ.
         output_dir (PathLike[Any] | str): 出力ディレクトリ.
+        engine_pool (bool): ワーカー内のFGFDMExecを再利用する. Falseの場合はスクリプトを毎回読み込む.
+        save_csv (bool): 出力をCSVファイルとして出力ディレクトリに保存する.
+        result_cache (ResultCache | None): 結果のキャッシュ. 入力が同じ組み合わせはシミュレーションしない.
+        descent_fast_forward (bool): パラシュート降下が落ち着いたら着地までを解析的に計算する.
+        output_properties (list[str] | None): 出力するプロパティ. Noneの場合は集計に必要なもの.
+        batch_engine (BatchEngineSchema | None): 指定した場合はJSBSimの代わりに一括積分エンジンで積分する.
+            engine_pool と descent_fast_forward は使わない.
 
     Returns:
         pd.Series: シミュレーションの結果.
@@ -30,19 +75,426 @@ def run_jsb(
     if not output_dir.exists():
         output_dir.mkdir(parents=True, exist_ok=True)
     temp_dir = Path(str(simulation_param_df.loc["param_dir"].iloc[0]))
+    output_dir_path = output_dir / f"{simulation_param_df.name}_{file_name_prefix}"
+    output_dir_path.mkdir(parents=True, exist_ok=True)
+    output_file = output_dir_path / "pq_rocket_output_raw.csv"
     environ["JSBSIM_DEBUG"] = "0"
+
+    start_wall = time.perf_counter()
+    cache_key = None
+    trajectory = None
+    start_type = None
+    integration_steps = 0
+    if result_cache is not None:
+        cache_key = result_cache.compute_key(
+            temp_dir,
+            **_cache_settings(
+                engine_pool=engine_pool, descent_fast_forward=descent_fast_forward, batch_engine=batch_engine
+            ),
+        )
+        trajectory = result_cache.get(cache_key)
+
+    telemetry = get_telemetry()
+    if trajectory is None:
+        with telemetry.stage("simulation"):
+            trajectory, start_type, integration_steps, simulation_wall_seconds = _simulate(
+                simulation_param_df,
+                temp_dir,
+                engine_pool=engine_pool,
+                descent_fast_forward=descent_fast_forward,
+                output_properties=output_properties,
+                batch_engine=batch_engine,
+            )
+        if result_cache is not None and cache_key is not None:
+            result_cache.put(cache_key, trajectory)
+    else:
+        simulation_wall_seconds = time.perf_counter() - start_wall
+
+    bytes_written = 0
+    if save_csv:
+        with telemetry.stage("csv_export"):
+            trajectory.to_csv(output_file)
+        bytes_written = output_file.stat().st_size
+    return pd.Series(
+        {
+            "raw_output_file": output_file,
+            "trajectory": trajectory,
+            "engine_start": start_type,
+            "cache_hit": start_type is None,
+            # 積分のステップ数、シミュレーション時間[s]、経過時間[s]、出力の行数、CSVのサイズ[bytes]
+            "run_metrics": {
+                "integration_steps": integration_steps,
+                "simulated_seconds": float(trajectory["Time"][-1]) if len(trajectory) else 0.0,
+                "simulation_wall_seconds": simulation_wall_seconds,
+                "output_rows": len(trajectory),
+                "bytes_written": bytes_written,
+            },
+        }
+    )
+
+
+def _simulate(
+    simulation_param_df: pd.Series,
+    temp_dir: Path,
+    *,
+    engine_pool: bool,
+    descent_fast_forward: bool,
+    output_properties: list[str] | None,
+    batch_engine: BatchEngineSchema | None = None,
+) -> tuple[Trajectory, str, int, float]:
+    """シミュレーションを実行して、出力と起動種別(warm/cold/branch/batch)、積分のステップ数、経過時間[s]を返す."""
+    if batch_engine is not None:
+        return get_batch_engine().run(
+            str(temp_dir),
+            simulation_param_df["launch"].to_dict(),
+            simulation_param_df["rocket"].to_dict(),
+            _engine_pool_simulation_param(simulation_param_df),
+            batch_engine,
+            output_properties=output_properties,
+        )
+    if engine_pool:
+        return get_engine_pool().run(
+            temp_dir,
+            simulation_param_df["launch"].to_dict(),
+            _engine_pool_simulation_param(simulation_param_df),
+            descent_fast_forward=descent_fast_forward,
+            output_properties=output_properties,
+        )
+
+    start_wall = time.perf_counter()
     fdm = jsbsim.FGFDMExec(str(temp_dir))
     # Disable debug output
     fdm.set_debug_level(0)
     fdm.load_script("pq_simulation.xml")
+    # 出力はメモリ上に記録するので、スクリプトの output はファイルに書かない (run_ic はヘッダーだけのファイルを作る)
+    fdm.disable_output()
     fdm.run_ic()
+    simulation_param = {
+        **simulation_param_df["simulation"].to_dict(),
+        **derive_simulation_parameters(simulation_param_df["launch"].to_dict()),
+    }
+    output_properties = ANALYSIS_OUTPUTS if output_properties is None else output_properties
+    sampler = OutputSampler(fdm, output_properties, simulation_param)
+    # スクリプトからは時間刻みを変えられないため、イベントが設定する飛行フェーズに合わせてここで変える
+    phase_time_steps = get_phase_time_steps(simulation_param)
+    phase_node = fdm.get_property_manager().get_node(FLIGHT_PHASE_PROPERTY)
+    dt = phase_time_steps[0]
+    descent_detector = DescentSettleDetector() if descent_fast_forward else None
     while fdm.run():
-        pass
-    output_dir_path = output_dir / f"{simulation_param_df.name}_{file_name_prefix}"
-    output_dir_path.mkdir(parents=True, exist_ok=True)
-    output_file = output_dir_path / "pq_rocket_output_raw.csv"
-    copy(
-        temp_dir / "pq_rocket_output_raw.csv",
-        output_file,
+        phase = int(phase_node.get_double_value())
+        sampler.update(dt, phase)
+        if phase_time_steps[phase] != dt:
+            dt = phase_time_steps[phase]
+            fdm.set_dt(dt)
+        if descent_detector is not None and descent_detector.update(fdm):
+            trajectory = fast_forward_descent(sampler.finish(), fdm, simulation_param, sampler.descent_output_interval)
+            return trajectory, COLD_START, int(fdm[FRAME_PROPERTY]), time.perf_counter() - start_wall
+    trajectory = append_final_state(sampler.finish(), fdm)
+    return trajectory, COLD_START, int(fdm[FRAME_PROPERTY]), time.perf_counter() - start_wall
+
+
+def _engine_pool_simulation_param(simulation_param_df: pd.Series) -> dict[str, Any]:
+    """エンジンプールに渡すシミュレーションパラメータ. パラシュートはロケットパラメータから計算して加える."""
+    return {
+        **simulation_param_df["simulation"].to_dict(),
+        **derive_parachute_parameters(simulation_param_df["rocket"].to_dict()),
+    }
+
+
+def _cache_settings(
+    *, engine_pool: bool, descent_fast_forward: bool, batch_engine: BatchEngineSchema | None
+) -> dict[str, object]:
+    """キャッシュのキーに含める実行時の設定. 一括積分エンジンの場合はJSBSimと別の結果として時間刻みも含める."""
+    if batch_engine is None:
+        return {"engine_pool": engine_pool, "descent_fast_forward": descent_fast_forward}
+    return {
+        "simulation_engine": "batch",
+        "time_step": batch_engine.time_step,
+        "descent_time_step": batch_engine.descent_time_step,
+    }
+
+
+def check_descent_fast_forward(
+    simulation_param_df: pd.Series,
+    output_dir: PathLike[Any] | str,
+    *,
+    engine_pool: bool = False,
+    result_cache: ResultCache | None = None,
+    output_properties: list[str] | None = None,
+) -> float:
+    """降下の早送りと通常の積分で着地点を比較する.
+
+    Args:
+        simulation_param_df (pd.Series): シミュレーションパラメータ.
+        output_dir (PathLike[Any] | str): 出力ディレクトリ.
+        engine_pool (bool): ワーカー内のFGFDMExecを再利用する.
+        result_cache (ResultCache | None): 結果のキャッシュ.
+        output_properties (list[str] | None): 出力するプロパティ.
+
+    Returns:
+        float: 着地点の差[m].
+    """
+    landing_points = []
+    for descent_fast_forward in (True, False):
+        trajectory = run_jsb(
+            simulation_param_df,
+            output_dir,
+            engine_pool=engine_pool,
+            save_csv=False,
+            result_cache=result_cache,
+            descent_fast_forward=descent_fast_forward,
+            output_properties=output_properties,
+        )["trajectory"]
+        landing_points.append((trajectory["Latitude"][-1], trajectory["Longitude"][-1]))
+    return float(geodesic_distance(*landing_points[0], *landing_points[1]))
+
+
+def check_batch_engine(
+    simulation_param_df: pd.Series,
+    output_dir: PathLike[Any] | str,
+    batch_engine: BatchEngineSchema,
+    *,
+    engine_pool: bool = False,
+    result_cache: ResultCache | None = None,
+    output_properties: list[str] | None = None,
+) -> float:
+    """一括積分エンジンとJSBSimで着地点を比較する.
+
+    Args:
+        simulation_param_df (pd.Series): シミュレーションパラメータ.
+        output_dir (PathLike[Any] | str): 出力ディレクトリ.
+        batch_engine (BatchEngineSchema): 一括積分エンジンの設定.
+        engine_pool (bool): JSBSimの実行でワーカー内のFGFDMExecを再利用する.
+        result_cache (ResultCache | None): 結果のキャッシュ.
+        output_properties (list[str] | None): 出力するプロパティ.
+
+    Returns:
+        float: 着地点の差[m].
+    """
+    landing_points = []
+    for settings in (batch_engine, None):
+        trajectory = run_jsb(
+            simulation_param_df,
+            output_dir,
+            engine_pool=engine_pool,
+            save_csv=False,
+            result_cache=result_cache,
+            output_properties=output_properties,
+            batch_engine=settings,
+        )["trajectory"]
+        landing_points.append((trajectory["Latitude"][-1], trajectory["Longitude"][-1]))
+    return float(geodesic_distance(*landing_points[0], *landing_points[1]))
+
+
+def run_jsb_and_analyze(
+    simulation_param_df: pd.Series,
+    output_dir: PathLike[Any] | str,
+    analysis_output_dirs: list[Path],
+    *,
+    engine_pool: bool = False,
+    save_csv: bool = True,
+    chart: ChartSchema | None = None,
+    keep_trajectory: bool = False,
+    result_cache: ResultCache | None = None,
+    descent_fast_forward: bool = False,
+    output_properties: list[str] | None = None,
+    batch_engine: BatchEngineSchema | None = None,
+    flight_path: Literal["kmz", "kml", "none"] = "kmz",
+    flight_path_tolerance_m: float = DEFAULT_FLIGHT_PATH_TOLERANCE_M,
+) -> pd.Series:
+    """JSBSimのシミュレーションを実行し、同じワーカー内で結果を集計する.
+
+    時系列データはメモリ上にあるうちに1度だけ走査し、親プロセスにはサマリーと極値分析の表だけを返す.
+    CSVファイルは集計でAoA列を追加した後に1度だけ保存する.
+
+    Args:
+        simulation_param_df (pd.Series): シミュレーションパラメータ.
+        output_dir (PathLike[Any] | str): 出力ディレクトリ.
+        analysis_output_dirs (list[Path]): 集計結果の出力先 (result_eachのグループごと).
+        engine_pool (bool): ワーカー内のFGFDMExecを再利用する.
+        save_csv (bool): 出力をCSVファイルとして出力ディレクトリに保存する.
+        chart (ChartSchema | None): 時系列のグラフの設定. Noneの場合はグラフを出力しない.
+        keep_trajectory (bool): 時系列データも親プロセスに返す.
+        result_cache (ResultCache | None): 結果のキャッシュ.
+        descent_fast_forward (bool): パラシュート降下が落ち着いたら着地までを解析的に計算する.
+        output_properties (list[str] | None): 出力するプロパティ.
+        batch_engine (BatchEngineSchema | None): 指定した場合は一括積分エンジンで積分する.
+        flight_path (Literal["kmz", "kml", "none"]): 飛行経路の出力方法 (analyze_trajectory).
+        flight_path_tolerance_m (float): 飛行経路を単純化する許容誤差[m].
+
+    Returns:
+        pd.Series: シミュレーションの結果と集計結果.
+    """
+    result = run_jsb(
+        simulation_param_df,
+        output_dir,
+        engine_pool=engine_pool,
+        save_csv=False,
+        result_cache=result_cache,
+        descent_fast_forward=descent_fast_forward,
+        output_properties=output_properties,
+        batch_engine=batch_engine,
     )
-    return pd.Series({"raw_output_file": output_file})
+    output_info_df = pd.concat([simulation_param_df, result])
+    output_info_df.name = simulation_param_df.name
+    start_wall = time.perf_counter()
+    analysis = analyze_trajectory(
+        output_info_df,
+        analysis_output_dirs,
+        chart=chart,
+        flight_path=flight_path,
+        flight_path_tolerance_m=flight_path_tolerance_m,
+        save_csv=save_csv,
+    )
+    result["run_metrics"]["analysis_wall_seconds"] = time.perf_counter() - start_wall
+    if save_csv:
+        result["run_metrics"]["bytes_written"] = result["raw_output_file"].stat().st_size
+    if not keep_trajectory:
+        result["trajectory"] = None
+    return pd.concat([result, analysis])
+
+
+def group_by_flight_prefix(
+    simulation_df: pd.DataFrame, model_keys: pd.Series, max_group_size: int
+) -> list[list[Hashable]]:
+    """飛行の前半を共有できる組み合わせをまとめる.
+
+    機体モデルと、分岐点より後にだけ影響するパラメータ(風、パラシュート)以外が同じ組み合わせを、
+    simulation_df の順にまとめる. 大きなグループは並列に実行できるように分け、風が同じ組み合わせを同じグループに入れる.
+
+    Args:
+        simulation_df (pd.DataFrame): 実行する組み合わせ.
+        model_keys (pd.Series): 組み合わせごとの機体モデルのキー (get_model_key).
+        max_group_size (int): グループの大きさの上限.
+
+    Returns:
+        list[list[Hashable]]: 組み合わせのグループ. 組み合わせがない場合は空.
+    """
+    if simulation_df.empty:
+        return []
+    key_columns = [
+        column
+        for column in simulation_df.columns
+        if (column[0] == "launch" and column[1] not in BRANCH_LAUNCH_PARAMETERS)
+        or (column[0] == "simulation" and column[1] not in BRANCH_SIMULATION_PARAMETERS)
+    ]
+    prefix_codes, _ = pd.factorize(
+        pd.MultiIndex.from_arrays([model_keys.loc[simulation_df.index], *(simulation_df[col] for col in key_columns)])
+    )
+    wind_columns = [("launch", key) for key in BRANCH_LAUNCH_PARAMETERS if ("launch", key) in simulation_df.columns]
+    groups: list[list[Hashable]] = []
+    for prefix_code in pd.unique(prefix_codes):
+        group_df = simulation_df[prefix_codes == prefix_code]
+        if wind_columns:
+            group_df = group_df.sort_values(wind_columns, kind="stable")
+        group_index = list(group_df.index)
+        chunk_size = math.ceil(len(group_index) / math.ceil(len(group_index) / max_group_size))
+        groups.extend(group_index[start : start + chunk_size] for start in range(0, len(group_index), chunk_size))
+    return groups
+
+
+def _uncached_members(
+    simulation_param_dfs: list[pd.Series],
+    result_cache: ResultCache | None,
+    *,
+    engine_pool: bool,
+    descent_fast_forward: bool,
+    batch_engine: BatchEngineSchema | None,
+) -> list[tuple[Path, pd.Series, dict[str, Any]]]:
+    """キャッシュにない組み合わせの (パラメータディレクトリ, パラメータ, エンジンに渡すシミュレーション設定).
+
+    Args:
+        simulation_param_dfs (list[pd.Series]): 組み合わせごとのシミュレーションパラメータ.
+        result_cache (ResultCache | None): 結果のキャッシュ.
+        engine_pool (bool): エンジンプールを使う.
+        descent_fast_forward (bool): パラシュート降下の後半を解析的に計算する.
+        batch_engine (BatchEngineSchema | None): 一括積分エンジンの設定.
+
+    Returns:
+        list[tuple[Path, pd.Series, dict[str, Any]]]: simulation_param_dfs の順.
+    """
+    members = []
+    for simulation_param_df in simulation_param_dfs:
+        param_dir = Path(str(simulation_param_df.loc["param_dir"].iloc[0]))
+        if result_cache is not None and result_cache.contains(
+            result_cache.compute_key(
+                param_dir,
+                **_cache_settings(
+                    engine_pool=engine_pool, descent_fast_forward=descent_fast_forward, batch_engine=batch_engine
+                ),
+            )
+        ):
+            continue
+        members.append((param_dir, simulation_param_df, _engine_pool_simulation_param(simulation_param_df)))
+    return members
+
+
+def run_jsb_group(
+    calls: list[Task],
+    simulation_param_dfs: list[pd.Series],
+    *,
+    engine_pool: bool = False,
+    result_cache: ResultCache | None = None,
+    descent_fast_forward: bool = False,
+    output_properties: list[str] | None = None,
+    batch_engine: BatchEngineSchema | None = None,
+) -> list[Any]:
+    """飛行の前半が同じ組み合わせ、または一括積分エンジンでまとめて積分する組み合わせを実行する.
+
+    エンジンプールでは、キャッシュにない組み合わせを JSBEnginePool.prepare_branches で前半を共有して実行しておき、
+    組み合わせごとの処理(calls)の中の run_jsb はその結果を使う. fork が使えない環境では1つずつ実行する.
+    一括積分エンジンでは、キャッシュにない組み合わせを BatchEngine.prepare でまとめて積分しておく.
+
+    Args:
+        calls (list[Task]): 組み合わせごとの処理 (run_jsb や run_jsb_and_analyze を joblib.delayed で包んだもの).
+        simulation_param_dfs (list[pd.Series]): 組み合わせごとのシミュレーションパラメータ. callsと同じ順.
+        engine_pool (bool): ワーカー内のFGFDMExecを再利用する. Falseの場合は前半を共有しない.
+        result_cache (ResultCache | None): 結果のキャッシュ. キャッシュにある組み合わせは実行しない.
+        descent_fast_forward (bool): パラシュート降下が落ち着いたら着地までを解析的に計算する.
+        output_properties (list[str] | None): 出力するプロパティ.
+        batch_engine (BatchEngineSchema | None): 指定した場合は一括積分エンジンでまとめて積分する.
+
+    Returns:
+        list[Any]: callsの戻り値.
+    """
+    if batch_engine is not None:
+        engine = get_batch_engine()
+        batch_members: list[tuple[str, dict[str, Any], dict[str, Any], dict[str, Any]]] = [
+            (str(param_dir), simulation_param_df["launch"].to_dict(), simulation_param_df["rocket"].to_dict(), param)
+            for param_dir, simulation_param_df, param in _uncached_members(
+                simulation_param_dfs,
+                result_cache,
+                engine_pool=engine_pool,
+                descent_fast_forward=descent_fast_forward,
+                batch_engine=batch_engine,
+            )
+        ]
+        if len(batch_members) > 1:
+            with get_telemetry().stage("simulation"):
+                engine.prepare(batch_members, batch_engine, output_properties=output_properties)
+        try:
+            return [func(*args, **kwargs) for func, args, kwargs in calls]
+        finally:
+            engine.discard_prepared()
+
+    pool = get_engine_pool()
+    if engine_pool and hasattr(os, "fork"):
+        branch_members: list[tuple[Path, dict[str, Any], dict[str, Any]]] = [
+            (param_dir, simulation_param_df["launch"].to_dict(), param)
+            for param_dir, simulation_param_df, param in _uncached_members(
+                simulation_param_dfs,
+                result_cache,
+                engine_pool=engine_pool,
+                descent_fast_forward=descent_fast_forward,
+                batch_engine=batch_engine,
+            )
+        ]
+        if len(branch_members) > 1:
+            with get_telemetry().stage("simulation"):
+                pool.prepare_branches(
+                    branch_members, descent_fast_forward=descent_fast_forward, output_properties=output_properties
+                )
+    try:
+        return [func(*args, **kwargs) for func, args, kwargs in calls]
+    finally:
+        pool.discard_prepared()
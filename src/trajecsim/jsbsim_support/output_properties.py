@@ -0,0 +1,80 @@
+"""シミュレーションで出力するプロパティの登録.
+
+pq_simulation.xml.j2 の output とエンジンプールの出力は、ここで選んだプロパティから作る.
+実行する集計に必要なプロパティだけを出力し、設定(misc.output_properties)で追加できる.
+"""
+
+from collections.abc import Iterable
+
+# 出力できるプロパティ (キャプション: (プロパティ名, unitconversions.xml の関数名, 単位変換係数))
+# 単位変換係数は unitconversions.xml の関数と同じ値
+OUTPUT_PROPERTIES: dict[str, tuple[str, str | None, float]] = {
+    "Latitude": ("position/lat-gc-deg", None, 1.0),
+    "Longitude": ("position/long-gc-deg", None, 1.0),
+    "Altitude": ("position/h-sl-meters", None, 1.0),
+    "Angle of Attack": ("aero/alpha-rad", None, 1.0),
+    "Angle of Sideslip": ("aero/beta-rad", None, 1.0),
+    "Acceleration": ("accelerations/udot-ft_sec2", "convert-ft_sec2-To-m_sec2", 0.3048),
+    "Thrust": ("external_reactions/thrust/magnitude", "convert-lbs-To-N", 4.448222),
+    "True Velocity": ("velocities/vtrue-fps", "convert-fps-To-ms", 0.3048),
+    "Ground Velocity": ("velocities/vg-fps", "convert-fps-To-m_s", 0.3048),
+    "Pitch": ("attitude/phi-rad", "convert-rad-To-deg", 57.29577951),
+    "Roll": ("attitude/theta-rad", "convert-rad-To-deg", 57.29577951),
+    "Yaw": ("attitude/psi-rad", "convert-rad-To-deg", 57.29577951),
+    "Dynamic Pressure": ("aero/qbar-psf", "convert-psf-To-Pa", 47.8803),
+    "parachute_deploy_gain": ("fcs/parachute_reef_pos_norm", None, 1.0),
+    "Mach": ("velocities/mach", None, 1.0),
+    "Mass": ("inertia/mass-slugs", "convert-slugs-To-kg", 14.5939),
+    "CG X": ("inertia/cg-x-in", "convert-in-To-m", 0.0254),
+    "Roll Rate": ("velocities/p-rad_sec", "convert-rad_sec-To-deg_sec", 57.29577951),
+    "Pitch Rate": ("velocities/q-rad_sec", "convert-rad_sec-To-deg_sec", 57.29577951),
+    "Yaw Rate": ("velocities/r-rad_sec", "convert-rad_sec-To-deg_sec", 57.29577951),
+    "Descent Rate": ("velocities/v-down-fps", "convert-fps-To-m_s", 0.3048),
+    "Air Density": ("atmosphere/rho-slugs_ft3", "convert-slugs_ft3-To-kg_m3", 515.378819),
+}
+
+# 着地点の計算に必要なプロパティ. 常に出力する
+POSITION_OUTPUTS = ["Latitude", "Longitude", "Altitude"]
+# サマリー、極値分析、KMLに必要なプロパティ
+ANALYSIS_OUTPUTS = [
+    "Latitude",
+    "Longitude",
+    "Altitude",
+    "Angle of Attack",
+    "Angle of Sideslip",
+    "Acceleration",
+    "Thrust",
+    "True Velocity",
+    "Ground Velocity",
+    "Pitch",
+    "Roll",
+    "Yaw",
+    "Dynamic Pressure",
+    "parachute_deploy_gain",
+]
+
+
+def resolve_output_properties(analysis: bool, extra_outputs: Iterable[str] = ()) -> list[str]:
+    """出力するプロパティを決める.
+
+    Args:
+        analysis (bool): サマリー、極値分析、KMLの集計を行う.
+        extra_outputs (Iterable[str]): 追加で出力するプロパティのキャプション.
+
+    Raises:
+        ValueError: 登録されていないプロパティが指定された場合.
+
+    Returns:
+        list[str]: 出力するプロパティのキャプション. OUTPUT_PROPERTIES の順.
+    """
+    extra_outputs = list(extra_outputs)
+    unknown_outputs = [caption for caption in extra_outputs if caption not in OUTPUT_PROPERTIES]
+    if unknown_outputs:
+        raise ValueError(f"出力できないプロパティです: {unknown_outputs} (指定できるもの: {list(OUTPUT_PROPERTIES)})")
+    selected = {*POSITION_OUTPUTS, *(ANALYSIS_OUTPUTS if analysis else []), *extra_outputs}
+    return [caption for caption in OUTPUT_PROPERTIES if caption in selected]
+
+
+def render_output_properties(output_properties: Iterable[str]) -> list[tuple[str, str, str | None]]:
+    """pq_simulation.xml.j2 の output に渡す (キャプション, プロパティ名, 単位変換の関数名) のリスト."""
+    return [(caption, *OUTPUT_PROPERTIES[caption][:2]) for caption in output_properties]
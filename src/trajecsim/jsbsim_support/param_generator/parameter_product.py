@@ -1,94 +1,118 @@
-import itertools
+from collections.abc import Iterator
 
+import numpy as np
 import pandas as pd
 
+# 一度に生成する組み合わせの数
+DEFAULT_CHUNK_SIZE = 10000
 
-def generate_dicts_product(data_input: dict[str, dict[str, list[int]]]) -> pd.DataFrame:
-    """Generate the Cartesian product of all parameter combinations.
-
-    Args:
-        data_input (dict[str, dict[str, list[int]]]): The input dictionary containing parameter lists.
 
-    Returns:
-        pd.DataFrame: DataFrame containing all parameter combinations with representative values as index.
-    """
-    # Extract all lists and their corresponding hierarchical column names
+def _collect_product_columns(
+    data_input: dict[str, dict[str, list[int]]],
+) -> tuple[list[list[object]], list[tuple[str, str]]]:
+    """Collect the non-empty parameter lists and their hierarchical column names in a consistent order."""
     lists_for_product = []
     product_column_names = []  # Tuples like ('A', 'a') for MultiIndex
 
-    # For representative values (excluding single-element lists)
-    representative_lists = []
-    representative_column_names = []
-
-    # Iterate through data_input. To ensure consistent column order in df_step2_product,
-    # especially if the input dictionary order could vary, sort keys.
-    sorted_outer_keys = sorted(data_input.keys())
-
-    for outer_key in sorted_outer_keys:
+    # Iterate through data_input. To ensure consistent column order, sort keys.
+    for outer_key in sorted(data_input.keys()):
         inner_dict = data_input[outer_key]
-        sorted_inner_keys = sorted(inner_dict.keys())
-        for inner_key in sorted_inner_keys:
+        for inner_key in sorted(inner_dict.keys()):
             value_list = inner_dict[inner_key]
             # Skip empty lists
             if not value_list:
                 continue
             lists_for_product.append(value_list)
             product_column_names.append((outer_key, inner_key))
+    return lists_for_product, product_column_names
+
+
+def count_combinations(data_input: dict[str, dict[str, list[int]]]) -> int:
+    """Count the parameter combinations without generating them.
+
+    Args:
+        data_input (dict[str, dict[str, list[int]]]): The input dictionary containing parameter lists.
+
+    Returns:
+        int: The number of combinations.
+    """
+    lists_for_product, _ = _collect_product_columns(data_input)
+    return int(np.prod([len(value_list) for value_list in lists_for_product])) if lists_for_product else 0
+
+
+def iter_dicts_product_chunks(
+    data_input: dict[str, dict[str, list[int]]],
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Iterator[pd.DataFrame]:
+    """Generate the Cartesian product of all parameter combinations lazily, in chunks.
 
-            # Only include lists with more than one element for representative values
-            if len(value_list) > 1:
-                representative_lists.append(value_list)
-                representative_column_names.append((outer_key, inner_key))
+    The rows are in the same order as `itertools.product`. Each chunk is decoded from the row numbers
+    (mixed radix) with NumPy, so memory use is bounded by the chunk size.
+
+    Args:
+        data_input (dict[str, dict[str, list[int]]]): The input dictionary containing parameter lists.
+        chunk_size (int): The maximum number of rows per chunk.
+
+    Yields:
+        pd.DataFrame: Chunks of combinations with representative values as index.
+    """
+    lists_for_product, product_column_names = _collect_product_columns(data_input)
+    if not lists_for_product:
+        return
+
+    columns = pd.MultiIndex.from_tuples(product_column_names)
+    sizes = np.array([len(value_list) for value_list in lists_for_product], dtype=np.int64)
+    # The last column changes fastest, like itertools.product
+    strides = np.cumprod(np.append(sizes[1:], 1)[::-1])[::-1]
+    total = int(np.prod(sizes))
+    # pd.Series infers the same dtype as a DataFrame column built from the product tuples
+    value_arrays = [pd.Series(value_list).to_numpy() for value_list in lists_for_product]
+
+    # Only lists with more than one element appear in the representative index
+    representative_labels = [
+        (i, np.array([f"{outer_key}_{inner_key}={value}" for value in value_list], dtype=object))
+        for i, ((outer_key, inner_key), value_list) in enumerate(
+            zip(product_column_names, lists_for_product, strict=True)
+        )
+        if len(value_list) > 1
+    ]
+
+    for start in range(0, total, chunk_size):
+        positions = np.arange(start, min(start + chunk_size, total), dtype=np.int64)
+        value_indices = [(positions // stride) % size for stride, size in zip(strides, sizes, strict=True)]
+        df = pd.DataFrame(
+            {i: values[value_index] for i, (values, value_index) in enumerate(zip(value_arrays, value_indices))}
+        )
+        df.columns = columns
+        if representative_labels:
+            index = representative_labels[0][1][value_indices[representative_labels[0][0]]]
+            for i, labels in representative_labels[1:]:
+                index = index + "_" + labels[value_indices[i]]
+            df.index = pd.Index(index, dtype=object)
+        else:
+            df.index = pd.RangeIndex(start, start + len(positions))
+        yield df
+
+
+def generate_dicts_product(data_input: dict[str, dict[str, list[int]]]) -> pd.DataFrame:
+    """Generate the Cartesian product of all parameter combinations.
+
+    Args:
+        data_input (dict[str, dict[str, list[int]]]): The input dictionary containing parameter lists.
+
+    Returns:
+        pd.DataFrame: DataFrame containing all parameter combinations with representative values as index.
+    """
+    lists_for_product, product_column_names = _collect_product_columns(data_input)
 
     # If no valid parameters remain after filtering, return empty DataFrame
     if not lists_for_product:
         return pd.DataFrame(columns=pd.MultiIndex.from_tuples(product_column_names))
 
-    if lists_for_product and all(len(lst) == 1 for lst in lists_for_product):
-        single_row = [lst[0] for lst in lists_for_product]
-        df = pd.DataFrame([single_row], columns=pd.MultiIndex.from_tuples(product_column_names))
+    df = pd.concat(list(iter_dicts_product_chunks(data_input)))
+    if all(len(value_list) == 1 for value_list in lists_for_product):
         # Set name for the single case
         df.name = "single_combination"
-        return df
-
-    # Generate the Cartesian product using itertools.product
-    cartesian_product_tuples = list(itertools.product(*lists_for_product))
-
-    # Create the product DataFrame with MultiIndex columns
-    df = pd.DataFrame(cartesian_product_tuples, columns=pd.MultiIndex.from_tuples(product_column_names))
-
-    # Generate representative values (combinations excluding single-element lists)
-    if representative_lists:
-        representative_combinations = list(itertools.product(*representative_lists))
-
-        # Create representative index names for each row
-        representative_index = []
-
-        # Map each full combination to its representative value
-        for full_combination in cartesian_product_tuples:
-            # Extract only the values corresponding to multi-element lists
-            representative_dict = {}
-            rep_idx = 0
-            for i, (col_name, value) in enumerate(zip(product_column_names, full_combination)):
-                # Check if this column corresponds to a multi-element list
-                if rep_idx < len(representative_column_names) and col_name == representative_column_names[rep_idx]:
-                    # Create key name from the hierarchical column name
-                    if isinstance(col_name, tuple):
-                        key_name = f"{col_name[0]}_{col_name[1]}"
-                    else:
-                        key_name = str(col_name)
-                    representative_dict[key_name] = value
-                    rep_idx += 1
-
-            # Convert dictionary to a string representation
-            dict_str = "_".join([f"{k}={v}" for k, v in representative_dict.items()])
-            representative_index.append(str(dict_str))
-
-        # Set the representative values as the index
-        df.index = representative_index
-        df.name = "combinations_with_representative_index"
     else:
-        # No lists with multiple elements, so no representative values
-        df.name = "all_single_element_lists"
-
+        df.name = "combinations_with_representative_index"
     return df
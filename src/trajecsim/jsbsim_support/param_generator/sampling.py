@@ -0,0 +1,168 @@
+"""サンプリングによるパラメータの組み合わせの生成を行うモジュール.
+
+全組み合わせ(generate_dicts_product)の代わりに、空間充填的な実験計画でnum_samples個の組み合わせを作る.
+計画は [0, 1) の一様な点として作り、パラメータごとに分布(distributions)または指定された値の選択に変換する.
+"""
+
+from collections.abc import Iterator
+from statistics import NormalDist
+
+import numpy as np
+import numpy.typing as npt
+import pandas as pd
+
+from trajecsim.jsbsim_support.param_generator.parameter_product import DEFAULT_CHUNK_SIZE
+from trajecsim.jsbsim_support.schemas.sampling import DistributionSchema, SamplingSchema
+
+# scipy のインポート（オプション. Sobol列に使う）
+try:
+    from scipy.stats import qmc
+
+    SCIPY_AVAILABLE = True
+except ImportError:
+    SCIPY_AVAILABLE = False
+
+# 正規分布の逆関数に渡す値の範囲. 0と1では無限大になるため
+UNIT_EPSILON = 1e-12
+
+
+def _first_primes(count: int) -> list[int]:
+    primes: list[int] = []
+    candidate = 2
+    while len(primes) < count:
+        if all(candidate % prime for prime in primes):
+            primes.append(candidate)
+        candidate += 1
+    return primes
+
+
+def _halton(num_samples: int, dimensions: int, rng: np.random.Generator) -> npt.NDArray[np.float64]:
+    """Halton列. 乱数でずらして(Cranley-Patterson回転)、シードごとに異なる点列にする."""
+    design = np.empty((num_samples, dimensions))
+    for dimension, base in enumerate(_first_primes(dimensions)):
+        # 0番目の点(原点)は使わない
+        remaining = np.arange(1, num_samples + 1)
+        values = np.zeros(num_samples)
+        factor = 1.0 / base
+        while np.any(remaining > 0):
+            values += factor * (remaining % base)
+            remaining //= base
+            factor /= base
+        design[:, dimension] = values
+    return (design + rng.random(dimensions)) % 1.0
+
+
+def generate_unit_design(
+    method: str, num_samples: int, dimensions: int, seed: int | None = 0
+) -> npt.NDArray[np.float64]:
+    """[0, 1) の一様な実験計画を作る.
+
+    Args:
+        method (str): random, lhs, sobol, halton のいずれか.
+        num_samples (int): 点の数.
+        dimensions (int): 次元.
+        seed (int | None): 乱数のシード.
+
+    Raises:
+        ImportError: sobol でscipyがインストールされていない場合.
+        ValueError: methodが不正な場合.
+
+    Returns:
+        npt.NDArray[np.float64]: num_samples x dimensions の配列.
+    """
+    rng = np.random.default_rng(seed)
+    if dimensions == 0:
+        return np.empty((num_samples, 0))
+    if method == "random":
+        return rng.random((num_samples, dimensions))
+    if method == "lhs":
+        # 各次元をnum_samples個の区間に分け、区間ごとに1点ずつ置く
+        strata = np.column_stack([rng.permutation(num_samples) for _ in range(dimensions)])
+        return (strata + rng.random((num_samples, dimensions))) / num_samples
+    if method == "halton":
+        return _halton(num_samples, dimensions, rng)
+    if method == "sobol":
+        if not SCIPY_AVAILABLE:
+            raise ImportError("Sobol列によるサンプリングにはscipyが必要です")
+        return qmc.Sobol(d=dimensions, scramble=True, seed=rng).random(num_samples)
+    raise ValueError(f"サンプリングの方法が不正です: {method}")
+
+
+def _transform(unit_values: npt.NDArray[np.float64], distribution: DistributionSchema) -> npt.NDArray[np.float64]:
+    """[0, 1) の値を分布に従う値に変換する."""
+    if distribution.type == "uniform":
+        # DistributionSchema の検証で uniform には low と high がある
+        assert distribution.low is not None  # noqa: S101
+        assert distribution.high is not None  # noqa: S101
+        return distribution.low + unit_values * (distribution.high - distribution.low)
+
+    # DistributionSchema の検証で normal には mean と std がある
+    assert distribution.mean is not None  # noqa: S101
+    assert distribution.std is not None  # noqa: S101
+    normal = NormalDist(distribution.mean, distribution.std)
+    clipped = np.clip(unit_values, UNIT_EPSILON, 1 - UNIT_EPSILON)
+    values = np.array([normal.inv_cdf(value) for value in clipped.tolist()])
+    low = -np.inf if distribution.low is None else distribution.low
+    high = np.inf if distribution.high is None else distribution.high
+    return np.clip(values, low, high)
+
+
+def iter_sampled_chunks(
+    data_input: dict[str, dict[str, list[object]]],
+    sampling: SamplingSchema,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Iterator[pd.DataFrame]:
+    """サンプリングした組み合わせをブロックごとに生成する.
+
+    列と型は iter_dicts_product_chunks と同じで、インデックスは "sample=<番号>".
+
+    Args:
+        data_input (dict[str, dict[str, list[object]]]): パラメータの候補値.
+        sampling (SamplingSchema): サンプリングの設定.
+        chunk_size (int): 1ブロックの組み合わせの数.
+
+    Raises:
+        ValueError: distributionsに存在しないパラメータが指定された場合.
+
+    Yields:
+        pd.DataFrame: 組み合わせのブロック.
+    """
+    column_names = [
+        (outer_key, inner_key)
+        for outer_key in sorted(data_input.keys())
+        for inner_key in sorted(data_input[outer_key].keys())
+        if data_input[outer_key][inner_key]
+    ]
+    distributions = {tuple(key.split(".", 1)): distribution for key, distribution in sampling.distributions.items()}
+    unknown_keys = [".".join(key) for key in distributions if key not in column_names]
+    if unknown_keys:
+        raise ValueError(f"distributionsのパラメータが存在しません: {unknown_keys}")
+
+    # 分布を指定したパラメータと、複数の値から選ぶパラメータが計画の次元になる
+    sampled_columns = [
+        column for column in column_names if column in distributions or len(data_input[column[0]][column[1]]) > 1
+    ]
+    num_samples = sampling.num_samples
+    design = generate_unit_design(sampling.method, num_samples, len(sampled_columns), sampling.seed)
+
+    columns = {}
+    for column in column_names:
+        value_list = data_input[column[0]][column[1]]
+        if column in distributions:
+            columns[column] = _transform(design[:, sampled_columns.index(column)], distributions[column])
+            continue
+        # pd.Series は全組み合わせのDataFrameの列と同じ型を推論する
+        values = pd.Series(value_list).to_numpy()
+        if column in sampled_columns:
+            unit_values = design[:, sampled_columns.index(column)]
+            columns[column] = values[np.minimum((unit_values * len(values)).astype(int), len(values) - 1)]
+        else:
+            columns[column] = values[np.zeros(num_samples, dtype=int)]
+
+    width = len(str(max(num_samples - 1, 0)))
+    for start in range(0, num_samples, chunk_size):
+        stop = min(start + chunk_size, num_samples)
+        df = pd.DataFrame({i: columns[column][start:stop] for i, column in enumerate(column_names)})
+        df.columns = pd.MultiIndex.from_tuples(column_names)
+        df.index = pd.Index([f"sample={i:0{width}d}" for i in range(start, stop)], dtype=object)
+        yield df
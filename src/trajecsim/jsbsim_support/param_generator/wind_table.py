@@ -1,6 +1,6 @@
 """風テーブル生成を行うモジュール"""
 
-import pandas as pd
+import numpy as np
 
 
 def generate_wind_table(
@@ -25,33 +25,53 @@ def generate_wind_table(
     Returns:
         list[tuple[float, float, float]]: List of (altitude_m, speed_mps, direction_deg) tuples.
     """
-    # Generate altitudes from 0 to 10,000 meters, every 100 meters.
-    altitudes_m_list = list(range(0, 10001, 100))
-    altitudes_s = pd.Series(altitudes_m_list, dtype=float)
+    return [
+        tuple(wind)
+        for wind in generate_wind_tables(
+            np.array([ground_wind_dir], dtype=float),
+            np.array([ground_wind_speed], dtype=float),
+            np.array([ref_altitude], dtype=float),
+            np.array([wind_power_factor], dtype=float),
+        )[0].tolist()
+    ]
+
 
-    # Calculate relative heights (h / H_REF).
-    relative_heights_s = altitudes_s / ref_altitude
+def generate_wind_tables(
+    ground_wind_dir: np.ndarray,
+    ground_wind_speed: np.ndarray,
+    ref_altitude: np.ndarray,
+    wind_power_factor: np.ndarray,
+) -> np.ndarray:
+    """Generate the wind tables of many parameter combinations at once (see generate_wind_table).
+
+    Args:
+        ground_wind_dir (np.ndarray): The ground wind directions (degrees).
+        ground_wind_speed (np.ndarray): The wind speeds (m/s) at the reference height.
+        ref_altitude (np.ndarray): The reference heights (m).
+        wind_power_factor (np.ndarray): The exponents alpha for the power law.
+
+    Returns:
+        np.ndarray: Array of shape (combinations, altitudes, 3) with (altitude_m, speed_mps, direction_deg).
+    """
+    ground_wind_dir = np.asarray(ground_wind_dir, dtype=float)[:, np.newaxis]
+    ground_wind_speed = np.asarray(ground_wind_speed, dtype=float)[:, np.newaxis]
+    ref_altitude = np.asarray(ref_altitude, dtype=float)[:, np.newaxis]
+    wind_power_factor = np.asarray(wind_power_factor, dtype=float)[:, np.newaxis]
+
+    # Generate altitudes from 0 to 10,000 meters, every 100 meters.
+    altitudes = np.arange(0, 10001, 100, dtype=float)[np.newaxis, :]
 
     # Calculate the power term (h / H_REF)^alpha.
-    power_terms_s = relative_heights_s.pow(wind_power_factor)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        power_terms = np.power(altitudes / ref_altitude, wind_power_factor)
 
     # Explicitly define behavior at h=0 (the first altitude point).
-    if not altitudes_s.empty and altitudes_s.iloc[0] == 0.0:
-        idx_first_element = altitudes_s.index[0]
-
-        if wind_power_factor > 0:
-            power_terms_s.loc[idx_first_element] = 0.0
-        elif wind_power_factor == 0:
-            power_terms_s.loc[idx_first_element] = 1.0
-        else:  # wind_power_factor < 0
-            power_terms_s.loc[idx_first_element] = 1.0
+    power_terms[:, 0] = np.where(wind_power_factor[:, 0] > 0, 0.0, 1.0)
 
-    wind_speeds_s = ground_wind_speed * power_terms_s
+    wind_speeds = ground_wind_speed * power_terms
 
     # Wind direction is assumed constant with altitude, equal to ground_wind_dir.
-    wind_directions_list = [float(ground_wind_dir)] * len(altitudes_m_list)
-
-    return [
-        (altitude, speed, direction)
-        for altitude, speed, direction in zip(altitudes_s, wind_speeds_s, wind_directions_list, strict=False)
-    ]
+    return np.stack(
+        np.broadcast_arrays(altitudes, wind_speeds, ground_wind_dir),
+        axis=-1,
+    )
@@ -1,11 +1,20 @@
 """XMLレンダリングを行うモジュール"""
 
+import hashlib
+import os
+from functools import lru_cache
 from pathlib import Path
 from shutil import copy
 
 from jinja2 import Template
 
 
+@lru_cache(maxsize=16)
+def _compile_template(template: str) -> Template:
+    """テンプレートをコンパイルする. ワーカーごとに一度だけコンパイルされる."""
+    return Template(template)
+
+
 def render_template(template: str, render_dict: dict[str, any]) -> str:
     """Render the simulation XML.
 
@@ -16,8 +25,43 @@ def render_template(template: str, render_dict: dict[str, any]) -> str:
     Returns:
         str: The rendered XML.
     """
-    template = Template(template)
-    return template.render(**render_dict)
+    return _compile_template(template).render(**render_dict)
+
+
+def store_shared_document(shared_dir: Path, content: bytes, suffix: str = ".xml") -> Path:
+    """内容のハッシュ値をファイル名にして、同じ内容のファイルを一度だけ保存する.
+
+    Args:
+        shared_dir (Path): 共有ファイルのディレクトリ.
+        content (bytes): ファイルの内容.
+        suffix (str): 拡張子.
+
+    Returns:
+        Path: 共有ファイルのパス.
+    """
+    shared_path = shared_dir / f"{hashlib.sha256(content).hexdigest()}{suffix}"
+    if not shared_path.exists():
+        shared_dir.mkdir(parents=True, exist_ok=True)
+        # 複数のワーカーが同時に書き込んでも壊れないように、一時ファイルから置き換える
+        temp_path = shared_dir / f"{shared_path.name}.{os.getpid()}.tmp"
+        temp_path.write_bytes(content)
+        temp_path.replace(shared_path)
+        shared_path.chmod(0o444)
+    return shared_path
+
+
+def link_shared_document(shared_path: Path, output_path: Path) -> None:
+    """共有ファイルを出力先にハードリンクする. ハードリンクできない場合はコピーする.
+
+    Args:
+        shared_path (Path): 共有ファイルのパス.
+        output_path (Path): 出力先.
+    """
+    output_path.unlink(missing_ok=True)
+    try:
+        output_path.hardlink_to(shared_path)
+    except OSError:
+        copy(shared_path, output_path)
 
 
 def render_and_save_xml_files(
@@ -29,9 +73,13 @@ def render_and_save_xml_files(
     simulation_param: dict,
     launch_param: dict,
     unitconversions_template_path: Path,
+    shared_dir: Path | None = None,
 ) -> None:
     """シミュレーションのXMLファイルをレンダリングして保存する.
 
+    shared_dirを指定した場合は、レンダリング結果を内容ごとに一度だけ共有ディレクトリに保存し、
+    出力ディレクトリにはそのハードリンクを置く.
+
     Args:
         output_dir (Path): 出力ディレクトリ.
         rocket_template (str): ロケットのXMLテンプレート.
@@ -41,20 +89,28 @@ def render_and_save_xml_files(
         simulation_param (dict): シミュレーションのパラメータ.
         launch_param (dict): 起動のパラメータ.
         unitconversions_template_path (Path): 単位変換のテンプレートパス.
+        shared_dir (Path | None): 共有ファイルのディレクトリ.
     """
     aircraft_output_dir = output_dir / "aircraft" / "PQ_ROCKET"
     if not aircraft_output_dir.exists():
         aircraft_output_dir.mkdir(parents=True, exist_ok=True)
 
-    rocket_xml = render_template(rocket_template, rocket_param)
-    simulation_xml = render_template(simulation_template, simulation_param)
-    launch_xml = render_template(launch_template, launch_param)
+    rendered = {
+        aircraft_output_dir / "pq_rocket.xml": render_template(rocket_template, rocket_param),
+        output_dir / "pq_simulation.xml": render_template(simulation_template, simulation_param),
+        aircraft_output_dir / "liftoff.xml": render_template(launch_template, launch_param),
+    }
 
-    with (aircraft_output_dir / "pq_rocket.xml").open("w") as f:
-        f.write(rocket_xml)
-    with (output_dir / "pq_simulation.xml").open("w") as f:
-        f.write(simulation_xml)
-    with (aircraft_output_dir / "liftoff.xml").open("w") as f:
-        f.write(launch_xml)
+    if shared_dir is None:
+        for output_path, content in rendered.items():
+            with output_path.open("w") as f:
+                f.write(content)
+        copy(unitconversions_template_path, output_dir / "unitconversions.xml")
+        return
 
-    copy(unitconversions_template_path, output_dir / "unitconversions.xml")
+    for output_path, content in rendered.items():
+        link_shared_document(store_shared_document(shared_dir, content.encode()), output_path)
+    link_shared_document(
+        store_shared_document(shared_dir, unitconversions_template_path.read_bytes()),
+        output_dir / "unitconversions.xml",
+    )
@@ -6,6 +6,7 @@ import pandas as pd
 from omegaconf import DictConfig, ListConfig, OmegaConf
 
 from trajecsim.jsbsim_support.schemas.launch import LaunchConfig
+from trajecsim.jsbsim_support.schemas.misc import MiscSchema
 from trajecsim.jsbsim_support.schemas.rocket import PqRocketSchema
 from trajecsim.jsbsim_support.schemas.simulation import SimulationSchema
 
@@ -53,6 +54,20 @@ def convert_omegaconf_to_schema(
     return rocket_params, simulation_params, launch_params
 
 
+def convert_omegaconf_to_misc_schema(params: DictConfig | ListConfig) -> MiscSchema:
+    """Convert the misc section of the YAML parameters to the schema.
+
+    Args:
+        params (DictConfig | ListConfig): The YAML parameters.
+
+    Returns:
+        MiscSchema: The converted misc parameters. Defaults are used if the section is missing.
+    """
+    if "misc" not in params or params.misc is None:
+        return MiscSchema()
+    return MiscSchema(**OmegaConf.to_container(params.misc, resolve=True))
+
+
 def load_csv_to_tuple_list(csv_path: Path | str) -> list[tuple[float, float]] | Path:
     """Load the CSV file to a list of tuples.
 
@@ -0,0 +1,127 @@
+"""シミュレーション結果の永続キャッシュ.
+
+レンダリング済みのXML一式(推力・燃料・風のテーブルを含む)、JSBSimのバージョン、実行方式から
+キーを計算し、シミュレーション出力(Trajectory)を保存する. 入力が前回のスイープと同じ組み合わせは
+シミュレーションせずにキャッシュから読み込む.
+キャッシュの合計サイズが上限を超えた場合は、最後に使われた日時が古いものから削除する(LRU).
+"""
+
+import hashlib
+import logging
+import os
+from os import PathLike
+from pathlib import Path
+from typing import Any
+
+import jsbsim
+import numpy as np
+
+from trajecsim.jsbsim_support.trajectory import Trajectory
+
+LOGGER = logging.getLogger(__name__)
+
+# シミュレーションの実装を変えて出力が変わる場合は値を変えて、古いキャッシュを使わないようにする
+CACHE_VERSION = "2"
+CACHE_SUFFIX = ".npz"
+
+
+class ResultCache:
+    """ディレクトリに保存するシミュレーション結果のキャッシュ."""
+
+    def __init__(self, cache_dir: PathLike[Any] | str, max_size_mb: float = 2048) -> None:
+        """初期化
+
+        Args:
+            cache_dir (PathLike[Any] | str): キャッシュのディレクトリ.
+            max_size_mb (float): キャッシュの合計サイズの上限[MB].
+        """
+        self.cache_dir = Path(cache_dir)
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024)
+
+    @staticmethod
+    def compute_key(param_dir: PathLike[Any] | str, **settings: object) -> str:
+        """レンダリング済みのパラメータからキャッシュのキーを計算する.
+
+        Args:
+            param_dir (PathLike[Any] | str): レンダリング済みパラメータのディレクトリ.
+            **settings (object): 出力に影響する実行時の設定 (例: engine_pool).
+
+        Returns:
+            str: キー.
+        """
+        param_dir = Path(param_dir)
+        digest = hashlib.sha256()
+        digest.update(f"{CACHE_VERSION}\0{jsbsim.__version__}\0".encode())
+        for key, value in sorted(settings.items()):
+            digest.update(f"{key}={value}\0".encode())
+        for path in sorted(param_dir.rglob("*.xml")):
+            digest.update(path.relative_to(param_dir).as_posix().encode() + b"\0")
+            digest.update(path.read_bytes())
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}{CACHE_SUFFIX}"
+
+    def get(self, key: str) -> Trajectory | None:
+        """キャッシュされた出力を取得する.
+
+        Args:
+            key (str): キー.
+
+        Returns:
+            Trajectory | None: 出力. キャッシュにない場合はNone.
+        """
+        path = self._path(key)
+        try:
+            with np.load(path) as npz:
+                trajectory = Trajectory(npz["columns"].tolist(), npz["data"])
+        except (FileNotFoundError, OSError, ValueError, KeyError):
+            return None
+        # LRUのために最後に使った日時を更新する
+        path.touch()
+        return trajectory
+
+    def contains(self, key: str) -> bool:
+        """キャッシュに出力があるか.
+
+        Args:
+            key (str): キー.
+
+        Returns:
+            bool: キャッシュにある場合はTrue.
+        """
+        return self._path(key).exists()
+
+    def put(self, key: str, trajectory: Trajectory) -> None:
+        """出力をキャッシュに保存する. 複数のワーカーから同時に呼ばれても壊れないように一時ファイルから置き換える.
+
+        Args:
+            key (str): キー.
+            trajectory (Trajectory): 出力.
+        """
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_name(f"{path.stem}.{os.getpid()}.tmp{CACHE_SUFFIX}")
+        np.savez(temp_path, columns=np.array(trajectory.columns), data=trajectory.data)
+        temp_path.replace(path)
+
+    def evict(self) -> int:
+        """合計サイズが上限以下になるまで、最後に使われた日時が古いものから削除する.
+
+        Returns:
+            int: 削除した件数.
+        """
+        entries = []
+        for path in self.cache_dir.glob(f"*/*{CACHE_SUFFIX}"):
+            stat = path.stat()
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total_size = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total_size -= size
+            removed += 1
+        return removed
@@ -0,0 +1,216 @@
+"""スイープの進捗の記録と再開.
+
+パラメータの組み合わせごとの状態 (pending: 未処理, rendered: XML生成済み, simulated: シミュレーション済み,
+analysed: 集計済み) を出力ディレクトリに記録する. 中断したスイープは --resume で、終わった組み合わせを
+飛ばして残りだけを実行できる.
+
+    <出力ディレクトリ>/run_manifest/manifest.json      設定のフィンガープリントと状態ごとの件数
+    <出力ディレクトリ>/run_manifest/combinations.pkl   レンダリング済みの組み合わせ (simulation_df)
+    <出力ディレクトリ>/run_manifest/runs/<組み合わせ>.pkl  組み合わせごとの状態と結果
+
+組み合わせごとの結果はワーカーが終わった時点で書くため、実行中に中断しても終わった分は失われない.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import pickle
+from collections.abc import Callable, Hashable
+from datetime import UTC, datetime
+from pathlib import Path
+from shutil import rmtree
+from typing import Any, Literal
+
+import pandas as pd
+from omegaconf import DictConfig, OmegaConf
+
+LOGGER = logging.getLogger(__name__)
+
+MANIFEST_DIR_NAME = "run_manifest"
+MANIFEST_FILE_NAME = "manifest.json"
+COMBINATIONS_FILE_NAME = "combinations.pkl"
+RUNS_DIR_NAME = "runs"
+RUN_SUFFIX = ".pkl"
+# レンダリング済みのXMLがどのスイープのものかを示すファイル. 別のスイープで上書きされていたら作り直す
+RENDERED_MARKER_NAME = ".run_manifest"
+
+RunState = Literal["pending", "rendered", "simulated", "analysed"]
+RUN_STATES: tuple[RunState, ...] = ("pending", "rendered", "simulated", "analysed")
+
+
+def compute_fingerprint(params: DictConfig, **settings: object) -> str:
+    """結果に影響する設定からフィンガープリントを計算する. 再開する前のスイープと同じ設定かの確認に使う.
+
+    Args:
+        params (DictConfig): 設定ファイルの内容. 並列実行の方法など結果に影響しない misc は含めない.
+        **settings (object): 結果に影響する misc の設定や実行時の引数.
+
+    Returns:
+        str: フィンガープリント.
+    """
+    digest = hashlib.sha256()
+    for key in ("rocket", "simulation", "launch"):
+        digest.update(OmegaConf.to_yaml(params[key], resolve=True).encode())
+    digest.update(json.dumps(settings, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+class RunManifest:
+    """スイープの進捗を出力ディレクトリに記録する."""
+
+    def __init__(self, manifest_dir: Path | str, fingerprint: str, keep_trajectories: bool = False) -> None:
+        """初期化
+
+        Args:
+            manifest_dir (Path | str): 記録のディレクトリ.
+            fingerprint (str): 設定のフィンガープリント (compute_fingerprint).
+            keep_trajectories (bool): 時系列データも記録する. 再開後に trajectory_store で保存する場合に必要.
+        """
+        self.manifest_dir = Path(manifest_dir)
+        self.fingerprint = fingerprint
+        self.keep_trajectories = keep_trajectories
+
+    @property
+    def runs_dir(self) -> Path:
+        """組み合わせごとの記録のディレクトリ."""
+        return self.manifest_dir / RUNS_DIR_NAME
+
+    def _run_path(self, index: Hashable) -> Path:
+        return self.runs_dir / f"{index}{RUN_SUFFIX}"
+
+    def read_fingerprint(self) -> str | None:
+        """記録されているフィンガープリント. 記録がない場合はNone."""
+        try:
+            return json.loads((self.manifest_dir / MANIFEST_FILE_NAME).read_text())["fingerprint"]
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            return None
+
+    def reset(self) -> None:
+        """前回の記録を削除して、新しいスイープの記録を始める."""
+        rmtree(self.manifest_dir, ignore_errors=True)
+        self.runs_dir.mkdir(parents=True, exist_ok=True)
+        self.write_summary()
+
+    def save_combinations(self, simulation_df: pd.DataFrame) -> None:
+        """レンダリング済みの組み合わせを記録する.
+
+        Args:
+            simulation_df (pd.DataFrame): generate_param_xml の戻り値.
+        """
+        _write_atomic(self.manifest_dir / COMBINATIONS_FILE_NAME, pickle.dumps(simulation_df))
+        for rendered_dir in {Path(param_dir).parent for param_dir in simulation_df[("param_dir", "")]}:
+            (rendered_dir / RENDERED_MARKER_NAME).write_text(self.fingerprint)
+        self.write_summary(simulation_df.index)
+
+    def load_combinations(self) -> pd.DataFrame | None:
+        """レンダリング済みの組み合わせを読み込む.
+
+        Returns:
+            pd.DataFrame | None: 組み合わせ. 記録がない場合や、XMLが削除または別のスイープで上書きされた場合はNone.
+        """
+        try:
+            simulation_df: pd.DataFrame = pd.read_pickle(self.manifest_dir / COMBINATIONS_FILE_NAME)  # noqa: S301
+        except (FileNotFoundError, pickle.UnpicklingError, EOFError):
+            return None
+        param_dirs = [Path(param_dir) for param_dir in simulation_df[("param_dir", "")]]
+        for rendered_dir in {param_dir.parent for param_dir in param_dirs}:
+            marker_path = rendered_dir / RENDERED_MARKER_NAME
+            if not marker_path.exists() or marker_path.read_text() != self.fingerprint:
+                LOGGER.info(f"レンダリング済みのXMLが削除されたか、別のスイープで上書きされています: {rendered_dir}")
+                return None
+        if not all(param_dir.exists() for param_dir in param_dirs):
+            LOGGER.info("レンダリング済みのXMLが削除されています")
+            return None
+        return simulation_df
+
+    def record(
+        self, index: Hashable, state: RunState, func: Callable[..., pd.Series], *args: Any, **kwargs: Any
+    ) -> pd.Series:
+        """ワーカーで組み合わせを処理し、結果を記録する.
+
+        Args:
+            index (Hashable): 組み合わせ.
+            state (RunState): 処理が終わった後の状態.
+            func (Callable[..., pd.Series]): 処理する関数 (run_jsb, run_jsb_and_analyze).
+            *args (Any): 関数の引数.
+            **kwargs (Any): 関数のキーワード引数.
+
+        Returns:
+            pd.Series: 関数の戻り値.
+        """
+        result = func(*args, **kwargs)
+        recorded = result
+        if not self.keep_trajectories and result.get("trajectory") is not None:
+            recorded = result.copy()
+            recorded["trajectory"] = None
+        # 状態だけを読めるように、状態と結果を別々に pickle する
+        _write_atomic(self._run_path(index), pickle.dumps(state) + pickle.dumps(recorded))
+        return result
+
+    def _read_run(self, index: Hashable, with_result: bool) -> tuple[RunState, pd.Series | None] | None:
+        """組み合わせの記録を読み込む. 記録がない場合や壊れている場合はNone."""
+        try:
+            with self._run_path(index).open("rb") as file:
+                state = pickle.load(file)  # noqa: S301
+                return state, pickle.load(file) if with_result else None  # noqa: S301
+        except (FileNotFoundError, pickle.UnpicklingError, EOFError):
+            return None
+
+    def load_results(self, index: pd.Index) -> dict[Hashable, pd.Series]:
+        """記録されている組み合わせの結果を読み込む.
+
+        Args:
+            index (pd.Index): 組み合わせ.
+
+        Returns:
+            dict[Hashable, pd.Series]: 結果が記録されている組み合わせと、その結果.
+        """
+        results = {}
+        for run_index in index:
+            run = self._read_run(run_index, with_result=True)
+            if run is not None:
+                results[run_index] = run[1]
+        return results
+
+    def states(self, index: pd.Index) -> pd.Series:
+        """組み合わせごとの状態.
+
+        Args:
+            index (pd.Index): 組み合わせ.
+
+        Returns:
+            pd.Series: 組み合わせごとの状態.
+        """
+        rendered = (self.manifest_dir / COMBINATIONS_FILE_NAME).exists()
+        states = pd.Series("rendered" if rendered else "pending", index=index, dtype=object)
+        for run_index in index:
+            run = self._read_run(run_index, with_result=False)
+            if run is not None:
+                states[run_index] = run[0]
+        return states
+
+    def write_summary(self, index: pd.Index | None = None) -> None:
+        """フィンガープリントと状態ごとの件数を manifest.json に保存する.
+
+        Args:
+            index (pd.Index | None): 組み合わせ. Noneの場合は件数を数えない.
+        """
+        counts = {state: 0 for state in RUN_STATES}
+        if index is not None:
+            counts.update(self.states(index).value_counts().to_dict())
+        summary = {
+            "fingerprint": self.fingerprint,
+            "updated_at": datetime.now(UTC).isoformat(timespec="seconds"),
+            "num_combinations": 0 if index is None else len(index),
+            "states": counts,
+        }
+        _write_atomic(self.manifest_dir / MANIFEST_FILE_NAME, json.dumps(summary, indent=2).encode())
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    """中断しても壊れたファイルが残らないように、一時ファイルに書いてから置き換える."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    temp_path.write_bytes(data)
+    temp_path.replace(path)
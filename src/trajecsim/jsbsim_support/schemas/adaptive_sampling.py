@@ -0,0 +1,27 @@
+"""保安域の境界付近に組み合わせを追加する適応的なスイープの設定のスキーマ."""
+
+from pydantic import BaseModel
+
+
+class AdaptiveSamplingSchema(BaseModel):
+    """保安域(range_kmz)の境界付近に組み合わせを追加する適応的なスイープ
+
+    スイープの組み合わせを最初の粗い標本とし、パラメータ空間で隣り合う組み合わせのうち、着地点が保安域の境界を
+    またぐもの、または境界から margin_m 以内にあるものの中点を追加で実行する. これを max_rounds 回まで繰り返し、
+    着地点が保安域に収まる風の条件の境界を細かく求める.
+    """
+
+    enabled: bool = False
+    # 中点を追加するパラメータ. キーは "launch.ground_wind_speed" のように、セクション名.パラメータ名
+    # 指定しない場合はスイープしたすべての数値のパラメータ
+    parameters: list[str] = []
+    # 周期的なパラメータとその周期. 中点は短い方の弧の中点にする
+    periodic: dict[str, float] = {"launch.ground_wind_dir": 360.0}
+    # 着地点が境界からこの距離[m]以内なら、境界をまたがなくても中点を追加する
+    margin_m: float = 100.0
+    # パラメータごとの分解能. 2つの組み合わせの差がすべてのパラメータでこれ以下なら中点を追加しない
+    tolerance: dict[str, float] = {"launch.ground_wind_speed": 0.1, "launch.ground_wind_dir": 2.0}
+    # 中点を追加する回数と、追加する組み合わせの数の上限 (1回あたりと合計)
+    max_rounds: int = 4
+    max_runs_per_round: int = 64
+    max_runs: int = 256
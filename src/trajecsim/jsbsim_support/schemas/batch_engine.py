@@ -0,0 +1,22 @@
+"""一括積分エンジンの設定のスキーマ."""
+
+from pydantic import BaseModel
+
+
+class BatchEngineSchema(BaseModel):
+    """多数の機体をNumPyの配列でまとめて積分するエンジン (simulation_engine: batch) の設定
+
+    機体モデルは pq_rocket.xml.j2 と同じで、4次のルンゲ・クッタ法を固定の時間刻みで使う.
+    JSBSimより大きな時間刻みで同じ精度になるため、simulation.time_step ではなくここで指定する.
+    """
+
+    # 1つのタスクでまとめて積分する組み合わせの数の上限. ワーカーが余らないように、これより小さく分けることがある
+    batch_size: int = 256
+    # ワーカーが余らないように小さく分ける場合の下限. 数機ずつではNumPyの呼び出しのコストでJSBSimより遅くなる
+    min_batch_size: int = 16
+    # 時間刻み[s]. すべての機体がパラシュート降下に入ったら descent_time_step を使う
+    time_step: float = 0.01
+    descent_time_step: float = 0.05
+    # JSBSimでも実行して着地点を比較する組み合わせの数と、着地点の差の許容値[m]
+    check: int = 0
+    check_tolerance_m: float = 50.0
@@ -0,0 +1,27 @@
+"""時系列のグラフの設定のスキーマ."""
+
+from typing import Literal
+
+from pydantic import BaseModel
+
+
+class ChartSchema(BaseModel):
+    """時系列のグラフ (--chart_output を指定した場合) の設定
+
+    グラフはシミュレーションと集計のワーカー内で描く. 線は max_points 点まで間引いてから描く.
+    """
+
+    # 組み合わせごとのグラフ (summary: すべての列を1枚にまとめる, per_column: 列ごとに1枚, none: 出力しない)
+    per_run: Literal["summary", "per_column", "none"] = "summary"
+    # result_eachのグループごとに、すべての組み合わせを重ねたグラフ(ensemble)を出力する
+    ensemble: bool = True
+    # グラフにする列. 指定しない場合は Time 以外のすべての列
+    columns: list[str] = []
+    # 1本の線の点の数の上限 (LTTBで間引く). 0の場合は間引かない
+    max_points: int = 1000
+    # 重ねたグラフの1本の線の点の数の上限. 線が多いので少なくする. ワーカーはこの点の数の時系列を返す
+    ensemble_max_points: int = 200
+    # 1行に並べるグラフの数 (summary と ensemble)
+    panel_columns: int = 3
+    dpi: int = 100
+    format: Literal["png", "svg", "pdf", "jpg"] = "png"
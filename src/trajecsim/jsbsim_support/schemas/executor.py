@@ -0,0 +1,26 @@
+"""並列実行の方法の設定のスキーマ."""
+
+from typing import Literal
+
+from pydantic import BaseModel
+
+
+class ExecutorSchema(BaseModel):
+    """XMLのレンダリング、シミュレーション、集計を並列に実行する方法
+
+    local: このマシンのプロセスで実行する (joblib).
+    shared_fs: 共有ファイルシステム上のキューにタスクを置き、src/worker.py で起動したワーカーが取り出して実行する.
+        ワーカーは複数のマシンで起動でき、本体と同じ作業ディレクトリ(共有ファイルシステム上)で起動する.
+    """
+
+    backend: Literal["local", "shared_fs"] = "local"
+    # local: プロセス数. 指定しない場合はCPU数
+    n_jobs: int | None = None
+    # shared_fs: キューのディレクトリ
+    queue_dir: str = "temp/executor-queue"
+    # shared_fs: 本体が起動するワーカーの数と、本体自身もタスクを実行するか
+    local_workers: int = 0
+    coordinator_works: bool = True
+    # shared_fs: ワーカーが取り出してからこの時間[s]以内に結果を返さないタスクは、キューに戻して再実行する
+    lease_timeout_s: float = 600.0
+    poll_interval_s: float = 0.2
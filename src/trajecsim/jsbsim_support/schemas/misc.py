@@ -0,0 +1,63 @@
+"""その他の設定のスキーマ."""
+
+from typing import Literal
+
+from pydantic import BaseModel
+
+from trajecsim.jsbsim_support.schemas.adaptive_sampling import AdaptiveSamplingSchema
+from trajecsim.jsbsim_support.schemas.batch_engine import BatchEngineSchema
+from trajecsim.jsbsim_support.schemas.chart import ChartSchema
+from trajecsim.jsbsim_support.schemas.executor import ExecutorSchema
+from trajecsim.jsbsim_support.schemas.sampling import SamplingSchema
+from trajecsim.jsbsim_support.schemas.surrogate import SurrogateSchema
+
+
+class MiscSchema(BaseModel):
+    """集計や実行方法の設定"""
+
+    kml_group_by: list[str] = []
+    result_each: list[str] = []
+    # 積分に使うエンジン (jsbsim: JSBSim, batch: 多数の組み合わせをNumPyでまとめて積分する一括積分エンジン)
+    simulation_engine: Literal["jsbsim", "batch"] = "jsbsim"
+    batch_engine: BatchEngineSchema = BatchEngineSchema()
+    # ワーカー内で機体モデルを読み込んだFGFDMExecを再利用する. イベントをPythonで再現するため、
+    # 機体モデルの読み込みを省いてもスクリプトを毎回読み込むより速くはならない
+    engine_pool: bool = False
+    # シミュレーション出力(pq_rocket_output_raw.csv)を出力ディレクトリに保存する
+    save_raw_csv: bool = True
+    # 飛行経路 (kmz: result_eachのグループごとに1つのKMZ, kml: 組み合わせごとのKML, none: 出力しない)
+    flight_path: Literal["kmz", "kml", "none"] = "kmz"
+    # 飛行経路を単純化する許容誤差[m] (Douglas–Peucker法). 0の場合はすべての点を出力する
+    flight_path_tolerance_m: float = 1.0
+    # result_eachのsummary.csvに、着地点が保安域(launch.range_kmz)の内側か(inside_range)と
+    # 境界までの距離[m](distance_to_boundary_m. 内側を正、外側を負とする)を加える
+    geofence: bool = True
+    # 地表に投影した飛行経路(flight_path: kmz の場合)と境界の距離の最小値[m]も加える
+    geofence_flight_path: bool = False
+    # スイープ全体の出力を列指向のバイナリ形式で保存する (none: 保存しない, npy: メモリマップ可能, npz: 圧縮)
+    trajectory_store: Literal["none", "npy", "npz"] = "none"
+    trajectory_dtype: Literal["float64", "float32"] = "float64"
+    # 入力が前回と同じ組み合わせはシミュレーションせずにキャッシュから読み込む
+    result_cache: bool = True
+    result_cache_dir: str = "temp/jsbsim/result-cache"
+    result_cache_max_mb: float = 2048
+    # エンジンプールで、風やパラシュートだけが異なる組み合わせの飛行の前半を一度だけ積分し、分岐して後半を積分する.
+    # 分岐したプロセスは1つずつ実行し、結果をパイプで返すため、共有した前半の分より遅くなることがある
+    share_flight_prefix: bool = False
+    # パラシュート降下が終端速度に落ち着いたら積分を打ち切り、着地までを解析的に計算する
+    descent_fast_forward: bool = False
+    # 通常の積分と着地点を比較する組み合わせの数と、着地点の差の許容値[m]
+    descent_fast_forward_check: int = 0
+    descent_fast_forward_tolerance_m: float = 5.0
+    # 時系列のグラフ (--chart_output を指定した場合) の描き方と保存形式
+    chart: ChartSchema = ChartSchema()
+    # 追加で出力するプロパティ. 位置は常に、集計に必要なプロパティはresult_eachを指定した場合に出力する
+    output_properties: list[str] = []
+    # パラメータの組み合わせの作り方. 指定しない場合は全組み合わせ
+    sampling: SamplingSchema = SamplingSchema()
+    # XMLのレンダリング、シミュレーション、集計を並列に実行する方法
+    executor: ExecutorSchema = ExecutorSchema()
+    # スイープの後で、保安域の境界付近に組み合わせを追加する
+    adaptive_sampling: AdaptiveSamplingSchema = AdaptiveSamplingSchema()
+    # 粗い格子の結果から着地点とサマリーの値を細かい格子に補間するサロゲートモデル
+    surrogate: SurrogateSchema = SurrogateSchema()
@@ -0,0 +1,41 @@
+"""サンプリングによるスイープの設定のスキーマ."""
+
+from typing import Literal, Self
+
+from pydantic import BaseModel, model_validator
+
+
+class DistributionSchema(BaseModel):
+    """1つのパラメータの分布"""
+
+    type: Literal["uniform", "normal"]
+    # uniform: 範囲. normal: 指定した場合は範囲内に切り詰める
+    low: float | None = None
+    high: float | None = None
+    # normal: 平均と標準偏差
+    mean: float | None = None
+    std: float | None = None
+
+    @model_validator(mode="after")
+    def check_parameters(self) -> Self:
+        """分布の種類に必要な値が指定されているか確認する"""
+        if self.type == "uniform" and (self.low is None or self.high is None):
+            raise ValueError("uniform分布にはlowとhighが必要です")
+        if self.type == "normal" and (self.mean is None or self.std is None):
+            raise ValueError("normal分布にはmeanとstdが必要です")
+        return self
+
+
+class SamplingSchema(BaseModel):
+    """スイープの方法
+
+    grid以外では、distributionsで指定したパラメータは分布から、それ以外で複数の値が指定されたパラメータは
+    その値から一様に、num_samples個の組み合わせをサンプリングする.
+    """
+
+    # grid: 全組み合わせ, random: 乱数, lhs: ラテン超方格, sobol: Sobol列(scipyが必要), halton: Halton列
+    method: Literal["grid", "random", "lhs", "sobol", "halton"] = "grid"
+    num_samples: int = 100
+    seed: int | None = 0
+    # キーは "launch.ground_wind_speed" のように、セクション名.パラメータ名
+    distributions: dict[str, DistributionSchema] = {}
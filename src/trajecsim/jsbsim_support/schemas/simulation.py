@@ -4,7 +4,7 @@ from typing import Annotated
 
 from pydantic import BaseModel, BeforeValidator
 
-from trajecsim.jsbsim_support.schemas.validator import convert_value_to_list
+from trajecsim.jsbsim_support.schemas.validator import convert_value_to_list, convert_value_to_list_optional
 
 
 class SimulationSchema(BaseModel):
@@ -15,3 +15,12 @@ class SimulationSchema(BaseModel):
     parachute_deploy_delay: Annotated[list[float], BeforeValidator(convert_value_to_list)]
     notify_interval: Annotated[list[float], BeforeValidator(convert_value_to_list)]
     output_rate: Annotated[list[int], BeforeValidator(convert_value_to_list)]
+    # 指定した場合は、パラシュート降下までをこの頻度[Hz]で、パラシュート降下中をoutput_rateで出力する
+    dense_output_rate: Annotated[list[int], BeforeValidator(convert_value_to_list_optional)] = []
+    # 飛行フェーズごとの時間刻み[s]. rail と boost は指定しない場合はtime_step
+    # rail: ランチャー上, boost: 燃焼終了まで, coast: パラシュートの展開完了まで, descent: パラシュート降下
+    # coast と descent は既定で粗くする (着地点の差は 0.4m 以内で、積分のステップ数は約 1/5). nullの場合はtime_step
+    rail_time_step: Annotated[list[float], BeforeValidator(convert_value_to_list_optional)] = []
+    boost_time_step: Annotated[list[float], BeforeValidator(convert_value_to_list_optional)] = []
+    coast_time_step: Annotated[list[float], BeforeValidator(convert_value_to_list_optional)] = [0.002]
+    descent_time_step: Annotated[list[float], BeforeValidator(convert_value_to_list_optional)] = [0.01]
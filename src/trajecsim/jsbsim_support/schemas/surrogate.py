@@ -0,0 +1,30 @@
+"""サロゲートモデルの設定のスキーマ."""
+
+from typing import Literal
+
+from pydantic import BaseModel
+
+
+class SurrogateSchema(BaseModel):
+    """粗い格子のシミュレーション結果から、着地点とサマリーの値を細かい格子に補間するサロゲートモデル
+
+    スイープしたパラメータ(複数の値を持つ数値のパラメータ)の関数として、着地点(北・東の距離)と targets を
+    放射基底関数で補間し、細かい格子で評価する. 各標本点を除いて補間したときの誤差(leave-one-out)を誤差の推定に使う.
+    """
+
+    enabled: bool = False
+    # 細かい格子の点の数. キーは "launch.ground_wind_speed" のように、セクション名.パラメータ名
+    # 指定しないパラメータは resolution 点
+    resolution: int = 50
+    grid: dict[str, int] = {}
+    # 周期的なパラメータとその周期. 周期の両端をつなげて補間する
+    periodic: dict[str, float] = {"launch.ground_wind_dir": 360.0}
+    # 着地点のほかに補間するサマリーの値 (result_eachを指定した場合に計算される)
+    targets: list[str] = ["max_altitude", "max_speed", "max_pressure", "launch_clear_speed"]
+    # 放射基底関数 (thin_plate: r^2 log r, cubic: r^3, linear: r)
+    kernel: Literal["thin_plate", "cubic", "linear"] = "thin_plate"
+    # 着地点の推定誤差[m]がこれを超える点で実際にシミュレーションし、標本点に加えて補間し直す. 0の場合は行わない
+    refine_tolerance_m: float = 0.0
+    # 1回に追加する標本点の数と、補間し直す回数の上限
+    refine_batch: int = 8
+    refine_rounds: int = 3
@@ -0,0 +1,117 @@
+"""シミュレーション出力の時系列データ."""
+
+from os import PathLike
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import pandas as pd
+
+# 記録バッファの初期行数. 足りなくなったら倍に拡張する
+INITIAL_CAPACITY = 4096
+
+
+class Trajectory:
+    """1回のシミュレーションの出力を列ごとのNumPy配列として保持する."""
+
+    def __init__(self, columns: list[str], data: np.ndarray) -> None:
+        """初期化
+
+        Args:
+            columns (list[str]): 列名. 先頭は時刻(Time).
+            data (np.ndarray): 行数 x 列数の配列.
+        """
+        self.columns = list(columns)
+        self.data = data
+
+    @classmethod
+    def from_dataframe(cls, df: pd.DataFrame) -> "Trajectory":
+        """DataFrameから作成する."""
+        return cls(list(df.columns), df.to_numpy(dtype=float))
+
+    @classmethod
+    def from_csv(cls, path: PathLike[Any] | str) -> "Trajectory":
+        """JSBSimが出力したCSVファイルから作成する."""
+        return cls.from_dataframe(pd.read_csv(path))
+
+    def __len__(self) -> int:
+        """行数"""
+        return len(self.data)
+
+    def __getitem__(self, column: str) -> np.ndarray:
+        """列の値を取得する."""
+        return self.data[:, self.columns.index(column)]
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """DataFrameに変換する."""
+        return pd.DataFrame(self.data, columns=self.columns)
+
+    def to_csv(self, path: PathLike[Any] | str) -> Path:
+        """CSVファイルに保存する.
+
+        Args:
+            path (PathLike[Any] | str): 保存先.
+
+        Returns:
+            Path: 保存先.
+        """
+        path = Path(path)
+        self.to_dataframe().to_csv(path, index=False)
+        return path
+
+    def add_columns(self, columns: dict[str, np.ndarray]) -> None:
+        """列を追加する. 同名の列がすでにある場合は上書きする.
+
+        Args:
+            columns (dict[str, np.ndarray]): 列名と値.
+        """
+        for name, values in columns.items():
+            values = np.asarray(values, dtype=float)
+            if name in self.columns:
+                self.data[:, self.columns.index(name)] = values
+            else:
+                self.columns.append(name)
+                self.data = np.column_stack([self.data, values])
+
+
+class TrajectoryRecorder:
+    """ステップループ内で出力を事前確保した配列に記録する."""
+
+    def __init__(self, columns: list[str], capacity: int = INITIAL_CAPACITY) -> None:
+        """初期化
+
+        Args:
+            columns (list[str]): 列名.
+            capacity (int): 初期の行数.
+        """
+        self.columns = list(columns)
+        self._data = np.empty((max(1, capacity), len(columns)))
+        self._size = 0
+
+    def append(self, values: list[float]) -> None:
+        """1行記録する."""
+        if self._size == len(self._data):
+            self._data = np.concatenate([self._data, np.empty_like(self._data)])
+        self._data[self._size] = values
+        self._size += 1
+
+    def finish(self) -> Trajectory:
+        """記録を終了してTrajectoryを返す."""
+        return Trajectory(self.columns, self._data[: self._size].copy())
+
+
+def read_trajectory(output_info_df: pd.Series) -> pd.DataFrame:
+    """シミュレーション結果の時系列データを取得する.
+
+    メモリ上のTrajectoryがあればそれを使い、なければ保存されたCSVファイルを読み込む.
+
+    Args:
+        output_info_df (pd.Series): シミュレーションの結果を含む行.
+
+    Returns:
+        pd.DataFrame: 時系列データ.
+    """
+    trajectory = output_info_df.get("trajectory")
+    if isinstance(trajectory, Trajectory):
+        return trajectory.to_dataframe()
+    return pd.read_csv(output_info_df["raw_output_file"])
@@ -0,0 +1,221 @@
+"""スイープ全体のシミュレーション出力を列指向のバイナリ形式で保存する.
+
+全実行の出力を列ごとに1つのファイルへ連結して保存し、実行ID(組み合わせのインデックス)ごとの
+開始位置と行数をindex.csvに記録する.
+
+- npy: 列ごとの生バイナリファイル. 読み込みはメモリマップで行うため、1実行や1列を読むときにコピーが発生しない.
+- npz: 保存終了時に全列を圧縮した1つのnpzファイルにまとめる. 読み込み時は必要な列だけを展開する.
+"""
+
+import argparse
+import json
+import logging
+from os import PathLike
+from pathlib import Path
+from typing import Any, Literal, Self
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from trajecsim.jsbsim_support.trajectory import Trajectory
+
+LOGGER = logging.getLogger(__name__)
+
+METADATA_FILE = "metadata.json"
+INDEX_FILE = "index.csv"
+COMPRESSED_FILE = "trajectories.npz"
+
+StoreFormat = Literal["npy", "npz"]
+
+
+class TrajectoryStore:
+    """列指向のシミュレーション出力ストア."""
+
+    def __init__(self, store_dir: PathLike[Any] | str) -> None:
+        """既存のストアを開く.
+
+        Args:
+            store_dir (PathLike[Any] | str): ストアのディレクトリ.
+
+        Raises:
+            FileNotFoundError: ストアが存在しない場合.
+        """
+        self.store_dir = Path(store_dir)
+        metadata_path = self.store_dir / METADATA_FILE
+        if not metadata_path.exists():
+            raise FileNotFoundError(metadata_path)
+        metadata = json.loads(metadata_path.read_text(encoding="utf-8"))
+        self.format: StoreFormat = metadata["format"]
+        self.dtype = np.dtype(metadata["dtype"])
+        self.columns: list[str] = metadata["columns"]
+        index_df = pd.read_csv(self.store_dir / INDEX_FILE, dtype={"run_id": str})
+        self._index = {
+            run_id: (int(offset), int(length))
+            for run_id, offset, length in zip(index_df["run_id"], index_df["offset"], index_df["length"], strict=True)
+        }
+        self._column_cache: dict[str, np.ndarray] = {}
+
+    @property
+    def run_ids(self) -> list[str]:
+        """保存されている実行IDの一覧"""
+        return list(self._index)
+
+    def read_column(self, column: str) -> np.ndarray:
+        """全実行分の1列を連結した配列を取得する. npy形式ではメモリマップになる.
+
+        Args:
+            column (str): 列名.
+
+        Returns:
+            np.ndarray: 全実行の値. 各実行の範囲は run_slice で取得できる.
+        """
+        if column not in self._column_cache:
+            column_index = self.columns.index(column)
+            if self.format == "npy":
+                path = self.store_dir / _column_file_name(column_index)
+                self._column_cache[column] = (
+                    np.memmap(path, dtype=self.dtype, mode="r")
+                    if path.stat().st_size > 0
+                    else np.empty(0, dtype=self.dtype)
+                )
+            else:
+                with np.load(self.store_dir / COMPRESSED_FILE) as npz:
+                    self._column_cache[column] = npz[_column_key(column_index)]
+        return self._column_cache[column]
+
+    def run_slice(self, run_id: str) -> slice:
+        """実行IDに対応する行の範囲を取得する."""
+        offset, length = self._index[str(run_id)]
+        return slice(offset, offset + length)
+
+    def read_run_column(self, run_id: str, column: str) -> np.ndarray:
+        """1実行の1列を取得する. npy形式ではコピーを伴わないビューになる."""
+        return self.read_column(column)[self.run_slice(run_id)]
+
+    def read_run(self, run_id: str) -> Trajectory:
+        """1実行の全列を取得する.
+
+        Args:
+            run_id (str): 実行ID.
+
+        Returns:
+            Trajectory: 1実行分の出力.
+        """
+        run_slice = self.run_slice(run_id)
+        data = np.column_stack([self.read_column(column)[run_slice] for column in self.columns]).astype(float)
+        return Trajectory(self.columns, data)
+
+    def export_csv(self, output_dir: PathLike[Any] | str, file_name: str = "pq_rocket_output_raw.csv") -> list[Path]:
+        """従来と同じ、実行ごとのCSVファイルに書き出す.
+
+        Args:
+            output_dir (PathLike[Any] | str): 出力ディレクトリ. 実行ごとに `<実行ID>_/` ディレクトリが作られる.
+            file_name (str): CSVファイル名.
+
+        Returns:
+            list[Path]: 書き出したCSVファイル.
+        """
+        output_dir = Path(output_dir)
+        exported = []
+        for run_id in tqdm(self.run_ids, desc="CSVファイルに書き出し中"):
+            run_dir = output_dir / f"{run_id}_"
+            run_dir.mkdir(parents=True, exist_ok=True)
+            exported.append(self.read_run(run_id).to_csv(run_dir / file_name))
+        return exported
+
+
+class TrajectoryStoreWriter:
+    """シミュレーション出力を列ごとのファイルに追記する."""
+
+    def __init__(
+        self,
+        store_dir: PathLike[Any] | str,
+        store_format: StoreFormat = "npy",
+        dtype: str = "float64",
+    ) -> None:
+        """新しいストアを作成する. 同じディレクトリの既存のストアは上書きされる.
+
+        Args:
+            store_dir (PathLike[Any] | str): ストアのディレクトリ.
+            store_format (StoreFormat): 保存形式.
+            dtype (str): 保存する数値の型. float32にするとサイズが半分になる.
+        """
+        self.store_dir = Path(store_dir)
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        self.format = store_format
+        self.dtype = np.dtype(dtype)
+        self.columns: list[str] | None = None
+        self._files: list[Any] = []
+        self._index: list[tuple[str, int, int]] = []
+        self._offset = 0
+
+    def __enter__(self) -> Self:
+        """コンテキストマネージャー"""
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        """コンテキストマネージャー"""
+        self.close()
+
+    def write(self, run_id: str, trajectory: Trajectory) -> None:
+        """1実行分の出力を追記する.
+
+        Args:
+            run_id (str): 実行ID.
+            trajectory (Trajectory): 出力.
+
+        Raises:
+            ValueError: 既に書き込んだ実行と列が異なる場合.
+        """
+        if self.columns is None:
+            self.columns = list(trajectory.columns)
+            self._files = [
+                (self.store_dir / _column_file_name(column_index)).open("wb")
+                for column_index in range(len(self.columns))
+            ]
+        elif trajectory.columns != self.columns:
+            raise ValueError(f"出力の列が一致しません: {trajectory.columns}")
+
+        data = trajectory.data.astype(self.dtype, copy=False)
+        for column_index, file in enumerate(self._files):
+            np.ascontiguousarray(data[:, column_index]).tofile(file)
+        self._index.append((str(run_id), self._offset, len(trajectory)))
+        self._offset += len(trajectory)
+
+    def close(self) -> None:
+        """書き込みを終了し、インデックスとメタデータを保存する."""
+        for file in self._files:
+            file.close()
+        columns = self.columns or []
+        if self.format == "npz":
+            arrays = {
+                _column_key(column_index): np.fromfile(self.store_dir / _column_file_name(column_index), self.dtype)
+                for column_index in range(len(columns))
+            }
+            np.savez_compressed(self.store_dir / COMPRESSED_FILE, **arrays)
+            for column_index in range(len(columns)):
+                (self.store_dir / _column_file_name(column_index)).unlink()
+
+        pd.DataFrame(self._index, columns=["run_id", "offset", "length"]).to_csv(
+            self.store_dir / INDEX_FILE, index=False
+        )
+        metadata = {"format": self.format, "dtype": self.dtype.name, "columns": columns}
+        (self.store_dir / METADATA_FILE).write_text(json.dumps(metadata, ensure_ascii=False), encoding="utf-8")
+        self._files = []
+
+
+def _column_file_name(column_index: int) -> str:
+    return f"column_{column_index:03d}.bin"
+
+
+def _column_key(column_index: int) -> str:
+    return f"column_{column_index:03d}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="保存されたシミュレーション出力を実行ごとのCSVファイルに書き出す")
+    parser.add_argument("store_dir", type=str, help="ストアのディレクトリ (例: data/result/trajectories)")
+    parser.add_argument("output_dir", type=str, help="CSVファイルの出力先 (例: data/result/raw_result)")
+    args = parser.parse_args()
+    TrajectoryStore(args.store_dir).export_csv(args.output_dir)
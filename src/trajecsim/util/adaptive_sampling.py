@@ -0,0 +1,331 @@
+"""保安域(range_kmz)の境界付近に組み合わせを追加する適応的なスイープ.
+
+着地点が保安域に収まるかどうかが変わる風の条件(go/no-go の境界)を求めるには、一様な格子では境界から離れた
+組み合わせにも同じだけ実行回数を使ってしまう. スイープの組み合わせを最初の粗い標本とし、パラメータ空間で
+隣り合う組み合わせのうち着地点が境界をまたぐもの、または境界に近いものの中点だけを追加で実行する.
+これを繰り返すと、追加の組み合わせは境界の近くに集まり、境界は1回ごとに半分の間隔で求まる.
+
+    <出力ディレクトリ>/adaptive/samples.csv   組み合わせごとの着地点と境界までの距離
+    <出力ディレクトリ>/adaptive/boundary.csv  境界をまたぐ隣り合う組み合わせの組
+    <出力ディレクトリ>/adaptive/report.json   追加した組み合わせの数と、同じ分解能の一様な格子の組み合わせの数
+"""
+
+import json
+import logging
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import numpy.typing as npt
+import pandas as pd
+
+from trajecsim.jsbsim_support.generate_param_xml import derive_combinations
+from trajecsim.jsbsim_support.schemas.adaptive_sampling import AdaptiveSamplingSchema
+from trajecsim.util.geofence import DISTANCE_COLUMN, INSIDE_COLUMN, evaluate_landing_geofence, landing_coordinates
+from trajecsim.util.surrogate import Parameter, parameter_name, swept_parameters
+
+LOGGER = logging.getLogger(__name__)
+
+ADAPTIVE_DIR_NAME = "adaptive"
+ROUND_COLUMN = "adaptive_round"
+# 同じ組み合わせとみなすパラメータの差 (正規化した値)
+DUPLICATE_TOLERANCE = 1e-9
+
+
+class _ParameterSpace:
+    """中点を追加するパラメータの空間. 周期的なパラメータは差を短い方の弧で測る."""
+
+    def __init__(self, parameters: list[Parameter], samples_df: pd.DataFrame, periodic: dict[Parameter, float]) -> None:
+        """初期化"""
+        self.parameters = parameters
+        self.periods = np.array([periodic.get(parameter, np.nan) for parameter in parameters])
+        self._periodic = ~np.isnan(self.periods)
+        values = samples_df[parameters].to_numpy(dtype=float)
+        span = values.max(axis=0) - values.min(axis=0)
+        # 正規化の幅. 周期的なパラメータは周期
+        self.scale = np.where(self._periodic, self.periods, np.where(span > 0, span, 1.0))
+
+    def differences(self, a: npt.NDArray[np.float64], b: npt.NDArray[np.float64]) -> npt.NDArray[np.float64]:
+        """パラメータごとの差の大きさ. a と b はブロードキャストされる."""
+        difference = np.abs(a - b)
+        wrapped = np.mod(difference, np.where(self._periodic, self.periods, np.inf))
+        return np.where(self._periodic, np.minimum(wrapped, self.periods - wrapped), difference)
+
+    def distances(self, a: npt.NDArray[np.float64], b: npt.NDArray[np.float64]) -> npt.NDArray[np.float64]:
+        """正規化したパラメータの距離 (a: (n, p), b: (m, p) -> (n, m))."""
+        differences = self.differences(a[:, np.newaxis, :], b[np.newaxis, :, :])
+        return np.sqrt(np.sum((differences / self.scale) ** 2, axis=2))
+
+    def midpoints(self, a: npt.NDArray[np.float64], b: npt.NDArray[np.float64]) -> npt.NDArray[np.float64]:
+        """2つの点の中点. 周期的なパラメータは短い方の弧の中点."""
+        period = np.where(self._periodic, self.periods, 1.0)
+        delta = np.mod(b - a + period / 2, period) - period / 2
+        return np.where(self._periodic, np.mod(a + delta / 2, period), (a + b) / 2)
+
+
+def _group_codes(samples_df: pd.DataFrame, group_columns: list[Any]) -> npt.NDArray[np.intp]:
+    """中点を追加しないパラメータの値ごとの番号. 同じ番号の組み合わせの間でだけ中点を追加する."""
+    if not group_columns:
+        return np.zeros(len(samples_df), dtype=int)
+    return pd.factorize(samples_df[group_columns].astype(str).agg("|".join, axis=1))[0]
+
+
+def _neighbour_pairs(
+    space: _ParameterSpace, values: npt.NDArray[np.float64], group_codes: npt.NDArray[np.intp]
+) -> npt.NDArray[np.intp]:
+    """パラメータ空間で隣り合う組み合わせの組 (位置の番号).
+
+    各組み合わせから近い順に (パラメータの数 x 2) 個を隣とする. 格子の場合は各軸の両隣になる.
+    """
+    num_neighbours = 2 * len(space.parameters)
+    pairs: set[tuple[int, int]] = set()
+    for group_code in np.unique(group_codes):
+        positions = np.flatnonzero(group_codes == group_code)
+        distances = space.distances(values[positions], values[positions])
+        np.fill_diagonal(distances, np.inf)
+        for row, position in enumerate(positions):
+            for neighbour in np.argsort(distances[row], kind="stable")[:num_neighbours]:
+                if np.isfinite(distances[row, neighbour]):
+                    pairs.add(tuple(sorted((position, positions[neighbour]))))
+    return np.array(sorted(pairs), dtype=int).reshape(-1, 2)
+
+
+def _classify_pairs(
+    space: _ParameterSpace,
+    values: npt.NDArray[np.float64],
+    distance: npt.NDArray[np.float64],
+    pairs: npt.NDArray[np.intp],
+    settings: AdaptiveSamplingSchema,
+) -> dict[str, npt.NDArray[Any]]:
+    """隣り合う組み合わせの組が境界をまたぐか、境界に近いか、パラメータの差が分解能以下か."""
+    first, second = pairs[:, 0], pairs[:, 1]
+    valid = np.isfinite(distance[first]) & np.isfinite(distance[second])
+    tolerance = np.array(
+        [settings.tolerance.get(parameter_name(parameter), 0.0) for parameter in space.parameters], dtype=float
+    )
+    differences = space.differences(values[first], values[second])
+    return {
+        "straddles": valid & ((distance[first] >= 0) != (distance[second] >= 0)),
+        "near": valid & (np.minimum(np.abs(distance[first]), np.abs(distance[second])) <= settings.margin_m),
+        "resolved": np.all(differences <= tolerance, axis=1),
+        "length": np.sqrt(np.sum((differences / space.scale) ** 2, axis=1)),
+    }
+
+
+def _propose_midpoints(
+    space: _ParameterSpace,
+    values: npt.NDArray[np.float64],
+    distance: npt.NDArray[np.float64],
+    group_codes: npt.NDArray[np.intp],
+    settings: AdaptiveSamplingSchema,
+    max_runs: int,
+) -> tuple[npt.NDArray[np.intp], npt.NDArray[np.float64]]:
+    """境界をまたぐ、または境界に近い隣り合う組み合わせの中点を選ぶ.
+
+    境界をまたぐ組を優先し、その中ではパラメータの差が大きい組から選ぶ. 既にある組み合わせと同じ中点は選ばない.
+
+    Args:
+        space (_ParameterSpace): 中点を追加するパラメータの空間.
+        values (npt.NDArray[np.float64]): 組み合わせごとのパラメータの値.
+        distance (npt.NDArray[np.float64]): 組み合わせごとの境界までの距離[m].
+        group_codes (npt.NDArray[np.intp]): 組み合わせごとの、中点を追加しないパラメータの値の番号.
+        settings (AdaptiveSamplingSchema): 適応的なスイープの設定.
+        max_runs (int): 選ぶ中点の数の上限.
+
+    Returns:
+        tuple[npt.NDArray[np.intp], npt.NDArray[np.float64]]: 中点の元にする組み合わせの位置と、中点のパラメータの値.
+    """
+    pairs = _neighbour_pairs(space, values, group_codes)
+    pair_flags = _classify_pairs(space, values, distance, pairs, settings)
+    candidates = np.flatnonzero((pair_flags["straddles"] | pair_flags["near"]) & ~pair_flags["resolved"])
+    candidates = candidates[np.lexsort((-pair_flags["length"][candidates], ~pair_flags["straddles"][candidates]))]
+    midpoints = space.midpoints(values[pairs[candidates, 0]], values[pairs[candidates, 1]])
+
+    bases: list[int] = []
+    selected: list[npt.NDArray[np.float64]] = []
+    for candidate, midpoint in zip(candidates, midpoints, strict=True):
+        if len(bases) >= max_runs:
+            break
+        base = pairs[candidate, 0]
+        existing = [values[group_codes == group_codes[base]]]
+        existing += [
+            point[np.newaxis]
+            for point, other in zip(selected, bases, strict=True)
+            if group_codes[other] == group_codes[base]
+        ]
+        if space.distances(midpoint[np.newaxis], np.vstack(existing)).min() < DUPLICATE_TOLERANCE:
+            continue
+        bases.append(base)
+        selected.append(midpoint)
+    return np.array(bases, dtype=int), np.array(selected).reshape(-1, len(space.parameters))
+
+
+def _uniform_grid_size(space: _ParameterSpace, values: npt.NDArray[np.float64], num_groups: int) -> int:
+    """求めた分解能(パラメータごとの最も細かい間隔)で一様な格子を作った場合の組み合わせの数."""
+    size = num_groups
+    for i in range(len(space.parameters)):
+        unique = np.unique(values[:, i])
+        if len(unique) < 2:  # noqa: PLR2004
+            continue
+        step = np.min(np.diff(unique))
+        span = space.periods[i] if not np.isnan(space.periods[i]) else unique[-1] - unique[0]
+        size *= round(span / step) + (0 if not np.isnan(space.periods[i]) else 1)
+    return int(size)
+
+
+def run_adaptive_sampling(
+    simulation_df: pd.DataFrame,
+    settings: AdaptiveSamplingSchema,
+    output_dir: Path,
+    simulate: Callable[[pd.DataFrame], pd.DataFrame],
+) -> pd.DataFrame:
+    """保安域の境界付近に組み合わせを追加して実行し、結果を保存する.
+
+    Args:
+        simulation_df (pd.DataFrame): スイープの組み合わせとシミュレーションの結果 (最初の標本).
+        settings (AdaptiveSamplingSchema): 適応的なスイープの設定.
+        output_dir (Path): 出力ディレクトリ. adaptive ディレクトリに保存する.
+        simulate (Callable[[pd.DataFrame], pd.DataFrame]): 追加の組み合わせをシミュレーションし、
+            組み合わせと結果を返す関数.
+
+    Raises:
+        ValueError: 保安域(range_kmz)が指定されていない場合や、中点を追加するパラメータが数値でない場合.
+
+    Returns:
+        pd.DataFrame: 最初の標本と追加した組み合わせの組み合わせと結果.
+    """
+    if ("launch", "range_kmz") not in simulation_df.columns or simulation_df[("launch", "range_kmz")].isna().all():
+        raise ValueError("適応的なスイープには保安域(launch.range_kmz)が必要です")
+    swept, not_numeric = swept_parameters(simulation_df)
+    if settings.parameters:
+        parameters: list[Parameter] = []
+        for name in settings.parameters:
+            section, key = name.split(".", 1)
+            parameters.append((section, key))
+        unknown = [parameter_name(parameter) for parameter in parameters if parameter not in simulation_df.columns]
+        if unknown:
+            raise ValueError(f"中点を追加するパラメータがありません: {unknown}")
+        not_numeric_parameters = [parameter_name(parameter) for parameter in parameters if parameter in not_numeric]
+        if not_numeric_parameters:
+            raise ValueError(f"数値でないパラメータには中点を追加できません: {not_numeric_parameters}")
+    else:
+        parameters = swept
+    if not parameters:
+        raise ValueError("スイープしたパラメータがないため中点を追加できません")
+    periodic = {
+        parameter: settings.periodic[parameter_name(parameter)]
+        for parameter in parameters
+        if parameter_name(parameter) in settings.periodic
+    }
+    # 中点を追加しないスイープしたパラメータ(数値でないものを含む)は、値が同じ組み合わせの間でだけ中点を追加する
+    group_columns = [parameter for parameter in swept if parameter not in parameters] + not_numeric
+    space = _ParameterSpace(parameters, simulation_df, periodic)
+
+    samples_df = simulation_df
+    landing_df = landing_coordinates(samples_df)
+    distances = evaluate_landing_geofence(samples_df)[DISTANCE_COLUMN]
+    rounds = pd.Series(0, index=samples_df.index)
+    round_log: list[dict[str, Any]] = []
+    num_added = 0
+    for adaptive_round in range(1, settings.max_rounds + 1):
+        group_codes = _group_codes(samples_df, group_columns)
+        values = samples_df[parameters].to_numpy(dtype=float)
+        bases, midpoints = _propose_midpoints(
+            space,
+            values,
+            distances.to_numpy(dtype=float),
+            group_codes,
+            settings,
+            min(settings.max_runs_per_round, settings.max_runs - num_added),
+        )
+        if not len(bases):
+            LOGGER.info("保安域の境界付近で中点を追加する組み合わせがなくなりました")
+            break
+        LOGGER.info(f"保安域の境界付近に組み合わせを追加します: {len(bases)}件 ({adaptive_round}回目)")
+        new_df = simulate(
+            derive_combinations(
+                samples_df,
+                samples_df.index[bases],
+                pd.DataFrame(midpoints, columns=pd.Index(parameters, tupleize_cols=False)),
+                f"adaptive={adaptive_round}",
+            )
+        )
+        new_landing_df = landing_coordinates(new_df)
+        new_distances = evaluate_landing_geofence(new_df)[DISTANCE_COLUMN]
+        samples_df = pd.concat([samples_df, new_df])
+        landing_df = pd.concat([landing_df, new_landing_df])
+        distances = pd.concat([distances, new_distances])
+        rounds = pd.concat([rounds, pd.Series(adaptive_round, index=new_df.index)])
+        num_added += len(new_df)
+        round_log.append(
+            {
+                "round": adaptive_round,
+                "num_added": len(new_df),
+                "num_inside": int((new_distances >= 0).sum()),
+                "num_outside": int((new_distances < 0).sum()),
+            }
+        )
+        if num_added >= settings.max_runs:
+            LOGGER.info(f"追加する組み合わせの数の上限 {settings.max_runs}件 に達しました")
+            break
+
+    _save_results(samples_df, landing_df, distances, rounds, space, group_columns, settings, output_dir, round_log)
+    return samples_df
+
+
+def _save_results(
+    samples_df: pd.DataFrame,
+    landing_df: pd.DataFrame,
+    distances: pd.Series,
+    rounds: pd.Series,
+    space: _ParameterSpace,
+    group_columns: list[Any],
+    settings: AdaptiveSamplingSchema,
+    output_dir: Path,
+    round_log: list[dict[str, Any]],
+) -> None:
+    """組み合わせごとの着地点、境界をまたぐ組、集計を保存する."""
+    adaptive_dir = output_dir / ADAPTIVE_DIR_NAME
+    adaptive_dir.mkdir(parents=True, exist_ok=True)
+    column_names = [parameter_name(column) for column in [*space.parameters, *group_columns]]
+    result_df = samples_df[[*space.parameters, *group_columns]].set_axis(column_names, axis=1)
+    result_df = pd.concat([result_df, landing_df], axis=1)
+    result_df[INSIDE_COLUMN] = distances >= 0
+    result_df[DISTANCE_COLUMN] = distances
+    result_df[ROUND_COLUMN] = rounds
+    result_df.to_csv(adaptive_dir / "samples.csv", index_label="index")
+
+    # 境界をまたぐ隣り合う組み合わせの組. 境界はその間にある
+    values = samples_df[space.parameters].to_numpy(dtype=float)
+    distance = distances.to_numpy(dtype=float)
+    group_codes = _group_codes(samples_df, group_columns)
+    pairs = _neighbour_pairs(space, values, group_codes)
+    boundary_pairs = pairs[_classify_pairs(space, values, distance, pairs, settings)["straddles"]]
+    inside = np.where(distance[boundary_pairs[:, 0]] >= 0, boundary_pairs[:, 0], boundary_pairs[:, 1])
+    outside = np.where(distance[boundary_pairs[:, 0]] >= 0, boundary_pairs[:, 1], boundary_pairs[:, 0])
+    boundary_df = pd.concat(
+        [
+            result_df.iloc[inside].reset_index(names="index").add_suffix("_inside"),
+            result_df.iloc[outside].reset_index(names="index").add_suffix("_outside"),
+        ],
+        axis=1,
+    )
+    boundary_df.to_csv(adaptive_dir / "boundary.csv", index=False)
+
+    num_groups = len(np.unique(group_codes))
+    report = {
+        "parameters": [parameter_name(parameter) for parameter in space.parameters],
+        "num_initial": int((rounds == 0).sum()),
+        "num_added": int((rounds > 0).sum()),
+        "num_inside": int((distances >= 0).sum()),
+        "num_outside": int((distances < 0).sum()),
+        "num_boundary_pairs": len(boundary_pairs),
+        "uniform_grid_runs": _uniform_grid_size(space, values, num_groups),
+        "rounds": round_log,
+    }
+    (adaptive_dir / "report.json").write_text(json.dumps(report, indent=2, ensure_ascii=False))
+    LOGGER.info(
+        f"適応的なスイープの結果を保存しました: {adaptive_dir} (最初 {report['num_initial']}件, "
+        f"追加 {report['num_added']}件, 同じ分解能の一様な格子では {report['uniform_grid_runs']}件)"
+    )
@@ -1,7 +1,22 @@
+"""時系列データのグラフ.
+
+pyplot は使わず、Aggバックエンドの Figure をプロセスごとに作って使い回す(線やタイトルだけを更新して保存する).
+線は LTTB (Largest-Triangle-Three-Buckets) で表示に必要な点の数まで間引いてから描く.
+"""
+
+from functools import lru_cache
 from pathlib import Path
 
-import matplotlib.pyplot as plt
+import matplotlib as mpl
+import numpy as np
 import pandas as pd
+from matplotlib.axes import Axes
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
+
+from trajecsim.jsbsim_support.schemas.chart import ChartSchema
+from trajecsim.jsbsim_support.trajectory import Trajectory, read_trajectory
 
 # seaborn のインポートを追加（オプション）
 try:
@@ -11,58 +26,230 @@ try:
     SEABORN_AVAILABLE = True
 except ImportError:
     SEABORN_AVAILABLE = False
+    # seabornが利用できない場合は、グリッドスタイルを手動で設定する
+    mpl.rcParams["axes.grid"] = True
+    mpl.rcParams["grid.alpha"] = 0.3
+    mpl.rcParams["axes.axisbelow"] = True
 
+# 1枚のグラフの大きさ[inch]と、図の余白[inch]. 描くたびにレイアウトを計算すると遅いので、余白は固定する
+PANEL_SIZE = (4.5, 2.6)
+FIGURE_MARGINS = {"left": 0.8, "right": 0.2, "bottom": 0.5, "top": 0.9}
+# 図のタイトルの上端の位置[inch]
+TITLE_OFFSET = 0.15
+PANEL_SPACING = {"wspace": 0.3, "hspace": 0.5}
+# 重ねたグラフの線の太さと、線の数に応じた透明度の下限
+ENSEMBLE_LINE_WIDTH = 0.8
+MIN_ENSEMBLE_ALPHA = 0.05
+# 組み合わせごとの列のグラフのファイル名 (per_run: per_column)
+COLUMN_CHART_NAME = "{column}_vs_time"
+SUMMARY_CHART_NAME = "time_series"
+ENSEMBLE_CHART_NAME = "ensemble"
 
-def create_time_series_plots(
-    output_info_df: pd.Series,
-):
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, num_points: int) -> np.ndarray:
+    """LTTB (Largest-Triangle-Three-Buckets) で残す点の番号を求める.
+
+    最初と最後の点を残し、残りをnum_points - 2個の区間に分けて、区間ごとに前に残した点と次の区間の平均を結ぶ
+    三角形の面積が最大になる点を残す. y が2次元の場合は列ごとに求める(区間のループは列で共有する).
+
+    Args:
+        x (np.ndarray): 時刻 (昇順).
+        y (np.ndarray): 値. 1次元または (点の数 x 列の数).
+        num_points (int): 残す点の数. 2以下または点の数以上の場合は間引かない.
+
+    Returns:
+        np.ndarray: 残す点の番号 (昇順). y と同じ次元で、2次元の場合は (残す点の数 x 列の数).
     """
-    Create time series plots for all columns in the CSV file.
+    x = np.asarray(x, dtype=float)
+    values = np.asarray(y, dtype=float)
+    values = values.reshape(len(x), -1)
+    num_rows, num_columns = values.shape
+    if num_points <= 2 or num_rows <= num_points:  # noqa: PLR2004
+        indices = np.repeat(np.arange(num_rows)[:, np.newaxis], num_columns, axis=1)
+        return indices if np.ndim(y) == 2 else indices[:, 0]  # noqa: PLR2004
+
+    bucket_edges = np.linspace(1, num_rows - 1, num_points - 1).astype(int)
+    column_index = np.arange(num_columns)
+    indices = np.empty((num_points, num_columns), dtype=int)
+    indices[0] = 0
+    indices[-1] = num_rows - 1
+    previous = np.zeros(num_columns, dtype=int)
+    for bucket in range(num_points - 2):
+        start, end = bucket_edges[bucket], bucket_edges[bucket + 1]
+        next_end = bucket_edges[bucket + 2] if bucket + 2 < len(bucket_edges) else num_rows
+        average_x = x[end:next_end].mean()
+        average_y = values[end:next_end].mean(axis=0)
+        previous_x, previous_y = x[previous], values[previous, column_index]
+        area = np.abs(
+            (previous_x - average_x) * (values[start:end] - previous_y)
+            - (previous_x - x[start:end, np.newaxis]) * (average_y - previous_y)
+        )
+        previous = start + np.argmax(np.nan_to_num(area, nan=-1.0), axis=0)
+        indices[bucket + 1] = previous
+    return indices if np.ndim(y) == 2 else indices[:, 0]  # noqa: PLR2004
+
+
+def downsample_series(trajectory: Trajectory, columns: list[str], max_points: int) -> dict[str, np.ndarray]:
+    """列ごとに LTTB で間引いた (時刻, 値) の配列.
 
     Args:
-        csv_path (str): Path to the input CSV file
-        output_dir (str): Directory to save the plots
+        trajectory (Trajectory): 時系列データ.
+        columns (list[str]): 列. 指定しない場合は Time 以外のすべての列.
+        max_points (int): 1本の線の点の数の上限. 0の場合は間引かない.
+
+    Returns:
+        dict[str, np.ndarray]: 列ごとの (点の数 x 2) の配列. 時系列データにない列は含めない.
     """
+    columns = [column for column in columns or trajectory.columns if column != "Time" and column in trajectory.columns]
+    if not columns or not len(trajectory):
+        return {}
+    time = trajectory["Time"]
+    values = np.column_stack([trajectory[column] for column in columns])
+    indices = lttb_indices(time, values, max_points)
+    return {
+        column: np.column_stack([time[indices[:, i]], values[indices[:, i], i]]) for i, column in enumerate(columns)
+    }
+
+
+class TimeSeriesChart:
+    """複数のグラフを並べた1枚の図. 同じ数のグラフを描くときは図と線を使い回す."""
+
+    def __init__(self, num_panels: int, panel_columns: int) -> None:
+        """初期化
+
+        Args:
+            num_panels (int): グラフの数.
+            panel_columns (int): 1行に並べるグラフの数.
+        """
+        panel_columns = max(1, min(panel_columns, num_panels))
+        panel_rows = -(-num_panels // panel_columns)
+        width, height = PANEL_SIZE[0] * panel_columns, PANEL_SIZE[1] * panel_rows
+        self.figure = Figure(figsize=(width, height))
+        FigureCanvasAgg(self.figure)
+        self.figure.subplots_adjust(
+            left=FIGURE_MARGINS["left"] / width,
+            right=1 - FIGURE_MARGINS["right"] / width,
+            bottom=FIGURE_MARGINS["bottom"] / height,
+            top=1 - FIGURE_MARGINS["top"] / height,
+            **PANEL_SPACING,
+        )
+        axes = self.figure.subplots(panel_rows, panel_columns, squeeze=False).ravel()
+        for unused_axes in axes[num_panels:]:
+            unused_axes.set_visible(False)
+        self.axes: list[Axes] = list(axes[:num_panels])
+        # グラフごとに1つの LineCollection に線をまとめ、描くたびに線の座標だけを入れ替える
+        self._collections = [LineCollection([], color="C0") for _ in self.axes]
+        for panel_axes, collection in zip(self.axes, self._collections, strict=True):
+            panel_axes.add_collection(collection)
+            panel_axes.set_xlabel("Time [s]")
+            panel_axes.grid(True, alpha=0.3)
 
-    output_file = output_info_df["raw_output_file"]
-    # Read the CSV file
-    output_dir = Path(Path(output_file).parent)
-    df = pd.read_csv(output_file)
+    def draw(
+        self,
+        panels: list[tuple[str, list[np.ndarray]]],
+        path: Path,
+        chart: ChartSchema,
+        title: str = "",
+    ) -> Path:
+        """グラフを描いて保存する.
 
-    # Create output directory if it doesn't exist
-    output_path = Path(output_dir)
+        Args:
+            panels (list[tuple[str, list[np.ndarray]]]): グラフごとの列名と、線ごとの (点の数 x 2) の配列.
+            path (Path): 保存先 (拡張子なし). 拡張子は chart.format にする.
+            chart (ChartSchema): グラフの設定.
+            title (str): 図のタイトル.
+
+        Returns:
+            Path: 保存先.
+        """
+        for panel_axes, collection, (column, series) in zip(self.axes, self._collections, panels, strict=True):
+            collection.set_segments(series)
+            # 重ねる線が多いほど細く、薄くする
+            if len(series) > 1:
+                alpha = max(MIN_ENSEMBLE_ALPHA, min(0.8, 8.0 / len(series)))
+                collection.set(alpha=alpha, linewidth=ENSEMBLE_LINE_WIDTH)
+            else:
+                collection.set(alpha=1.0, linewidth=1.0)
+            panel_axes.set_title(column)
+            points = np.vstack(series) if series else np.zeros((0, 2))
+            points = points[np.isfinite(points).all(axis=1)]
+            if len(points):
+                panel_axes.dataLim.set_points(np.array([points.min(axis=0), points.max(axis=0)]))
+                panel_axes.autoscale_view()
+        self.figure.suptitle(title, y=1 - TITLE_OFFSET / self.figure.get_figheight(), va="top")
+        path = path.with_name(f"{path.name}.{chart.format}")
+        self.figure.savefig(path, dpi=chart.dpi, format=chart.format)
+        return path
+
+
+@lru_cache(maxsize=8)
+def _get_chart(num_panels: int, panel_columns: int) -> TimeSeriesChart:
+    """プロセス内で使い回す図を取得する."""
+    return TimeSeriesChart(num_panels, panel_columns)
+
+
+def create_time_series_plots(
+    output_info_df: pd.Series,
+    chart: ChartSchema | None = None,
+    trajectory: Trajectory | None = None,
+) -> dict[str, np.ndarray]:
+    """1回のシミュレーション結果の時系列のグラフを、出力ファイルと同じディレクトリに保存する.
+
+    Args:
+        output_info_df (pd.Series): シミュレーションのパラメータと結果を含む行.
+        chart (ChartSchema | None): グラフの設定. Noneの場合は既定値.
+        trajectory (Trajectory | None): 時系列データ. Noneの場合はメモリ上またはCSVファイルから読み込む.
+
+    Returns:
+        dict[str, np.ndarray]: 列ごとの ensemble_max_points 点まで間引いた (時刻, 値) の配列.
+            グループのグラフ(ensemble)に使う. chart.ensemble が False の場合は空.
+    """
+    chart = chart or ChartSchema()
+    if trajectory is None:
+        trajectory = Trajectory.from_dataframe(read_trajectory(output_info_df))
+    output_path = Path(output_info_df["raw_output_file"]).parent
     output_path.mkdir(parents=True, exist_ok=True)
 
-    # Set style - 修正版
-    if not SEABORN_AVAILABLE:
-        # seabornが利用できない場合は、matplotlib の built-in スタイルを使用
-        plt.style.use("default")  # または "ggplot", "bmh", "classic" など
-        # グリッドスタイルを手動で設定
-        plt.rcParams["axes.grid"] = True
-        plt.rcParams["grid.alpha"] = 0.3
-        plt.rcParams["axes.axisbelow"] = True
-
-    # Create plots for each column except 'Time'
-    for column in df.columns:
-        if column == "Time":
-            continue
-
-        plt.figure(figsize=(12, 6))
-        plt.plot(df["Time"], df[column], linewidth=1)
-
-        # Customize plot
-        plt.title(f"{column} vs Time")
-        plt.xlabel("Time")
-        plt.ylabel(column)
-        plt.grid(True, alpha=0.3)
-
-        # Save plot
-        plt.savefig(output_path / f"{column}_vs_time.png", dpi=300, bbox_inches="tight")
-        plt.close()
-
-
-if __name__ == "__main__":
-    # Example usage
-    csv_path = "data/result/raw_result/rocket_terminal_velocity=0.0__.csv"
-    output_dir = "data/result/plots"
-    create_time_series_plots(csv_path, output_dir)
+    ensemble_series = (
+        downsample_series(trajectory, chart.columns, chart.ensemble_max_points) if chart.ensemble else {}
+    )
+    if chart.per_run == "none":
+        return ensemble_series
+    series = downsample_series(trajectory, chart.columns, chart.max_points)
+    if not series:
+        return ensemble_series
+    if chart.per_run == "summary":
+        _get_chart(len(series), chart.panel_columns).draw(
+            [(column, [points]) for column, points in series.items()],
+            output_path / SUMMARY_CHART_NAME,
+            chart,
+            title=str(output_info_df.name),
+        )
+    else:
+        column_chart = _get_chart(1, 1)
+        for column, points in series.items():
+            column_chart.draw(
+                [(column, [points])], output_path / COLUMN_CHART_NAME.format(column=column), chart, title=""
+            )
+    return ensemble_series
+
+
+def create_ensemble_plot(chart_series: pd.Series, output_dir: Path, chart: ChartSchema) -> Path | None:
+    """グループのすべての組み合わせの時系列を重ねたグラフを保存する.
+
+    Args:
+        chart_series (pd.Series): 組み合わせごとの create_time_series_plots の戻り値.
+        output_dir (Path): 出力ディレクトリ.
+        chart (ChartSchema): グラフの設定.
+
+    Returns:
+        Path | None: 保存先. 時系列がない場合はNone.
+    """
+    runs = [series for series in chart_series if isinstance(series, dict) and series]
+    if not runs:
+        return None
+    columns = list(dict.fromkeys(column for series in runs for column in series))
+    panels = [(column, [series[column] for series in runs if column in series]) for column in columns]
+    return _get_chart(len(panels), chart.panel_columns).draw(
+        panels, output_dir / ENSEMBLE_CHART_NAME, chart, title=f"{output_dir.name} ({len(runs)})"
+    )
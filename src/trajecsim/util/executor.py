@@ -0,0 +1,305 @@
+"""タスクの並列実行.
+
+joblib.delayed で作ったタスク (関数, 引数, キーワード引数) のリストを実行し、同じ順番で結果を返す.
+
+- LocalExecutor: このマシンのプロセスで実行する (joblib).
+- SharedFsExecutor: 共有ファイルシステム上のキューにタスクを置き、任意の数のワーカー(src/worker.py)が取り出して実行する.
+  ワーカーは複数のマシンで起動できる. タスクの関数は trajecsim のモジュールのものを使い、パスは作業ディレクトリからの
+  相対パスのまま渡すため、ワーカーは本体と同じ作業ディレクトリ(共有ファイルシステム上)で起動する.
+
+キューのディレクトリ構成 (バッチは Executor.run の1回の呼び出し):
+
+    queue_dir/<バッチ>/tasks/<番号>.pkl    実行待ち
+    queue_dir/<バッチ>/claimed/<番号>.pkl  実行中 (tasks からの rename で取り出す)
+    queue_dir/<バッチ>/results/<番号>.pkl  結果
+"""
+
+import logging
+import multiprocessing
+import os
+import pickle
+import threading
+import time
+import traceback
+from abc import ABC, abstractmethod
+from collections.abc import Callable
+from pathlib import Path
+from shutil import rmtree
+from typing import Any
+
+from joblib import Parallel
+from tqdm import tqdm
+
+from trajecsim.jsbsim_support.schemas.executor import ExecutorSchema
+from trajecsim.util.logger import tqdm_joblib
+
+LOGGER = logging.getLogger(__name__)
+
+# joblib.delayed(func)(*args, **kwargs) の戻り値
+Task = tuple[Callable[..., Any], tuple[Any, ...], dict[str, Any]]
+
+TASKS_DIR_NAME = "tasks"
+CLAIMED_DIR_NAME = "claimed"
+RESULTS_DIR_NAME = "results"
+INCOMING_DIR_NAME = "incoming"
+TASK_SUFFIX = ".pkl"
+
+
+class Executor(ABC):
+    """タスクを並列に実行する."""
+
+    @abstractmethod
+    def run(self, tasks: list[Task], desc: str | None = None) -> list[Any]:
+        """タスクを実行する.
+
+        Args:
+            tasks (list[Task]): joblib.delayed で作ったタスク.
+            desc (str | None): 進捗バーの説明. Noneの場合は進捗バーを表示しない.
+
+        Returns:
+            list[Any]: タスクと同じ順番の結果.
+        """
+
+
+class LocalExecutor(Executor):
+    """このマシンのプロセスで実行する."""
+
+    def __init__(self, n_jobs: int | None = None) -> None:
+        """初期化
+
+        Args:
+            n_jobs (int | None): プロセス数. Noneの場合はCPU数.
+        """
+        self.n_jobs = n_jobs or os.cpu_count()
+
+    def run(self, tasks: list[Task], desc: str | None = None) -> list[Any]:
+        """タスクを joblib で実行する."""
+        if desc is None:
+            return Parallel(n_jobs=self.n_jobs)(tasks)
+        with tqdm_joblib(tqdm(desc=desc, total=len(tasks))):
+            return Parallel(n_jobs=self.n_jobs)(tasks)
+
+
+def _write_atomic(path: Path, data: bytes, temp_dir: Path) -> None:
+    """他のプロセスが書きかけのファイルを読まないように、一時ファイルに書いてから rename する."""
+    temp_path = temp_dir / f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp"
+    temp_path.write_bytes(data)
+    temp_path.replace(path)
+
+
+def _claim_task(batch_dirs: list[Path]) -> Path | None:
+    """実行待ちのタスクを1つ取り出す. rename はアトミックなので、同じタスクを2つのワーカーが取り出すことはない."""
+    for batch_dir in batch_dirs:
+        try:
+            task_paths = sorted((batch_dir / TASKS_DIR_NAME).iterdir())
+        except FileNotFoundError:
+            continue
+        for task_path in task_paths:
+            claimed_path = batch_dir / CLAIMED_DIR_NAME / task_path.name
+            try:
+                task_path.rename(claimed_path)
+            except FileNotFoundError:
+                continue
+            # rename では更新時刻が変わらないので、取り出した時刻にする
+            os.utime(claimed_path)
+            return claimed_path
+    return None
+
+
+def _execute_task(claimed_path: Path, heartbeat_interval: float) -> None:
+    """取り出したタスクを実行し、結果を保存する. 実行中は定期的に更新時刻を更新して、生きていることを示す."""
+    batch_dir = claimed_path.parent.parent
+    stop_heartbeat = threading.Event()
+
+    def heartbeat() -> None:
+        while not stop_heartbeat.wait(heartbeat_interval):
+            try:
+                os.utime(claimed_path)
+            except FileNotFoundError:
+                return
+
+    heartbeat_thread = threading.Thread(target=heartbeat, daemon=True)
+    heartbeat_thread.start()
+    try:
+        func, args, kwargs = pickle.loads(claimed_path.read_bytes())  # noqa: S301
+        try:
+            outcome: tuple[str, Any, str | None] = ("ok", func(*args, **kwargs), None)
+        except Exception as error:  # noqa: BLE001
+            outcome = ("error", error, traceback.format_exc())
+        try:
+            data = pickle.dumps(outcome)
+        except Exception:  # noqa: BLE001
+            # 例外や結果を pickle できない場合は、内容を文字列にして返す
+            data = pickle.dumps(("error", RuntimeError(repr(outcome[1])), outcome[2] or traceback.format_exc()))
+        try:
+            _write_atomic(batch_dir / RESULTS_DIR_NAME / claimed_path.name, data, batch_dir / INCOMING_DIR_NAME)
+        except FileNotFoundError:
+            # 本体がバッチを中止して削除した場合は、結果を捨てる
+            LOGGER.warning(f"削除されたバッチのタスクの結果を破棄します: {batch_dir.name}/{claimed_path.name}")
+    finally:
+        stop_heartbeat.set()
+        heartbeat_thread.join()
+        claimed_path.unlink(missing_ok=True)
+
+
+def run_worker(
+    queue_dir: Path | str,
+    batch_name: str | None = None,
+    idle_timeout_s: float | None = None,
+    poll_interval_s: float = 0.2,
+    heartbeat_interval_s: float = 10.0,
+) -> int:
+    """キューからタスクを取り出して実行し続ける.
+
+    Args:
+        queue_dir (Path | str): キューのディレクトリ.
+        batch_name (str | None): このバッチのタスクだけを実行し、実行待ちがなくなったら終了する.
+        idle_timeout_s (float | None): 実行待ちのタスクがない状態がこの時間[s]続いたら終了する. Noneの場合は終了しない.
+        poll_interval_s (float): 実行待ちのタスクがない場合に、キューを確認する間隔[s].
+        heartbeat_interval_s (float): 実行中のタスクの更新時刻を更新する間隔[s].
+
+    Returns:
+        int: 実行したタスクの数.
+    """
+    queue_dir = Path(queue_dir)
+    num_tasks = 0
+    idle_since = time.monotonic()
+    while True:
+        if batch_name is not None:
+            batch_dirs = [queue_dir / batch_name]
+        else:
+            batch_dirs = sorted(queue_dir.iterdir()) if queue_dir.exists() else []
+        claimed_path = _claim_task(batch_dirs)
+        if claimed_path is not None:
+            _execute_task(claimed_path, heartbeat_interval_s)
+            num_tasks += 1
+            idle_since = time.monotonic()
+            continue
+        if batch_name is not None:
+            return num_tasks
+        if idle_timeout_s is not None and time.monotonic() - idle_since > idle_timeout_s:
+            return num_tasks
+        time.sleep(poll_interval_s)
+
+
+class SharedFsExecutor(Executor):
+    """共有ファイルシステム上のキューを介してワーカーに実行させる."""
+
+    def __init__(
+        self,
+        queue_dir: Path | str,
+        local_workers: int = 0,
+        coordinator_works: bool = True,
+        lease_timeout_s: float = 600.0,
+        poll_interval_s: float = 0.2,
+    ) -> None:
+        """初期化
+
+        Args:
+            queue_dir (Path | str): キューのディレクトリ.
+            local_workers (int): このマシンで起動するワーカーの数.
+            coordinator_works (bool): 結果を待つ間、このプロセスもタスクを実行する.
+            lease_timeout_s (float): 取り出されてからこの時間[s]更新のないタスクは、ワーカーが停止したとみなして
+                キューに戻す.
+            poll_interval_s (float): 結果を確認する間隔[s].
+        """
+        self.queue_dir = Path(queue_dir)
+        self.local_workers = local_workers
+        self.coordinator_works = coordinator_works
+        self.lease_timeout_s = lease_timeout_s
+        self.poll_interval_s = poll_interval_s
+
+    def run(self, tasks: list[Task], desc: str | None = None) -> list[Any]:
+        """タスクをキューに置き、全ての結果が揃うまで待つ."""
+        if not tasks:
+            return []
+        batch_dir = self.queue_dir / f"{time.time_ns()}-{os.getpid()}"
+        for dir_name in (INCOMING_DIR_NAME, TASKS_DIR_NAME, CLAIMED_DIR_NAME, RESULTS_DIR_NAME):
+            (batch_dir / dir_name).mkdir(parents=True, exist_ok=True)
+        task_names = [f"{i:08d}{TASK_SUFFIX}" for i in range(len(tasks))]
+        for task_name, task in zip(task_names, tasks, strict=True):
+            _write_atomic(batch_dir / TASKS_DIR_NAME / task_name, pickle.dumps(task), batch_dir / INCOMING_DIR_NAME)
+
+        context = multiprocessing.get_context("spawn")
+        workers = [
+            context.Process(
+                target=run_worker,
+                args=(self.queue_dir, batch_dir.name),
+                kwargs={"heartbeat_interval_s": self.lease_timeout_s / 3},
+                daemon=True,
+            )
+            for _ in range(self.local_workers)
+        ]
+        for worker in workers:
+            worker.start()
+        progress = tqdm(desc=desc, total=len(tasks), disable=desc is None)
+        try:
+            results = self._wait(batch_dir, len(tasks), progress)
+            return [results[task_name] for task_name in task_names]
+        finally:
+            progress.close()
+            for worker in workers:
+                worker.terminate()
+                worker.join()
+            rmtree(batch_dir, ignore_errors=True)
+
+    def _wait(self, batch_dir: Path, num_tasks: int, progress: tqdm) -> dict[str, Any]:
+        """全ての結果が揃うまで待つ. 失敗したタスクがあれば、残りを待たずにその例外を送出する."""
+        results_dir = batch_dir / RESULTS_DIR_NAME
+        results: dict[str, Any] = {}
+        while True:
+            finished = {path.name for path in results_dir.iterdir() if path.suffix == TASK_SUFFIX}
+            for task_name in sorted(finished - results.keys()):
+                results[task_name] = self._load_result(results_dir / task_name)
+                progress.update()
+            if len(results) == num_tasks:
+                return results
+            self._requeue_expired(batch_dir, finished)
+
+            claimed_path = _claim_task([batch_dir]) if self.coordinator_works else None
+            if claimed_path is not None:
+                _execute_task(claimed_path, self.lease_timeout_s / 3)
+            else:
+                time.sleep(self.poll_interval_s)
+
+    def _requeue_expired(self, batch_dir: Path, finished: set[str]) -> None:
+        """停止したワーカーが取り出したままのタスクをキューに戻す."""
+        now = time.time()
+        for claimed_path in (batch_dir / CLAIMED_DIR_NAME).iterdir():
+            try:
+                expired = now - claimed_path.stat().st_mtime > self.lease_timeout_s
+                if expired and claimed_path.name not in finished:
+                    claimed_path.rename(batch_dir / TASKS_DIR_NAME / claimed_path.name)
+                    LOGGER.warning(f"応答のないワーカーのタスクを再実行します: {claimed_path.name}")
+            except FileNotFoundError:
+                continue
+
+    @staticmethod
+    def _load_result(result_path: Path) -> Any:  # noqa: ANN401
+        status, value, error_traceback = pickle.loads(result_path.read_bytes())  # noqa: S301
+        if status == "error":
+            LOGGER.error(f"タスクの実行に失敗しました: {result_path.name}\n{error_traceback}")
+            raise value
+        return value
+
+
+def create_executor(executor_schema: ExecutorSchema | None = None) -> Executor:
+    """設定から Executor を作る.
+
+    Args:
+        executor_schema (ExecutorSchema | None): 並列実行の設定. Noneの場合はこのマシンのCPU数で実行する.
+
+    Returns:
+        Executor: 設定に応じた Executor.
+    """
+    if executor_schema is None:
+        return LocalExecutor()
+    if executor_schema.backend == "shared_fs":
+        return SharedFsExecutor(
+            executor_schema.queue_dir,
+            local_workers=executor_schema.local_workers,
+            coordinator_works=executor_schema.coordinator_works,
+            lease_timeout_s=executor_schema.lease_timeout_s,
+            poll_interval_s=executor_schema.poll_interval_s,
+        )
+    return LocalExecutor(executor_schema.n_jobs)
@@ -0,0 +1,166 @@
+"""WGS84楕円体上の測地線距離をNumPyの配列でまとめて計算する.
+
+Vincentyの逆解法を配列に対してベクトル化したもの. 地点間の距離が対蹠点に近くない限り、
+geopy.distance.geodesic と1mm未満で一致する.
+"""
+
+import numpy as np
+import numpy.typing as npt
+
+# WGS84楕円体
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_B = (1 - WGS84_F) * WGS84_A
+
+# 逆解法の収束判定[rad]と最大反復回数
+CONVERGENCE_THRESHOLD = 1e-12
+MAX_ITERATIONS = 200
+
+ArrayLike = npt.ArrayLike
+
+
+def geodesic_distance(lat1: ArrayLike, lon1: ArrayLike, lat2: ArrayLike, lon2: ArrayLike) -> np.ndarray:
+    """2地点間の測地線距離を計算する. 引数はブロードキャストされる.
+
+    Args:
+        lat1 (ArrayLike): 地点1の緯度[deg].
+        lon1 (ArrayLike): 地点1の経度[deg].
+        lat2 (ArrayLike): 地点2の緯度[deg].
+        lon2 (ArrayLike): 地点2の経度[deg].
+
+    Returns:
+        np.ndarray: 距離[m].
+    """
+    lat1, lon1, lat2, lon2 = np.broadcast_arrays(
+        *(np.asarray(value, dtype=float) for value in (lat1, lon1, lat2, lon2))
+    )
+    f = WGS84_F
+    u1 = np.arctan((1 - f) * np.tan(np.radians(lat1)))
+    u2 = np.arctan((1 - f) * np.tan(np.radians(lat2)))
+    sin_u1, cos_u1 = np.sin(u1), np.cos(u1)
+    sin_u2, cos_u2 = np.sin(u2), np.cos(u2)
+    lon_diff = np.radians(lon2 - lon1)
+
+    lam = lon_diff
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for _ in range(MAX_ITERATIONS):
+            sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+            sin_sigma = np.hypot(cos_u2 * sin_lam, cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lam)
+            cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lam
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            # 同じ地点の場合は sin_sigma = 0
+            sin_alpha = np.where(sin_sigma == 0, 0.0, cos_u1 * cos_u2 * sin_lam / sin_sigma)
+            cos_sq_alpha = 1 - sin_alpha**2
+            # 赤道上の測地線の場合は cos_sq_alpha = 0
+            cos_2sigma_m = np.where(cos_sq_alpha == 0, 0.0, cos_sigma - 2 * sin_u1 * sin_u2 / cos_sq_alpha)
+            c = f / 16 * cos_sq_alpha * (4 + f * (4 - 3 * cos_sq_alpha))
+            lam_prev = lam
+            lam = lon_diff + (1 - c) * f * sin_alpha * (
+                sigma + c * sin_sigma * (cos_2sigma_m + c * cos_sigma * (-1 + 2 * cos_2sigma_m**2))
+            )
+            if np.all(np.abs(lam - lam_prev) < CONVERGENCE_THRESHOLD):
+                break
+
+    u_sq = cos_sq_alpha * (WGS84_A**2 - WGS84_B**2) / WGS84_B**2
+    a = 1 + u_sq / 16384 * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+    b = u_sq / 1024 * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+    delta_sigma = (
+        b
+        * sin_sigma
+        * (
+            cos_2sigma_m
+            + b
+            / 4
+            * (
+                cos_sigma * (-1 + 2 * cos_2sigma_m**2)
+                - b / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma**2) * (-3 + 4 * cos_2sigma_m**2)
+            )
+        )
+    )
+    return WGS84_B * a * (sigma - delta_sigma)
+
+
+def geodesic_offsets(lat0: ArrayLike, lon0: ArrayLike, lat: ArrayLike, lon: ArrayLike) -> dict[str, np.ndarray]:
+    """基準点から見た各地点の距離と南北・東西方向の距離を計算する.
+
+    南北方向は経度を基準点に固定した点まで、東西方向は緯度を基準点に固定した点までの測地線距離.
+    符号は緯度・経度の差と同じで、基準点より北・東にある地点を正、南・西にある地点を負とする.
+
+    Args:
+        lat0 (ArrayLike): 基準点の緯度[deg].
+        lon0 (ArrayLike): 基準点の経度[deg].
+        lat (ArrayLike): 各地点の緯度[deg].
+        lon (ArrayLike): 各地点の経度[deg].
+
+    Returns:
+        dict[str, np.ndarray]: distance_m, lat_diff_m, lon_diff_m, lat_diff_degrees, lon_diff_degrees.
+    """
+    lat0, lon0, lat, lon = np.broadcast_arrays(*(np.asarray(value, dtype=float) for value in (lat0, lon0, lat, lon)))
+    lat_diff_degrees = lat - lat0
+    lon_diff_degrees = lon - lon0
+    return {
+        "distance_m": geodesic_distance(lat0, lon0, lat, lon),
+        "lat_diff_m": np.where(lat_diff_degrees < 0, -1, 1) * geodesic_distance(lat0, lon0, lat, lon0),
+        "lon_diff_m": np.where(lon_diff_degrees < 0, -1, 1) * geodesic_distance(lat0, lon0, lat0, lon),
+        "lat_diff_degrees": lat_diff_degrees,
+        "lon_diff_degrees": lon_diff_degrees,
+    }
+
+
+def offset_to_degrees(lat: ArrayLike, north_m: ArrayLike, east_m: ArrayLike) -> tuple[np.ndarray, np.ndarray]:
+    """緯度latの地点における南北・東西方向の距離を緯度・経度の差に変換する. 数km程度までの距離に使う.
+
+    Args:
+        lat (ArrayLike): 緯度[deg].
+        north_m (ArrayLike): 南北方向の距離[m]. 北を正とする.
+        east_m (ArrayLike): 東西方向の距離[m]. 東を正とする.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: 緯度の差[deg]と経度の差[deg].
+    """
+    lat_rad = np.radians(np.asarray(lat, dtype=float))
+    e_sq = WGS84_F * (2 - WGS84_F)
+    w = np.sqrt(1 - e_sq * np.sin(lat_rad) ** 2)
+    # 子午線曲率半径と卯酉線曲率半径
+    meridian_radius = WGS84_A * (1 - e_sq) / w**3
+    prime_vertical_radius = WGS84_A / w
+    lat_diff = np.degrees(np.asarray(north_m, dtype=float) / meridian_radius)
+    lon_diff = np.degrees(np.asarray(east_m, dtype=float) / (prime_vertical_radius * np.cos(lat_rad)))
+    return lat_diff, lon_diff
+
+
+def geodetic_to_geocentric_latitude(lat: ArrayLike, height_m: ArrayLike) -> np.ndarray:
+    """測地緯度を、楕円体高の地点の地心緯度に変換する (JSBSimの position/lat-gc-deg と同じ).
+
+    Args:
+        lat (ArrayLike): 測地緯度[deg].
+        height_m (ArrayLike): 楕円体高[m].
+
+    Returns:
+        np.ndarray: 地心緯度[deg].
+    """
+    lat_rad = np.radians(np.asarray(lat, dtype=float))
+    height_m = np.asarray(height_m, dtype=float)
+    e_sq = WGS84_F * (2 - WGS84_F)
+    prime_vertical_radius = WGS84_A / np.sqrt(1 - e_sq * np.sin(lat_rad) ** 2)
+    ratio = (prime_vertical_radius * (1 - e_sq) + height_m) / (prime_vertical_radius + height_m)
+    return np.degrees(np.arctan(ratio * np.tan(lat_rad)))
+
+
+def geocentric_to_geodetic_latitude(lat: ArrayLike, height_m: ArrayLike, iterations: int = 5) -> np.ndarray:
+    """地心緯度を測地緯度に変換する (geodetic_to_geocentric_latitude の逆変換). JSBSimの ic/lat-gc-deg に使う.
+
+    Args:
+        lat (ArrayLike): 地心緯度[deg].
+        height_m (ArrayLike): 楕円体高[m].
+        iterations (int): 反復回数. 1回ごとに誤差が1/100程度になり、5回で1e-9度未満に収束する.
+
+    Returns:
+        np.ndarray: 測地緯度[deg].
+    """
+    lat = np.asarray(lat, dtype=float)
+    geodetic_lat = lat
+    for _ in range(iterations):
+        # 地心緯度の誤差を測地緯度の補正に使う (両者の差は最大0.2度程度で、傾きはほぼ1)
+        geodetic_lat = geodetic_lat + (lat - geodetic_to_geocentric_latitude(geodetic_lat, height_m))
+    return geodetic_lat
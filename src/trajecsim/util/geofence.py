@@ -0,0 +1,348 @@
+"""保安域(range_kmz)のポリゴンと着地点の位置関係を計算する.
+
+KMZ(またはKML)の Polygon を一度だけ読み込み、射点を原点とする接平面上の座標[m]で、多数の地点の内外判定と
+境界までの距離をNumPyの配列でまとめて計算する. 保安域は数km程度の大きさなので、接平面の近似の誤差は十分に小さい.
+
+ポリゴンを囲む格子のセルごとに、セル内の点から最も近くなりうる辺と、セル内の点から東向きの半直線が交わりうる辺を
+あらかじめ求めておき(空間インデックス)、点はセルごとにまとめてそれらの辺とだけ計算する.
+"""
+
+import logging
+import xml.etree.ElementTree as ET
+import zipfile
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from trajecsim.util.geodesy import ArrayLike, offset_to_degrees
+
+LOGGER = logging.getLogger(__name__)
+
+INSIDE_COLUMN = "inside_range"
+DISTANCE_COLUMN = "distance_to_boundary_m"
+FLIGHT_PATH_DISTANCE_COLUMN = "flight_path_min_distance_to_boundary_m"
+GEOFENCE_COLUMNS = [INSIDE_COLUMN, DISTANCE_COLUMN]
+# 一度に計算する地点の数. 地点の数 x 辺の数 の配列のメモリを抑える
+POINT_CHUNK_SIZE = 4096
+# 空間インデックスの格子の1辺のセルの数の上限と、格子をポリゴンの外側に広げる割合
+MAX_GRID_SIZE = 128
+GRID_PADDING_RATIO = 0.5
+
+
+def _local_name(tag: str) -> str:
+    """名前空間を除いたタグ名."""
+    return tag.rsplit("}", 1)[-1]
+
+
+def _parse_coordinates(text: str | None) -> np.ndarray:
+    """KMLの coordinates (経度,緯度[,高度] を空白区切り) を (経度, 緯度) の配列にする."""
+    points = [tuple(float(value) for value in token.split(",")[:2]) for token in (text or "").split()]
+    return np.array(points, dtype=float).reshape(-1, 2)
+
+
+def load_range_polygons(kmz_path: Path | str) -> list[list[np.ndarray]]:
+    """KMZ(またはKML)ファイルから Polygon を読み込む.
+
+    Args:
+        kmz_path (Path | str): KMZまたはKMLファイルのパス.
+
+    Raises:
+        ValueError: Polygon が含まれていない場合.
+
+    Returns:
+        list[list[np.ndarray]]: ポリゴンごとの輪郭 (外周と穴) の (経度, 緯度) の配列.
+    """
+    kmz_path = Path(kmz_path)
+    if zipfile.is_zipfile(kmz_path):
+        with zipfile.ZipFile(kmz_path) as kmz:
+            kml_name = "doc.kml" if "doc.kml" in kmz.namelist() else next(
+                name for name in kmz.namelist() if name.endswith(".kml")
+            )
+            root = ET.fromstring(kmz.read(kml_name))
+    else:
+        root = ET.parse(kmz_path).getroot()
+
+    polygons = []
+    for polygon in root.iter():
+        if _local_name(polygon.tag) != "Polygon":
+            continue
+        rings = [
+            _parse_coordinates(element.text)
+            for element in polygon.iter()
+            if _local_name(element.tag) == "coordinates"
+        ]
+        rings = [ring for ring in rings if len(ring) >= 3]
+        if rings:
+            polygons.append(rings)
+    if not polygons:
+        raise ValueError(f"保安域のポリゴンがありません: {kmz_path}")
+    return polygons
+
+
+def _segment_distances(points: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """点から線分までの距離 (点の数 x 線分の数)."""
+    edge_x, edge_y = (ends - starts).T
+    inverse_length_sq = 1.0 / np.maximum(edge_x**2 + edge_y**2, 1e-12)
+    relative_x = points[:, 0:1] - starts[:, 0]
+    relative_y = points[:, 1:2] - starts[:, 1]
+    t = np.clip((relative_x * edge_x + relative_y * edge_y) * inverse_length_sq, 0.0, 1.0)
+    relative_x -= t * edge_x
+    relative_y -= t * edge_y
+    return np.sqrt(relative_x**2 + relative_y**2)
+
+
+def _ray_crossings(points: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """点から東向きの半直線が線分と交わるか (点の数 x 線分の数)."""
+    x, y = points[:, 0:1], points[:, 1:2]
+    straddles = (starts[:, 1] > y) != (ends[:, 1] > y)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = (ends[:, 0] - starts[:, 0]) / (ends[:, 1] - starts[:, 1])
+    return straddles & (x < starts[:, 0] + (y - starts[:, 1]) * slope)
+
+
+class RangeGeofence:
+    """保安域のポリゴン. 複数のポリゴンがある場合は、いずれかの内側を保安域の内側とする."""
+
+    def __init__(
+        self,
+        polygons: list[list[np.ndarray]],
+        origin_latitude: float,
+        origin_longitude: float,
+        grid_size: int | None = None,
+    ) -> None:
+        """初期化
+
+        Args:
+            polygons (list[list[np.ndarray]]): ポリゴンごとの輪郭の (経度, 緯度) の配列.
+            origin_latitude (float): 接平面の原点の緯度[deg]. 射点を使う.
+            origin_longitude (float): 接平面の原点の経度[deg].
+            grid_size (int | None): 空間インデックスの格子の1辺のセルの数. Noneの場合は辺の数から決める.
+        """
+        self.origin_latitude = origin_latitude
+        self.origin_longitude = origin_longitude
+        # 1mあたりの緯度・経度の差
+        self._degrees_per_meter = np.array(offset_to_degrees(origin_latitude, 1.0, 1.0), dtype=float)
+        # 辺の始点と終点 (東, 北)[m] と、辺が属するポリゴンの番号
+        starts, ends, polygon_ids = [], [], []
+        for polygon_id, rings in enumerate(polygons):
+            for ring in rings:
+                points = self._project(ring[:, 1], ring[:, 0])
+                if not np.array_equal(points[0], points[-1]):
+                    points = np.vstack([points, points[:1]])
+                starts.append(points[:-1])
+                ends.append(points[1:])
+                polygon_ids.append(np.full(len(points) - 1, polygon_id))
+        self._starts = np.vstack(starts)
+        self._ends = np.vstack(ends)
+        # 辺がどのポリゴンに属するか (辺の数 x ポリゴンの数). 交差数をポリゴンごとに数えるのに使う
+        self._polygon_membership = np.eye(len(polygons), dtype=int)[np.concatenate(polygon_ids)]
+        self._build_index(grid_size)
+
+    @classmethod
+    def from_kmz(cls, kmz_path: Path | str, origin_latitude: float, origin_longitude: float) -> "RangeGeofence":
+        """KMZ(またはKML)ファイルから作る."""
+        return cls(load_range_polygons(kmz_path), origin_latitude, origin_longitude)
+
+    def _project(self, latitude: ArrayLike, longitude: ArrayLike) -> np.ndarray:
+        """緯度・経度を接平面上の (東, 北)[m] にする."""
+        north = (np.asarray(latitude, dtype=float) - self.origin_latitude) / self._degrees_per_meter[0]
+        east = (np.asarray(longitude, dtype=float) - self.origin_longitude) / self._degrees_per_meter[1]
+        return np.column_stack([np.ravel(east), np.ravel(north)])
+
+    def _build_index(self, grid_size: int | None) -> None:
+        """格子のセルごとに、距離と内外判定で計算する辺を求める."""
+        num_edges = len(self._starts)
+        self._grid_size = grid_size or int(np.clip(2 * np.ceil(np.sqrt(num_edges)), 4, MAX_GRID_SIZE))
+        vertices = np.vstack([self._starts, self._ends])
+        low, high = vertices.min(axis=0), vertices.max(axis=0)
+        padding = GRID_PADDING_RATIO * np.max(high - low) + 1.0
+        self._grid_low = low - padding
+        self._cell_size = (high - low + 2 * padding) / self._grid_size
+
+        column, row = np.meshgrid(np.arange(self._grid_size), np.arange(self._grid_size), indexing="ij")
+        cell_low = self._grid_low + np.column_stack([column.ravel(), row.ravel()]) * self._cell_size
+        corners = [cell_low + np.array(offset) * self._cell_size for offset in ((0, 0), (1, 0), (0, 1), (1, 1))]
+        center = cell_low + self._cell_size / 2
+        half_diagonal = np.linalg.norm(self._cell_size) / 2
+        edge_low = np.minimum(self._starts, self._ends)
+        edge_high = np.maximum(self._starts, self._ends)
+
+        self._distance_edges: list[np.ndarray] = []
+        self._crossing_edges: list[np.ndarray] = []
+        for start in range(0, len(center), POINT_CHUNK_SIZE // 4):
+            chunk = slice(start, start + POINT_CHUNK_SIZE // 4)
+            # セル内の点から辺までの距離は、中心までの距離 - 半対角線 以上で、(凸関数なので)4隅の距離の最大値以下
+            lower = _segment_distances(center[chunk], self._starts, self._ends) - half_diagonal
+            upper = np.max([_segment_distances(corner[chunk], self._starts, self._ends) for corner in corners], axis=0)
+            nearest_upper = upper.min(axis=1, keepdims=True)
+            self._distance_edges.extend(np.flatnonzero(candidates) for candidates in lower <= nearest_upper)
+            # 東向きの半直線が交わりうる辺: 南北の範囲がセルと重なり、東端がセルの西端より東にある
+            overlaps = (
+                (edge_low[:, 1] <= cell_low[chunk, 1:2] + self._cell_size[1])
+                & (edge_high[:, 1] >= cell_low[chunk, 1:2])
+                & (edge_high[:, 0] >= cell_low[chunk, 0:1])
+            )
+            self._crossing_edges.extend(np.flatnonzero(candidates) for candidates in overlaps)
+
+    def _evaluate(self, points: np.ndarray, distance_edges: np.ndarray, crossing_edges: np.ndarray) -> np.ndarray:
+        """指定した辺だけを使って、点の符号付きの距離を計算する."""
+        signed = np.empty(len(points))
+        for start in range(0, len(points), POINT_CHUNK_SIZE):
+            chunk = points[start : start + POINT_CHUNK_SIZE]
+            distance = _segment_distances(chunk, self._starts[distance_edges], self._ends[distance_edges]).min(axis=1)
+            crossings = _ray_crossings(chunk, self._starts[crossing_edges], self._ends[crossing_edges])
+            # ポリゴンごとに、交わる辺の数が奇数なら内側
+            inside = np.any((crossings.astype(int) @ self._polygon_membership[crossing_edges]) % 2 == 1, axis=1)
+            signed[start : start + len(chunk)] = np.where(inside, distance, -distance)
+        return signed
+
+    def signed_distance(self, latitude: ArrayLike, longitude: ArrayLike) -> np.ndarray:
+        """保安域の境界までの距離[m]. 内側を正、外側を負とする.
+
+        Args:
+            latitude (ArrayLike): 緯度[deg].
+            longitude (ArrayLike): 経度[deg].
+
+        Returns:
+            np.ndarray: 境界までの距離[m]. 緯度・経度がNaNの地点はNaN.
+        """
+        points = self._project(latitude, longitude)
+        signed = np.full(len(points), np.nan)
+        valid = np.flatnonzero(np.isfinite(points).all(axis=1))
+        cells = np.floor((points[valid] - self._grid_low) / self._cell_size).astype(int)
+        in_grid = np.all((cells >= 0) & (cells < self._grid_size), axis=1)
+
+        # 格子の外側の点はすべての辺と計算する
+        outside = valid[~in_grid]
+        if len(outside):
+            all_edges = np.arange(len(self._starts))
+            signed[outside] = self._evaluate(points[outside], all_edges, all_edges)
+
+        cell_ids = cells[in_grid, 0] * self._grid_size + cells[in_grid, 1]
+        order = np.argsort(cell_ids, kind="stable")
+        positions = valid[in_grid][order]
+        unique_cells, first = np.unique(cell_ids[order], return_index=True)
+        for cell_id, members in zip(unique_cells, np.split(positions, first[1:]), strict=True):
+            signed[members] = self._evaluate(
+                points[members], self._distance_edges[cell_id], self._crossing_edges[cell_id]
+            )
+        return signed
+
+    def contains(self, latitude: ArrayLike, longitude: ArrayLike) -> np.ndarray:
+        """保安域の内側(境界を含む)にあるか."""
+        return self.signed_distance(latitude, longitude) >= 0
+
+
+@lru_cache(maxsize=16)
+def _cached_geofence(kmz_path: str, modified_ns: int, origin_latitude: float, origin_longitude: float) -> RangeGeofence:
+    """ファイルの更新時刻ごとに、読み込んだ保安域を再利用する."""
+    return RangeGeofence.from_kmz(kmz_path, origin_latitude, origin_longitude)
+
+
+def get_range_geofence(kmz_path: Path | str, origin_latitude: float, origin_longitude: float) -> RangeGeofence:
+    """保安域を取得する. 同じファイルと射点の保安域はプロセス内で一度だけ読み込む.
+
+    Args:
+        kmz_path (Path | str): KMZまたはKMLファイルのパス.
+        origin_latitude (float): 射点の緯度[deg].
+        origin_longitude (float): 射点の経度[deg].
+
+    Returns:
+        RangeGeofence: 保安域.
+    """
+    kmz_path = Path(kmz_path)
+    return _cached_geofence(
+        str(kmz_path.resolve()), kmz_path.stat().st_mtime_ns, float(origin_latitude), float(origin_longitude)
+    )
+
+
+def landing_coordinates(simulation_df: pd.DataFrame) -> pd.DataFrame:
+    """組み合わせごとの着地点の緯度・経度.
+
+    サマリー(result_eachを指定した場合)から、サマリーがない場合は時系列データの最後の位置を使う.
+
+    Args:
+        simulation_df (pd.DataFrame): 組み合わせとシミュレーションの結果.
+
+    Returns:
+        pd.DataFrame: landed_latitude, landed_longitude. 分からない組み合わせはNaN.
+    """
+    landing_df = pd.DataFrame(np.nan, index=simulation_df.index, columns=["landed_latitude", "landed_longitude"])
+    for column in landing_df.columns:
+        if column in simulation_df.columns:
+            landing_df[column] = simulation_df[column].astype(float)
+    missing = landing_df.isna().any(axis=1)
+    if missing.any() and "trajectory" in simulation_df.columns:
+        for index in landing_df.index[missing]:
+            trajectory = simulation_df.at[index, "trajectory"]
+            if trajectory is None or not len(trajectory):
+                continue
+            landing_df.loc[index] = [
+                float(np.asarray(trajectory["Latitude"], dtype=float)[-1]),
+                float(np.asarray(trajectory["Longitude"], dtype=float)[-1]),
+            ]
+    return landing_df
+
+
+def _geofence_groups(simulation_df: pd.DataFrame) -> list[tuple[RangeGeofence, pd.Index]]:
+    """保安域と射点が同じ組み合わせごとの保安域とインデックス."""
+    if ("launch", "range_kmz") not in simulation_df.columns:
+        return []
+    geofence_keys = pd.DataFrame(
+        {
+            "range_kmz": simulation_df[("launch", "range_kmz")].map(lambda path: None if pd.isna(path) else str(path)),
+            "latitude": simulation_df[("launch", "latitude")].astype(float),
+            "longitude": simulation_df[("launch", "longitude")].astype(float),
+        }
+    ).dropna()
+    return [
+        (get_range_geofence(kmz_path, latitude, longitude), key_df.index)
+        for (kmz_path, latitude, longitude), key_df in geofence_keys.groupby(["range_kmz", "latitude", "longitude"])
+    ]
+
+
+def evaluate_landing_geofence(simulation_df: pd.DataFrame, flight_path: bool = False) -> pd.DataFrame:
+    """スイープのすべての着地点(と飛行経路)を保安域と比べる.
+
+    保安域と射点は組み合わせごとのパラメータ (launch.range_kmz, launch.latitude, launch.longitude) を使い、
+    同じ保安域の組み合わせはまとめて1回で計算する.
+
+    Args:
+        simulation_df (pd.DataFrame): 組み合わせとシミュレーションの結果.
+        flight_path (bool): 単純化した飛行経路(flight_path列)の各点と境界の距離の最小値も計算する.
+
+    Returns:
+        pd.DataFrame: inside_range (内側か), distance_to_boundary_m (境界までの距離[m]. 内側を正、外側を負とする).
+            flight_path が True の場合は flight_path_min_distance_to_boundary_m (地表に投影した経路のうち
+            最も外側の点の距離[m]) も含む. 保安域か着地点が分からない組み合わせは inside_range が NA で、距離は NaN.
+    """
+    landing_df = landing_coordinates(simulation_df)
+    distances = pd.Series(np.nan, index=simulation_df.index)
+    path_distances = pd.Series(np.nan, index=simulation_df.index)
+    for geofence, index in _geofence_groups(simulation_df):
+        rows = landing_df.loc[index]
+        distances.loc[index] = geofence.signed_distance(rows["landed_latitude"], rows["landed_longitude"])
+        if flight_path and "flight_path" in simulation_df.columns:
+            paths = [
+                (path_index, path)
+                for path_index, path in simulation_df.loc[index, "flight_path"].items()
+                if isinstance(path, np.ndarray) and len(path)
+            ]
+            if paths:
+                # すべての経路の点をまとめて計算し、経路ごとの最小値をとる
+                points = np.vstack([path for _, path in paths])
+                path_signed = geofence.signed_distance(points[:, 1], points[:, 0])
+                offsets = np.cumsum([0] + [len(path) for _, path in paths[:-1]])
+                path_distances.loc[[path_index for path_index, _ in paths]] = np.minimum.reduceat(path_signed, offsets)
+
+    result_df = pd.DataFrame(
+        {
+            INSIDE_COLUMN: (distances >= 0).astype("boolean").mask(distances.isna()),
+            DISTANCE_COLUMN: distances,
+        }
+    )
+    if flight_path:
+        result_df[FLIGHT_PATH_DISTANCE_COLUMN] = path_distances
+    return result_df
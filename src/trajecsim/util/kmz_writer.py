@@ -0,0 +1,174 @@
+"""飛行経路をKMZ(またはKML)ファイルに少しずつ書き出す.
+
+simplekml は文書全体の木をメモリ上に作ってから保存するため、組み合わせが多いと遅く、ファイルも大きくなる.
+ここでは KML の文字列を組み合わせごとに直接(KMZの場合は圧縮しながら)書き出し、メモリ上には書き出し中の
+1つの経路だけを置く. 経路は射点を原点とする局所座標[m]で Douglas–Peucker 法により単純化してから書き出す.
+"""
+
+import io
+import logging
+import zipfile
+from pathlib import Path
+from types import TracebackType
+from typing import Self, TextIO
+from xml.sax.saxutils import escape
+
+import numpy as np
+
+from trajecsim.util.geodesy import offset_to_degrees
+
+LOGGER = logging.getLogger(__name__)
+
+# 一度に書き出す座標の数
+COORDINATE_CHUNK_SIZE = 4096
+# KMZの中のKMLファイルの名前
+KMZ_DOCUMENT_NAME = "doc.kml"
+# 3次元の経路(赤)と地表に投影した経路(緑). KMLの色は aabbggrr
+FLIGHT_PATH_STYLES = {
+    "flight_path_3d": "ff0000ff",
+    "flight_path_ground": "ff00ff00",
+}
+FLIGHT_PATH_LINE_WIDTH = 3
+
+
+def simplify_flight_path(
+    longitude: np.ndarray, latitude: np.ndarray, altitude: np.ndarray, tolerance_m: float
+) -> np.ndarray:
+    """飛行経路を Douglas–Peucker 法で単純化し、残す点の番号を返す.
+
+    最初の点を原点とする局所座標(東, 北, 高度)[m]で、残した点を結ぶ線分から tolerance_m より離れた点がなくなるまで
+    点を加える.
+
+    Args:
+        longitude (np.ndarray): 経度[deg].
+        latitude (np.ndarray): 緯度[deg].
+        altitude (np.ndarray): 高度[m].
+        tolerance_m (float): 許容誤差[m]. 0以下の場合はすべての点を残す.
+
+    Returns:
+        np.ndarray: 残す点の番号 (昇順).
+    """
+    num_points = len(longitude)
+    if tolerance_m <= 0 or num_points <= 2:  # noqa: PLR2004
+        return np.arange(num_points)
+    degrees_per_meter = offset_to_degrees(latitude[0], 1.0, 1.0)
+    points = np.column_stack(
+        [
+            (np.asarray(longitude, dtype=float) - longitude[0]) / degrees_per_meter[1],
+            (np.asarray(latitude, dtype=float) - latitude[0]) / degrees_per_meter[0],
+            np.asarray(altitude, dtype=float),
+        ]
+    )
+    keep = np.zeros(num_points, dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, num_points - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:  # noqa: PLR2004
+            continue
+        relative = points[start + 1 : end] - points[start]
+        segment = points[end] - points[start]
+        length_sq = segment @ segment
+        if length_sq > 0:
+            t = np.clip(relative @ segment / length_sq, 0.0, 1.0)
+            relative = relative - t[:, np.newaxis] * segment
+        distances_sq = np.einsum("ij,ij->i", relative, relative)
+        farthest = int(np.argmax(distances_sq))
+        if distances_sq[farthest] > tolerance_m**2:
+            split = start + 1 + farthest
+            keep[split] = True
+            stack.extend([(start, split), (split, end)])
+    return np.flatnonzero(keep)
+
+
+class FlightPathKmzWriter:
+    """飛行経路を1つのKMZ(拡張子が .kml の場合はKML)ファイルに少しずつ書き出す.
+
+    with 文で使う. 書き出し中は一時ファイルに書き、閉じたときに置き換える.
+    """
+
+    def __init__(self, path: Path | str, name: str = "flight_path") -> None:
+        """初期化
+
+        Args:
+            path (Path | str): 出力ファイルのパス. 拡張子が .kmz の場合は圧縮する.
+            name (str): 文書の名前.
+        """
+        self.path = Path(path)
+        self.name = name
+        self.num_paths = 0
+        self._temp_path = self.path.with_name(f".{self.path.name}.tmp")
+        self._archive: zipfile.ZipFile | None = None
+        self._stream: TextIO | None = None
+
+    def __enter__(self) -> Self:
+        """ファイルを開き、文書の先頭とスタイルを書き出す."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if self.path.suffix.lower() == ".kmz":
+            self._archive = zipfile.ZipFile(self._temp_path, "w", compression=zipfile.ZIP_DEFLATED)
+            self._stream = io.TextIOWrapper(self._archive.open(KMZ_DOCUMENT_NAME, "w"), encoding="utf-8")
+        else:
+            self._stream = self._temp_path.open("w", encoding="utf-8")
+        self._stream.write(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<kml xmlns="http://www.opengis.net/kml/2.2">\n'
+            f"<Document><name>{escape(self.name)}</name>\n"
+        )
+        for style_id, color in FLIGHT_PATH_STYLES.items():
+            self._stream.write(
+                f'<Style id="{style_id}"><LineStyle><color>{color}</color>'
+                f"<width>{FLIGHT_PATH_LINE_WIDTH}</width></LineStyle></Style>\n"
+            )
+        return self
+
+    def add_flight_path(self, name: str, longitude: np.ndarray, latitude: np.ndarray, altitude: np.ndarray) -> None:
+        """1つの飛行経路を、3次元の経路と地表に投影した経路として書き出す.
+
+        Args:
+            name (str): 経路の名前 (組み合わせの名前).
+            longitude (np.ndarray): 経度[deg].
+            latitude (np.ndarray): 緯度[deg].
+            altitude (np.ndarray): 高度[m].
+        """
+        stream = self._stream
+        if stream is None:
+            raise RuntimeError("FlightPathKmzWriter は with 文の中で使ってください")
+        stream.write(f"<Folder><name>{escape(str(name))}</name>\n")
+        for style_id, altitude_mode, dimensions in (
+            ("flight_path_3d", "relativeToGround", 3),
+            ("flight_path_ground", "clampToGround", 2),
+        ):
+            stream.write(
+                f"<Placemark><name>flight_path</name><styleUrl>#{style_id}</styleUrl>"
+                f"<LineString><altitudeMode>{altitude_mode}</altitudeMode><coordinates>"
+            )
+            for start in range(0, len(longitude), COORDINATE_CHUNK_SIZE):
+                end = start + COORDINATE_CHUNK_SIZE
+                if dimensions == 3:  # noqa: PLR2004
+                    coordinates = zip(longitude[start:end], latitude[start:end], altitude[start:end], strict=True)
+                    stream.write(" ".join(f"{lon:.7f},{lat:.7f},{alt:.2f}" for lon, lat, alt in coordinates))
+                else:
+                    coordinates = zip(longitude[start:end], latitude[start:end], strict=True)
+                    stream.write(" ".join(f"{lon:.7f},{lat:.7f}" for lon, lat in coordinates))
+                stream.write(" ")
+            stream.write("</coordinates></LineString></Placemark>\n")
+        stream.write("</Folder>\n")
+        self.num_paths += 1
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        """文書の末尾を書き出してファイルを閉じる. 例外の場合は一時ファイルを削除する."""
+        if self._stream is not None:
+            if exc_type is None:
+                self._stream.write("</Document>\n</kml>\n")
+            self._stream.close()
+        if self._archive is not None:
+            self._archive.close()
+        if exc_type is None:
+            self._temp_path.replace(self.path)
+        else:
+            self._temp_path.unlink(missing_ok=True)
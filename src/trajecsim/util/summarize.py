@@ -2,88 +2,97 @@
 
 import math
 from pathlib import Path
+from typing import Literal
 
-import geopy.distance
 import numpy as np
 import pandas as pd
-from geopy import Point
 
+from trajecsim.jsbsim_support.schemas.chart import ChartSchema
+from trajecsim.jsbsim_support.trajectory import Trajectory, read_trajectory
+from trajecsim.util.create_chart import create_ensemble_plot, create_time_series_plots
+from trajecsim.util.geodesy import geodesic_offsets
+from trajecsim.util.geofence import FLIGHT_PATH_DISTANCE_COLUMN, GEOFENCE_COLUMNS
 from trajecsim.util.kml_generator import KMLGenerator
+from trajecsim.util.kmz_writer import FlightPathKmzWriter, simplify_flight_path
+from trajecsim.util.telemetry import get_telemetry
 
 VGUST = 9.0
-
-
-def calculate_with_geopy(lat1, lon1, lat2, lon2):
-    """
-    geopyライブラリを使用した計算
-
-    Args:
-        lat1, lon1: 地点1の緯度、経度
-        lat2, lon2: 地点2の緯度、経度
-
-    Returns:
-        dict: 計算結果
-    """
-    # 2点を定義
-    point1 = Point(lat1, lon1)
-    point2 = Point(lat2, lon2)
-
-    # 距離を計算（geodesic距離 - より正確）
-    distance = geopy.distance.geodesic(point1, point2).meters
-
-    # 緯度方向の距離（経度を固定）
-    lat_distance = geopy.distance.geodesic((lat1, lon1), (lat2, lon1)).meters
-    if lat2 < lat1:
-        lat_distance = -lat_distance
-
-    # 経度方向の距離（緯度を固定）
-    lon_distance = geopy.distance.geodesic((lat1, lon1), (lat1, lon2)).meters
-    if lon2 < lon1:
-        lon_distance = -lon_distance
-
+# result_eachのグループごとの飛行経路のファイル名と、飛行経路を単純化する許容誤差[m]の既定値
+FLIGHT_PATH_FILE_NAME = "flight_path.kmz"
+DEFAULT_FLIGHT_PATH_TOLERANCE_M = 1.0
+SUMMARY_COLUMNS = [
+    "max_altitude",
+    "max_speed",
+    "landed_latitude",
+    "landed_longitude",
+    "max_pressure",
+    "launch_clear_speed",
+    "landed_lat_m",
+    "landed_long_m",
+    "landed_range_m",
+]
+
+
+def calculate_aoa_columns(
+    angle_of_attack: np.ndarray,
+    angle_of_sideslip: np.ndarray,
+    true_velocity: np.ndarray,
+) -> dict[str, np.ndarray]:
+    """AoA(total, gust)の列を計算する."""
+    alpha = np.radians(angle_of_attack)
+    beta = np.radians(angle_of_sideslip)
+    vtrue = np.asarray(true_velocity)
+    vgust = VGUST
     return {
-        "distance_m": distance,
-        "lat_diff_m": lat_distance,
-        "lon_diff_m": lon_distance,
-        "lat_diff_degrees": lat2 - lat1,
-        "lon_diff_degrees": lon2 - lon1,
+        "Angle of Attack(total)": np.degrees(np.arccos(np.cos(alpha) * np.cos(beta))),
+        "Angle of Attack(gust)": np.degrees(
+            np.arccos(
+                np.cos(beta)
+                * (vtrue * np.cos(alpha) - vgust * np.sin(beta))
+                / np.sqrt(vtrue * vtrue + vgust * vgust * np.cos(beta) * np.cos(beta))
+            )
+        ),
     }
 
 
 def calculate_aoa(row: pd.Series) -> None:
-    """AoAを計算する."""
+    """AoAを計算する. 結果は時系列データに列として追加される."""
     output_file = row["raw_output_file"]
-    output_df = pd.read_csv(output_file)
-
-    alpha = np.radians(output_df["Angle of Attack"])
-    beta = np.radians(output_df["Angle of Sideslip"])
-    vtrue = output_df["True Velocity"]
-    vgust = VGUST
-
+    output_df = read_trajectory(row)
     calculated_df = pd.DataFrame(
-        {
-            "Angle of Attack(total)": np.degrees(np.arccos(np.cos(alpha) * np.cos(beta))),
-            "Angle of Attack(gust)": np.degrees(
-                np.arccos(
-                    np.cos(beta)
-                    * (vtrue * np.cos(alpha) - vgust * np.sin(beta))
-                    / np.sqrt(vtrue * vtrue + vgust * vgust * np.cos(beta) * np.cos(beta))
-                )
-            ),
-        }
+        calculate_aoa_columns(
+            output_df["Angle of Attack"].to_numpy(),
+            output_df["Angle of Sideslip"].to_numpy(),
+            output_df["True Velocity"].to_numpy(),
+        )
     )
 
+    trajectory = row.get("trajectory")
+    if isinstance(trajectory, Trajectory):
+        trajectory.add_columns({column: calculated_df[column].to_numpy() for column in calculated_df.columns})
+        # CSVとして保存されている場合は保存内容も更新する
+        if Path(output_file).exists():
+            trajectory.to_csv(output_file)
+        return
+
     # Concatenate the dataframes first
     combined_df = pd.concat([output_df, calculated_df], axis=1)
     # Save to the original output file
     combined_df.to_csv(output_file, index=False)
 
 
-def get_extrema_analysis(output_info_df: pd.Series) -> pd.DataFrame:
-    """シミュレーション結果の極値分析を行う."""
-    output_file = output_info_df["raw_output_file"]
-    output_df = pd.read_csv(output_file)
+def _calculate_temperature(altitude: np.ndarray) -> np.ndarray:
+    # 標準大気モデル（海面レベル15°C、高度1000mごとに6.5°C下降）
+    return 15.0 - 6.5 * (altitude / 1000.0)
+
+
+def _calculate_pressure(altitude: np.ndarray) -> np.ndarray:
+    # 標準大気圧公式（海面レベル1013.25 hPa）
+    return 1013.25 * ((288.15 - 0.0065 * altitude) / 288.15) ** 5.256
 
+
+def _extrema_table(output: Trajectory | pd.DataFrame) -> pd.DataFrame:
+    """AoA列を含む時系列データから極値点の表を作成する."""
     # 列名を短縮名にマッピング
     cols = {
         "Time": "time",
@@ -100,180 +109,268 @@ def get_extrema_analysis(output_info_df: pd.Series) -> pd.DataFrame:
         "Roll": "roll_deg",
         "Yaw": "yaw_deg",
         "Dynamic Pressure": "dynamic_pressure",
+        "parachute_deploy_gain": "parachute_deploy_gain",
     }
-
-    # データフレームの列名を変更
-    df = output_df.rename(columns=cols)
+    df = {short_name: np.asarray(output[column], dtype=float) for column, short_name in cols.items()}
 
     # 風速を計算（対気速度から対地速度を引いた差の大きさ）
-    df["wind_speed"] = abs(df["true_velocity"] - df["ground_velocity"])
+    df["wind_speed"] = np.abs(df["true_velocity"] - df["ground_velocity"])
+    df["temperature"] = _calculate_temperature(df["altitude"])
+    df["pressure"] = _calculate_pressure(df["altitude"])
+    # 動圧*atan(風速/速度)の計算
+    df["qbar_atan_aoa"] = df["dynamic_pressure"] * np.degrees(df["angle_of_attack_gust"])
 
-    # 気温の計算（標準大気モデル）
-    def calculate_temperature(altitude):
-        # 標準大気モデル（海面レベル15°C、高度1000mごとに6.5°C下降）
-        return 15.0 - 6.5 * (altitude / 1000.0)
+    # 極値点 (名前, 位置, 値の列). NaNは無視する (pandasのidxmax/idxminと同じ)
+    extrema_points = [
+        # 0. 初期ちてん
+        ("initial_point", np.nanargmin(df["time"]), "altitude"),
+        # 1. 最高速度の点
+        ("max_speed", np.nanargmax(df["true_velocity"]), "true_velocity"),
+        # 2. 最大動圧の点
+        ("max_dynamic_pressure", np.nanargmax(df["dynamic_pressure"]), "dynamic_pressure"),
+        # 3. 最大加速度の点
+        ("max_acceleration", np.nanargmax(df["acceleration"]), "acceleration"),
+        # 4. 動圧*AoAが最大の点
+        ("max_qbar_atan_aoa", np.nanargmax(df["qbar_atan_aoa"]), "qbar_atan_aoa"),
+        # 5. 最大高度の点
+        ("max_altitude", np.nanargmax(df["altitude"]), "altitude"),
+        # 6. 最終ちてん
+        ("final_point", np.nanargmax(df["time"]), "altitude"),
+        # 7. パラシュート展開の点
+        ("parachute_deploy", np.nanargmax(df["parachute_deploy_gain"]), "parachute_deploy_gain"),
+    ]
+
+    # 初期地点から各極値点までの距離をまとめて計算する
+    indices = np.array([idx for _, idx, _ in extrema_points])
+    initial_point_idx = extrema_points[0][1]
+    pos_diff = geodesic_offsets(
+        df["latitude"][initial_point_idx],
+        df["longitude"][initial_point_idx],
+        df["latitude"][indices],
+        df["longitude"][indices],
+    )
 
-    # 気圧の計算（標準大気モデル）
-    def calculate_pressure(altitude):
-        # 標準大気圧公式（海面レベル1013.25 hPa）
-        return 1013.25 * ((288.15 - 0.0065 * altitude) / 288.15) ** 5.256
+    # 各極値点での詳細データを収集
+    result_data = []
+    for i, (extrema_name, idx, metric) in enumerate(extrema_points):
+        row_data = {
+            "extrema_type": extrema_name,
+            "extrema_value": df[metric][idx],
+            "time": df["time"][idx],
+            "thrust": df["thrust"][idx],
+            "acceleration": df["acceleration"][idx],
+            "dynamic_pressure": df["dynamic_pressure"][idx],
+            "angle_of_attack_gust": df["angle_of_attack_gust"][idx],
+            "angle_of_attack_total": df["angle_of_attack_total"][idx],
+            "true_velocity": df["true_velocity"][idx],
+            "altitude": df["altitude"][idx],
+            "temperature": df["temperature"][idx],
+            "pressure": df["pressure"][idx],
+            "latitude": df["latitude"][idx],
+            "longitude": df["longitude"][idx],
+            "lat_m": pos_diff["lat_diff_m"][i],
+            "long_m": pos_diff["lon_diff_m"][i],
+            "range_m": pos_diff["distance_m"][i],
+        }
+        result_data.append(row_data)
 
-    df["temperature"] = df["altitude"].apply(calculate_temperature)
-    df["pressure"] = df["altitude"].apply(calculate_pressure)
+    return pd.DataFrame(result_data)
 
-    # 動圧*atan(風速/速度)の計算
-    df["qbar_atan_aoa"] = df["dynamic_pressure"] * np.degrees(df["angle_of_attack_gust"])
 
-    # 4つの極値点を見つける
-    extrema_points = {}
+def get_extrema_analysis(output_info_df: pd.Series) -> pd.DataFrame:
+    """シミュレーション結果の極値分析を行う."""
+    return _extrema_table(read_trajectory(output_info_df))
 
-    # 0. 初期ちてん
-    initial_point_idx = df["time"].idxmin()
-    extrema_points["initial_point"] = {
-        "index": initial_point_idx,
-        "value": df.loc[initial_point_idx, "altitude"],
-        "metric": "altitude",
-    }
 
-    initial_point_lat = df.loc[initial_point_idx, "latitude"]
-    initial_point_long = df.loc[initial_point_idx, "longitude"]
+def _summary_values(output: Trajectory | pd.DataFrame, output_info_df: pd.Series) -> dict[str, float]:
+    """時系列データからサマリーの値を計算する."""
+    altitude = np.asarray(output["Altitude"], dtype=float)
+    speed = np.asarray(output["True Velocity"], dtype=float)
+    latitude = np.asarray(output["Latitude"], dtype=float)
+    longitude = np.asarray(output["Longitude"], dtype=float)
+    # 初期地点から着地点までの距離
+    landed_diff = geodesic_offsets(latitude[0], longitude[0], latitude[-1], longitude[-1])
 
-    # 1. 最高速度の点
-    max_speed_idx = df["true_velocity"].idxmax()
-    extrema_points["max_speed"] = {
-        "index": max_speed_idx,
-        "value": df.loc[max_speed_idx, "true_velocity"],
-        "metric": "true_velocity",
-    }
+    launch_clear_height = output_info_df[("launch", "elevation")] + output_info_df[
+        ("launch", "launcher_length")
+    ] * math.sin(
+        output_info_df[("launch", "pitch")] * math.pi / 180,
+    )
 
-    # 2. 最大動圧の点
-    max_qbar_idx = df["dynamic_pressure"].idxmax()
-    extrema_points["max_dynamic_pressure"] = {
-        "index": max_qbar_idx,
-        "value": df.loc[max_qbar_idx, "dynamic_pressure"],
-        "metric": "dynamic_pressure",
+    return {
+        "max_altitude": np.nanmax(altitude),
+        "max_speed": np.nanmax(speed),
+        "landed_latitude": latitude[-1],
+        "landed_longitude": longitude[-1],
+        "max_pressure": np.nanmax(np.asarray(output["Dynamic Pressure"], dtype=float)),
+        "launch_clear_speed": speed[np.flatnonzero(altitude > launch_clear_height)[0]],
+        "landed_lat_m": float(landed_diff["lat_diff_m"]),
+        "landed_long_m": float(landed_diff["lon_diff_m"]),
+        "landed_range_m": float(landed_diff["distance_m"]),
     }
 
-    # 3. 最大加速度の点
-    max_accel_idx = df["acceleration"].idxmax()
-    extrema_points["max_acceleration"] = {
-        "index": max_accel_idx,
-        "value": df.loc[max_accel_idx, "acceleration"],
-        "metric": "acceleration",
-    }
 
-    # 4. 動圧*AoAが最大の点
-    max_qbar_atan_idx = df["qbar_atan_aoa"].idxmax()
-    extrema_points["max_qbar_atan_aoa"] = {
-        "index": max_qbar_atan_idx,
-        "value": df.loc[max_qbar_atan_idx, "qbar_atan_aoa"],
-        "metric": "qbar_atan_aoa",
-    }
+def _simplified_flight_path(output: Trajectory | pd.DataFrame, tolerance_m: float) -> np.ndarray:
+    """飛行経路を単純化した (経度, 緯度, 高度) の配列."""
+    longitude = np.asarray(output["Longitude"], dtype=float)
+    latitude = np.asarray(output["Latitude"], dtype=float)
+    altitude = np.asarray(output["Altitude"], dtype=float)
+    keep = simplify_flight_path(longitude, latitude, altitude, tolerance_m)
+    return np.column_stack([longitude[keep], latitude[keep], altitude[keep]])
 
-    # 5. 最大高度の点
-    max_altitude_idx = df["altitude"].idxmax()
-    extrema_points["max_altitude"] = {
-        "index": max_altitude_idx,
-        "value": df.loc[max_altitude_idx, "altitude"],
-        "metric": "altitude",
-    }
 
-    # 6. 最終ちてん
-    final_point_idx = df["time"].idxmax()
-    extrema_points["final_point"] = {
-        "index": final_point_idx,
-        "value": df.loc[final_point_idx, "altitude"],
-        "metric": "altitude",
-    }
+def _save_flight_path_kml(flight_path: np.ndarray, name: str, kml_paths: list[Path]) -> None:
+    """1つの飛行経路のKMLファイルを生成する."""
+    for kml_path in kml_paths:
+        with FlightPathKmzWriter(kml_path, name) as writer:
+            writer.add_flight_path(name, flight_path[:, 0], flight_path[:, 1], flight_path[:, 2])
 
-    # 7. パラシュート展開の点
-    parachute_deploy_idx = df["parachute_deploy_gain"].idxmax()
-    extrema_points["parachute_deploy"] = {
-        "index": parachute_deploy_idx,
-        "value": df.loc[parachute_deploy_idx, "parachute_deploy_gain"],
-        "metric": "parachute_deploy_gain",
-    }
 
-    # 各極値点での詳細データを収集
-    result_data = []
+def summarize_output_info_df(output_info_df: pd.Series, output_dir: Path) -> pd.Series:
+    """シミュレーションの結果をまとめる."""
+    output_df = read_trajectory(output_info_df)
+    _save_flight_path_kml(
+        _simplified_flight_path(output_df, DEFAULT_FLIGHT_PATH_TOLERANCE_M),
+        str(output_info_df.name),
+        [output_dir / "flight_path" / f"{output_info_df.name}.kml"],
+    )
+    return pd.Series(_summary_values(output_df, output_info_df))
 
-    for extrema_name, extrema_info in extrema_points.items():
-        idx = extrema_info["index"]
-        pos_diff = calculate_with_geopy(
-            initial_point_lat, initial_point_long, df.loc[idx, "latitude"], df.loc[idx, "longitude"]
-        )
 
-        range_m = pos_diff["distance_m"]
-        lat_m = pos_diff["lat_diff_m"]
-        long_m = pos_diff["lon_diff_m"]
+def analyze_trajectory(
+    output_info_df: pd.Series,
+    output_dirs: list[Path],
+    *,
+    chart: ChartSchema | None = None,
+    flight_path: Literal["kmz", "kml", "none"] = "kmz",
+    flight_path_tolerance_m: float = DEFAULT_FLIGHT_PATH_TOLERANCE_M,
+    save_csv: bool = False,
+) -> pd.Series:
+    """1回のシミュレーション結果を1度の走査で集計する.
 
-        row_data = {
-            "extrema_type": extrema_name,
-            "extrema_value": extrema_info["value"],
-            "time": df.loc[idx, "time"],
-            "thrust": df.loc[idx, "thrust"],
-            "acceleration": df.loc[idx, "acceleration"],
-            "dynamic_pressure": df.loc[idx, "dynamic_pressure"],
-            "angle_of_attack_gust": df.loc[idx, "angle_of_attack_gust"],
-            "angle_of_attack_total": df.loc[idx, "angle_of_attack_total"],
-            "true_velocity": df.loc[idx, "true_velocity"],
-            "altitude": df.loc[idx, "altitude"],
-            "temperature": df.loc[idx, "temperature"],
-            "pressure": df.loc[idx, "pressure"],
-            "latitude": df.loc[idx, "latitude"],
-            "longitude": df.loc[idx, "longitude"],
-            "lat_m": lat_m,
-            "long_m": long_m,
-            "range_m": range_m,
-        }
-        result_data.append(row_data)
+    AoA列の追加、サマリー、極値分析、飛行経路、(任意で)グラフの出力をまとめて行う.
+    シミュレーションを実行したワーカー内で、時系列データがメモリ上にあるうちに呼び出すことを想定している.
 
-    return pd.DataFrame(result_data)
+    Args:
+        output_info_df (pd.Series): シミュレーションのパラメータと結果を含む行.
+        output_dirs (list[Path]): 集計結果の出力先. flight_path が kml の場合は、
+            それぞれの flight_path 以下にKMLを保存する.
+        chart (ChartSchema | None): 時系列のグラフの設定. Noneの場合はグラフを出力しない.
+        flight_path (Literal["kmz", "kml", "none"]): 飛行経路の出力方法. kmz の場合は単純化した経路を返し、
+            save_group_results がグループごとのKMZにまとめる. kml の場合は組み合わせごとのKMLを保存する.
+        flight_path_tolerance_m (float): 飛行経路を単純化する許容誤差[m].
+        save_csv (bool): AoA列を追加した時系列を raw_output_file に保存する.
 
+    Returns:
+        pd.Series: サマリーの値と極値分析の表(extrema). flight_path が kmz の場合は単純化した経路(flight_path)、
+            グループのグラフ(chart.ensemble)を出力する場合は間引いた時系列(chart_series)も含む.
+    """
+    telemetry = get_telemetry()
+    trajectory = output_info_df.get("trajectory")
+    if not isinstance(trajectory, Trajectory):
+        trajectory = Trajectory.from_dataframe(read_trajectory(output_info_df))
+        output_info_df = output_info_df.copy()
+        output_info_df["trajectory"] = trajectory
+
+    with telemetry.stage("analysis"):
+        trajectory.add_columns(
+            calculate_aoa_columns(
+                trajectory["Angle of Attack"], trajectory["Angle of Sideslip"], trajectory["True Velocity"]
+            )
+        )
+    if save_csv:
+        with telemetry.stage("csv_export"):
+            trajectory.to_csv(output_info_df["raw_output_file"])
+
+    with telemetry.stage("analysis"):
+        analysis = {**_summary_values(trajectory, output_info_df), "extrema": _extrema_table(trajectory)}
+    if chart is not None:
+        with telemetry.stage("chart"):
+            chart_series = create_time_series_plots(output_info_df, chart, trajectory)
+        if chart_series:
+            analysis["chart_series"] = chart_series
+    if flight_path != "none":
+        with telemetry.stage("kml"):
+            path_points = _simplified_flight_path(trajectory, flight_path_tolerance_m)
+            if flight_path == "kml":
+                _save_flight_path_kml(
+                    path_points,
+                    str(output_info_df.name),
+                    [output_dir / "flight_path" / f"{output_info_df.name}.kml" for output_dir in output_dirs],
+                )
+            else:
+                analysis["flight_path"] = path_points
+    return pd.Series(analysis)
 
-def summarize_output_info_df(output_info_df: pd.Series, output_dir: Path) -> pd.Series:
-    """シミュレーションの結果をまとめる."""
-    output_file = output_info_df["raw_output_file"]
-    output_df = pd.read_csv(output_file)
 
-    altitude_col = "Altitude"
-    speed_col = "True Velocity"
-    pressure_col = "Dynamic Pressure"
-    lat_col = "Latitude"
-    long_col = "Longitude"
+def save_group_results(
+    group_df: pd.DataFrame, result_output_dir: Path, kml_group_by: list[str], chart: ChartSchema | None = None
+) -> Path:
+    """result_eachの1グループの集計結果を保存する.
 
-    launch_clear_height = output_info_df[("launch", "elevation")] + output_info_df[
-        ("launch", "launcher_length")
-    ] * math.sin(
-        output_info_df[("launch", "pitch")] * math.pi / 180,
-    )
+    summary.csv, simulation_params.csv, extrema.csv と、kml_group_byごとの着地点ポリゴンのKML、
+    飛行経路のKMZ(組み合わせごとの集計で経路を返した場合)、すべての組み合わせの時系列を重ねたグラフ
+    (組み合わせごとの集計で間引いた時系列を返した場合)を書き出す.
+    グループ同士は独立しているため、別々のプロセスで並列に実行できる.
 
-    launch_clear_speed = output_df[output_df[altitude_col] > launch_clear_height].iloc[0][speed_col]
-    max_altitude = output_df[altitude_col].max()
-    max_speed = output_df[speed_col].max()
-    max_pressure = output_df[pressure_col].max()
-    landed_lat = output_df[lat_col].iloc[-1]
-    landed_long = output_df[long_col].iloc[-1]
-
-    # KMLファイルの生成
-    kml_dir = output_dir / "flight_path"
-    kml_dir.mkdir(parents=True, exist_ok=True)
-
-    kml_generator = KMLGenerator()
-
-    coordinates_3d = list(zip(output_df[long_col], output_df[lat_col], output_df[altitude_col], strict=False))
-    coordinates_2d = list(zip(output_df[long_col], output_df[lat_col], strict=False))
-
-    kml_generator.add_line(coordinates_3d, "flight_path", (255, 0, 0))
-    kml_generator.add_line(coordinates_2d, "flight_path", (0, 255, 0))
-    kml_generator.save(kml_dir / f"{output_info_df.name}.kml")
-
-    summary_row = {
-        "max_altitude": max_altitude,
-        "max_speed": max_speed,
-        "landed_latitude": landed_lat,
-        "landed_longitude": landed_long,
-        "max_pressure": max_pressure,
-        "launch_clear_speed": launch_clear_speed,
-    }
-    return pd.Series(summary_row)
+    Args:
+        group_df (pd.DataFrame): グループに属する組み合わせのパラメータと集計結果.
+        result_output_dir (Path): 出力ディレクトリ.
+        kml_group_by (list[str]): 着地点ポリゴンをまとめるパラメータ.
+        chart (ChartSchema | None): 時系列のグラフの設定. Noneの場合はグラフを出力しない.
+
+    Returns:
+        Path: 出力ディレクトリ.
+    """
+    telemetry = get_telemetry()
+    result_output_dir.mkdir(parents=True, exist_ok=True)
+    with telemetry.stage("csv_export"):
+        geofence_columns = [column for column in [*GEOFENCE_COLUMNS, FLIGHT_PATH_DISTANCE_COLUMN] if column in group_df]
+        group_df[SUMMARY_COLUMNS + geofence_columns].to_csv(result_output_dir / "summary.csv", index=False)
+        group_df.select_dtypes(include=["number"]).to_csv(result_output_dir / "simulation_params.csv", index=False)
+
+        extrema_df = pd.concat(
+            [df for df in group_df["extrema"] if isinstance(df, pd.DataFrame) and not df.empty], ignore_index=True
+        )
+        # Export complete extrema_df with all columns
+        extrema_df.to_csv(
+            result_output_dir / "extrema.csv",
+            index=False,
+            float_format="%.6f",  # Use 6 decimal places for float values
+            encoding="utf-8",  # Ensure proper encoding
+        )
+
+    with telemetry.stage("kml"):
+        _save_landing_kml(group_df, result_output_dir, kml_group_by)
+        _save_flight_paths_kmz(group_df, result_output_dir / FLIGHT_PATH_FILE_NAME)
+    if chart is not None and chart.ensemble and "chart_series" in group_df.columns:
+        with telemetry.stage("chart"):
+            create_ensemble_plot(group_df["chart_series"], result_output_dir, chart)
+    return result_output_dir
+
+
+def _save_flight_paths_kmz(group_df: pd.DataFrame, kmz_path: Path) -> None:
+    """グループのすべての組み合わせの飛行経路を1つのKMZに書き出す. 経路を返していない組み合わせは含めない."""
+    if "flight_path" not in group_df.columns:
+        return
+    flight_paths = [(index, path) for index, path in group_df["flight_path"].items() if isinstance(path, np.ndarray)]
+    if not flight_paths:
+        return
+    with FlightPathKmzWriter(kmz_path, kmz_path.parent.name) as writer:
+        for index, path in flight_paths:
+            writer.add_flight_path(str(index), path[:, 0], path[:, 1], path[:, 2])
+
+
+def _save_landing_kml(group_df: pd.DataFrame, result_output_dir: Path, kml_group_by: list[str]) -> None:
+    """kml_group_byごとの着地点ポリゴンのKMLを保存する."""
+    for kml_group_key in kml_group_by:
+        kml_generator = KMLGenerator()
+        group_keys = [col for col in group_df.columns if kml_group_key in col]
+        grouped_by_group_key = group_df.groupby(group_keys)
+        kml_generator.generate_grouped_points_polygons(grouped_by_group_key)
+        representation_df = grouped_by_group_key.first()
+        kmz_path = representation_df[("launch", "range_kmz")].iloc[0]
+        if not kmz_path.exists():
+            continue
+
+        kml_generator.save(result_output_dir / f"result_{kml_group_key}.kml")
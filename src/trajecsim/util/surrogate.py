@@ -0,0 +1,452 @@
+"""粗い格子のシミュレーション結果を補間するサロゲートモデル.
+
+着地点の地図は、風速 x 風向の格子の点ごとに1回のシミュレーションが必要になる. 粗い格子の結果から、着地点(北・東の距離)と
+サマリーの値をスイープしたパラメータの関数として放射基底関数(RBF)で補間し、細かい格子をミリ秒単位で評価する.
+
+誤差は leave-one-out (各標本点を除いて補間したときの、その点での誤差) で推定する. 補間の連立方程式の逆行列から、
+標本点ごとに解き直さずに計算できる (Rippa, 1999). 推定誤差が許容値を超える点では、実際にシミュレーションして
+標本点に加え、補間し直す.
+
+    <出力ディレクトリ>/surrogate/grid.csv     細かい格子の補間値と着地点の推定誤差
+    <出力ディレクトリ>/surrogate/samples.csv  標本点の値とleave-one-outの誤差
+    <出力ディレクトリ>/surrogate/report.json  誤差の統計と改良の経過
+"""
+
+import json
+import logging
+import time
+from collections.abc import Callable, Hashable
+from itertools import product
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import pandas as pd
+
+from trajecsim.jsbsim_support.generate_param_xml import PARAMETER_SECTIONS, derive_combinations
+from trajecsim.jsbsim_support.schemas.surrogate import SurrogateSchema
+from trajecsim.util.geodesy import geodesic_offsets, offset_to_degrees
+
+LOGGER = logging.getLogger(__name__)
+
+SURROGATE_DIR_NAME = "surrogate"
+# 着地点の北・東の距離[m] (summarize.summarize_output と同じ列名)
+LANDING_TARGETS = ["landed_lat_m", "landed_long_m"]
+LANDING_ERROR_COLUMN = "landing_error_m"
+LOO_ERROR_SUFFIX = "_loo_error"
+REFINEMENT_ROUND_COLUMN = "refinement_round"
+# 一度に評価する点の数. カーネル行列(点の数 x 標本点の数)のメモリを抑える
+EVALUATION_CHUNK_SIZE = 8192
+# leave-one-out の誤差を計算できない(逆行列の対角成分が0に近い)とみなす値
+MIN_INVERSE_DIAGONAL = 1e-12
+
+Parameter = tuple[str, str]
+
+
+def parameter_name(parameter: Parameter) -> str:
+    """パラメータの列名を "launch.ground_wind_speed" の形式にする."""
+    return ".".join(parameter)
+
+
+def _pairwise_distances(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """点の集合同士のユークリッド距離 (len(a) x len(b))."""
+    squared = np.sum(a**2, axis=1)[:, np.newaxis] + np.sum(b**2, axis=1)[np.newaxis, :] - 2 * a @ b.T
+    return np.sqrt(np.maximum(squared, 0.0))
+
+
+def _kernel(distance: np.ndarray, kernel: str) -> np.ndarray:
+    """放射基底関数."""
+    if kernel == "thin_plate":
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(distance > 0, distance**2 * np.log(distance), 0.0)
+    if kernel == "cubic":
+        return distance**3
+    return distance
+
+
+class RadialBasisSurrogate:
+    """放射基底関数と1次の多項式による補間. 標本点では標本の値に一致する.
+
+    パラメータは標本点の範囲で0から1に正規化し、周期的なパラメータは円周上の点(cos, sin)として扱う.
+    """
+
+    def __init__(
+        self,
+        points: pd.DataFrame,
+        values: pd.DataFrame,
+        kernel: str = "thin_plate",
+        periodic: dict[Parameter, float] | None = None,
+    ) -> None:
+        """初期化
+
+        Args:
+            points (pd.DataFrame): 標本点のパラメータ (列はスイープしたパラメータ).
+            values (pd.DataFrame): 標本点の値 (列は補間する値). pointsと同じ順.
+            kernel (str): 放射基底関数 (thin_plate, cubic, linear).
+            periodic (dict[Parameter, float] | None): 周期的なパラメータとその周期.
+        """
+        self.parameters: list[Parameter] = list(points.columns)
+        self.targets: list[str] = list(values.columns)
+        self.kernel = kernel
+        self.periodic = periodic or {}
+        raw_points = points.to_numpy(dtype=float)
+        self._low = raw_points.min(axis=0)
+        span = raw_points.max(axis=0) - self._low
+        self._span = np.where(span > 0, span, 1.0)
+        self._points = self._features(raw_points)
+
+        num_points = len(self._points)
+        polynomial = np.hstack([np.ones((num_points, 1)), self._points])
+        num_terms = polynomial.shape[1]
+        matrix = np.zeros((num_points + num_terms, num_points + num_terms))
+        matrix[:num_points, :num_points] = _kernel(_pairwise_distances(self._points, self._points), kernel)
+        matrix[:num_points, num_points:] = polynomial
+        matrix[num_points:, :num_points] = polynomial.T
+        rhs = np.vstack([values.to_numpy(dtype=float), np.zeros((num_terms, len(self.targets)))])
+        # 標本点が少なく多項式が決まらない場合や、同じ点が重複している場合でも解けるように擬似逆行列を使う
+        inverse = np.linalg.pinv(matrix)
+        coefficients = inverse @ rhs
+        self._weights = coefficients[:num_points]
+        self._polynomial_weights = coefficients[num_points:]
+
+        # leave-one-out の誤差 (Rippa): e_i = c_i / (A^-1)_ii
+        diagonal = np.diag(inverse)[:num_points, np.newaxis]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            loo_errors = np.where(np.abs(diagonal) > MIN_INVERSE_DIAGONAL, self._weights / diagonal, np.nan)
+        self.loo_errors = pd.DataFrame(loo_errors, index=points.index, columns=self.targets)
+        # 標本点同士の間隔 (最も近い標本点までの距離の中央値). 誤差の推定に使う
+        distances = _pairwise_distances(self._points, self._points)
+        np.fill_diagonal(distances, np.inf)
+        nearest = distances.min(axis=1) if num_points > 1 else np.ones(1)
+        self.spacing = float(np.median(nearest[np.isfinite(nearest) & (nearest > 0)])) if np.any(nearest > 0) else 1.0
+
+    def _features(self, raw_points: np.ndarray) -> np.ndarray:
+        """パラメータの値を補間に使う座標にする."""
+        features = []
+        for i, parameter in enumerate(self.parameters):
+            if parameter in self.periodic:
+                # 直径が1の円周上の点にする (正規化した他のパラメータと同じ程度の大きさ)
+                angle = 2 * np.pi * raw_points[:, i] / self.periodic[parameter]
+                features.extend([0.5 * np.cos(angle), 0.5 * np.sin(angle)])
+            else:
+                features.append((raw_points[:, i] - self._low[i]) / self._span[i])
+        return np.column_stack(features)
+
+    def features(self, points: pd.DataFrame) -> np.ndarray:
+        """点のパラメータを補間に使う座標にする. 列は標本点と同じ."""
+        return self._features(points[self.parameters].to_numpy(dtype=float))
+
+    def __call__(self, points: pd.DataFrame) -> pd.DataFrame:
+        """補間する.
+
+        Args:
+            points (pd.DataFrame): 評価する点のパラメータ. 列は標本点と同じ.
+
+        Returns:
+            pd.DataFrame: 補間した値.
+        """
+        features = self.features(points)
+        values = np.empty((len(features), len(self.targets)))
+        for start in range(0, len(features), EVALUATION_CHUNK_SIZE):
+            chunk = features[start : start + EVALUATION_CHUNK_SIZE]
+            kernel_matrix = _kernel(_pairwise_distances(chunk, self._points), self.kernel)
+            polynomial = np.hstack([np.ones((len(chunk), 1)), chunk])
+            values[start : start + len(chunk)] = kernel_matrix @ self._weights + polynomial @ self._polynomial_weights
+        return pd.DataFrame(values, index=points.index, columns=self.targets)
+
+    def estimate_error(self, points: pd.DataFrame, sample_errors: np.ndarray) -> np.ndarray:
+        """標本点の leave-one-out の誤差から、任意の点の誤差を推定する.
+
+        近い標本点の誤差を距離の2乗の逆数で重み付けして平均し、最も近い標本点までの距離と標本点の間隔の比
+        (最大1) を掛ける. 標本点では0になり、標本点の間隔以上離れた点では周りの標本点の誤差になる.
+
+        Args:
+            points (pd.DataFrame): 評価する点のパラメータ.
+            sample_errors (np.ndarray): 標本点ごとの誤差. 標本点と同じ順.
+
+        Returns:
+            np.ndarray: 推定誤差.
+        """
+        features = self.features(points)
+        valid = np.isfinite(sample_errors)
+        errors = np.zeros(len(features))
+        if not valid.any():
+            return np.full(len(features), np.nan)
+        for start in range(0, len(features), EVALUATION_CHUNK_SIZE):
+            chunk = features[start : start + EVALUATION_CHUNK_SIZE]
+            distances = _pairwise_distances(chunk, self._points[valid])
+            with np.errstate(divide="ignore"):
+                weights = 1 / np.maximum(distances, 1e-12) ** 2
+            weighted = weights @ sample_errors[valid] / weights.sum(axis=1)
+            errors[start : start + len(chunk)] = weighted * np.minimum(distances.min(axis=1) / self.spacing, 1.0)
+        return errors
+
+    def distance_to_samples(self, points: pd.DataFrame) -> np.ndarray:
+        """最も近い標本点までの距離 (補間に使う座標での距離)."""
+        features = self.features(points)
+        return np.concatenate(
+            [
+                _pairwise_distances(features[start : start + EVALUATION_CHUNK_SIZE], self._points).min(axis=1)
+                for start in range(0, len(features), EVALUATION_CHUNK_SIZE)
+            ]
+        )
+
+
+def swept_parameters(simulation_df: pd.DataFrame) -> tuple[list[Parameter], list[Parameter]]:
+    """スイープしたパラメータ (組み合わせによって値が異なるパラメータ) を取得する.
+
+    Args:
+        simulation_df (pd.DataFrame): 組み合わせ.
+
+    Returns:
+        tuple[list[Parameter], list[Parameter]]: スイープした数値のパラメータと、数値でないパラメータ(テーブルなど).
+    """
+    parameters: list[Parameter] = []
+    not_numeric: list[Parameter] = []
+    for column in simulation_df.columns:
+        if not isinstance(column, tuple) or column[0] not in PARAMETER_SECTIONS:
+            continue
+        values = simulation_df[column]
+        if values.astype(str).nunique() <= 1:
+            continue
+        if pd.api.types.is_numeric_dtype(values):
+            parameters.append(column)
+        else:
+            not_numeric.append(column)
+    return parameters, not_numeric
+
+
+def collect_targets(simulation_df: pd.DataFrame, targets: list[str]) -> pd.DataFrame:
+    """標本点の値 (着地点の北・東の距離と targets) を集める.
+
+    着地点はサマリー(result_eachを指定した場合)から、サマリーがない場合は時系列データの最初と最後の位置から計算する.
+
+    Args:
+        simulation_df (pd.DataFrame): 組み合わせとシミュレーションの結果.
+        targets (list[str]): 着地点のほかに補間するサマリーの値. simulation_df の列にあるもの.
+
+    Returns:
+        pd.DataFrame: 標本点の値. 着地点が分からない組み合わせは含まない.
+    """
+    values = pd.DataFrame(index=simulation_df.index)
+    for target in LANDING_TARGETS:
+        values[target] = simulation_df[target].astype(float) if target in simulation_df.columns else np.nan
+    missing = values[LANDING_TARGETS].isna().any(axis=1)
+    if missing.any() and "trajectory" in simulation_df.columns:
+        for index in values.index[missing]:
+            trajectory = simulation_df.at[index, "trajectory"]
+            if trajectory is None or not len(trajectory):
+                continue
+            latitude = np.asarray(trajectory["Latitude"], dtype=float)
+            longitude = np.asarray(trajectory["Longitude"], dtype=float)
+            offsets = geodesic_offsets(latitude[0], longitude[0], latitude[-1], longitude[-1])
+            values.loc[index, LANDING_TARGETS] = [float(offsets["lat_diff_m"]), float(offsets["lon_diff_m"])]
+
+    for target in targets:
+        values[target] = simulation_df[target].astype(float)
+
+    missing = values[LANDING_TARGETS].isna().any(axis=1)
+    if missing.any():
+        LOGGER.warning(f"着地点が分からない組み合わせは標本点に使いません: {int(missing.sum())}件")
+    return values[~missing]
+
+
+def build_grid(points: pd.DataFrame, settings: SurrogateSchema) -> pd.DataFrame:
+    """標本点の範囲を覆う細かい格子を作る.
+
+    Args:
+        points (pd.DataFrame): 標本点のパラメータ.
+        settings (SurrogateSchema): サロゲートモデルの設定.
+
+    Returns:
+        pd.DataFrame: 格子の点のパラメータ.
+    """
+    axes = []
+    for parameter in points.columns:
+        num_points = settings.grid.get(parameter_name(parameter), settings.resolution)
+        axes.append(np.linspace(points[parameter].min(), points[parameter].max(), max(num_points, 1)))
+    return pd.DataFrame(list(product(*axes)), columns=points.columns)
+
+
+def propose_refinement(
+    model: RadialBasisSurrogate, grid: pd.DataFrame, estimated_error: np.ndarray, settings: SurrogateSchema
+) -> pd.DataFrame:
+    """推定誤差が許容値を超える格子の点から、追加でシミュレーションする点を選ぶ.
+
+    推定誤差の大きい順に、すでに選んだ点や標本点から標本点の間隔の半分以上離れた点を refine_batch 個まで選ぶ.
+
+    Args:
+        model (RadialBasisSurrogate): サロゲートモデル.
+        grid (pd.DataFrame): 格子の点のパラメータ.
+        estimated_error (np.ndarray): 格子の点の着地点の推定誤差[m].
+        settings (SurrogateSchema): サロゲートモデルの設定.
+
+    Returns:
+        pd.DataFrame: 追加する点のパラメータ.
+    """
+    candidates = np.flatnonzero(estimated_error > settings.refine_tolerance_m)
+    candidates = candidates[np.argsort(-estimated_error[candidates], kind="stable")]
+    min_distance = model.spacing / 2
+    distances = model.distance_to_samples(grid.iloc[candidates])
+    grid_features = model.features(grid)
+    selected: list[int] = []
+    for candidate, distance in zip(candidates, distances, strict=True):
+        if len(selected) >= settings.refine_batch:
+            break
+        if distance < min_distance:
+            continue
+        features = grid_features[[candidate]]
+        if selected and _pairwise_distances(features, grid_features[selected]).min() < min_distance:
+            continue
+        selected.append(candidate)
+    return grid.iloc[selected].reset_index(drop=True)
+
+
+def _refinement_combinations(
+    simulation_df: pd.DataFrame, points: pd.DataFrame, model: RadialBasisSurrogate, refinement_round: int
+) -> pd.DataFrame:
+    """追加する点の組み合わせを作る. スイープしていないパラメータは最も近い標本点の値を使う."""
+    sample_points = simulation_df[model.parameters]
+    nearest = np.argmin(_pairwise_distances(model.features(points), model.features(sample_points)), axis=1)
+    return derive_combinations(simulation_df, simulation_df.index[nearest], points, f"surrogate={refinement_round}")
+
+
+def run_surrogate(
+    simulation_df: pd.DataFrame,
+    settings: SurrogateSchema,
+    output_dir: Path,
+    simulate: Callable[[pd.DataFrame], pd.DataFrame] | None = None,
+) -> pd.DataFrame:
+    """サロゲートモデルを作り、細かい格子で評価して保存する.
+
+    Args:
+        simulation_df (pd.DataFrame): 組み合わせとシミュレーションの結果 (標本点).
+        settings (SurrogateSchema): サロゲートモデルの設定.
+        output_dir (Path): 出力ディレクトリ. surrogate ディレクトリに保存する.
+        simulate (Callable[[pd.DataFrame], pd.DataFrame] | None): 追加の組み合わせをシミュレーションし、
+            組み合わせと結果を返す関数. Noneの場合は推定誤差が大きくてもシミュレーションしない.
+
+    Returns:
+        pd.DataFrame: 格子の点のパラメータと補間値、着地点の緯度・経度と推定誤差.
+    """
+    parameters, not_numeric = swept_parameters(simulation_df)
+    if not_numeric:
+        raise ValueError(
+            f"数値でないパラメータをスイープしているため補間できません: {[parameter_name(p) for p in not_numeric]}"
+        )
+    if not parameters:
+        raise ValueError("スイープしたパラメータがないため補間できません")
+    periodic = {
+        parameter: settings.periodic[parameter_name(parameter)]
+        for parameter in parameters
+        if parameter_name(parameter) in settings.periodic
+    }
+    targets = [target for target in settings.targets if target in simulation_df.columns]
+    skipped_targets = sorted(set(settings.targets) - set(targets))
+    if skipped_targets:
+        LOGGER.info(f"サマリーにない値は補間しません (result_eachを指定すると計算されます): {skipped_targets}")
+    samples_df = simulation_df
+    refinement_rounds: dict[Hashable, int] = {}
+    refinement_log: list[dict[str, Any]] = []
+    refinement_round = 0
+    while True:
+        values = collect_targets(samples_df, targets)
+        points = samples_df.loc[values.index, parameters]
+        start = time.perf_counter()
+        model = RadialBasisSurrogate(points, values, settings.kernel, periodic)
+        fit_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        grid = build_grid(points, settings)
+        grid_values = model(grid)
+        landing_loo_error = np.hypot(*(model.loo_errors[target].to_numpy() for target in LANDING_TARGETS))
+        estimated_error = model.estimate_error(grid, landing_loo_error)
+        evaluate_seconds = time.perf_counter() - start
+        LOGGER.info(
+            f"サロゲートモデルを作りました: 標本点 {len(points)}件, 格子 {len(grid)}点 "
+            f"(補間 {fit_seconds * 1000:.1f}ms, 評価 {evaluate_seconds * 1000:.1f}ms), "
+            f"着地点のleave-one-out誤差 最大 {np.nanmax(landing_loo_error):.2f}m"
+        )
+        if (
+            simulate is None
+            or settings.refine_tolerance_m <= 0
+            or refinement_round >= settings.refine_rounds
+            or not np.nanmax(estimated_error) > settings.refine_tolerance_m
+        ):
+            break
+
+        refinement_round += 1
+        new_points = propose_refinement(model, grid, estimated_error, settings)
+        if new_points.empty:
+            break
+        LOGGER.info(
+            f"着地点の推定誤差が {settings.refine_tolerance_m}m を超える点を追加でシミュレーションします: "
+            f"{len(new_points)}件 ({refinement_round}回目)"
+        )
+        new_df = simulate(_refinement_combinations(samples_df, new_points, model, refinement_round))
+        refinement_rounds.update(dict.fromkeys(new_df.index, refinement_round))
+        # 追加した点での補間値とシミュレーションの結果の差 (補間の実際の誤差)
+        new_values = collect_targets(new_df, [])
+        predicted = model(new_df.loc[new_values.index, parameters])
+        actual_error = np.hypot(
+            *(new_values[target].to_numpy() - predicted[target].to_numpy() for target in LANDING_TARGETS)
+        )
+        LOGGER.info(f"追加した点での着地点の補間誤差: 最大 {np.max(actual_error, initial=0.0):.2f}m")
+        refinement_log.append(
+            {
+                "round": refinement_round,
+                "num_added": len(new_df),
+                "max_estimated_error_m": float(np.nanmax(estimated_error)),
+                "max_actual_error_m": float(np.max(actual_error, initial=0.0)),
+            }
+        )
+        samples_df = pd.concat([samples_df, new_df])
+
+    grid_df = _with_landing_coordinates(pd.concat([grid, grid_values], axis=1), samples_df)
+    grid_df[LANDING_ERROR_COLUMN] = estimated_error
+    samples_out = pd.concat([points, values, model.loo_errors.add_suffix(LOO_ERROR_SUFFIX)], axis=1)
+    samples_out[f"landing{LOO_ERROR_SUFFIX}_m"] = landing_loo_error
+    samples_out[REFINEMENT_ROUND_COLUMN] = [refinement_rounds.get(index, 0) for index in samples_out.index]
+
+    surrogate_dir = output_dir / SURROGATE_DIR_NAME
+    surrogate_dir.mkdir(parents=True, exist_ok=True)
+    grid_df.rename(columns=_column_name).to_csv(surrogate_dir / "grid.csv", index=False)
+    samples_out.rename(columns=_column_name).to_csv(surrogate_dir / "samples.csv", index_label="index")
+    report = {
+        "parameters": [parameter_name(parameter) for parameter in parameters],
+        "kernel": settings.kernel,
+        "num_samples": len(points),
+        "num_grid_points": len(grid),
+        "fit_seconds": fit_seconds,
+        "evaluate_seconds": evaluate_seconds,
+        "leave_one_out": {
+            target: {
+                "max": float(np.nanmax(np.abs(model.loo_errors[target]))),
+                "rmse": float(np.sqrt(np.nanmean(model.loo_errors[target] ** 2))),
+            }
+            for target in model.targets
+        },
+        "landing_leave_one_out_max_m": float(np.nanmax(landing_loo_error)),
+        "landing_estimated_error_max_m": float(np.nanmax(estimated_error)),
+        "refinement": refinement_log,
+    }
+    (surrogate_dir / "report.json").write_text(json.dumps(report, indent=2, ensure_ascii=False))
+    LOGGER.info(f"サロゲートモデルの結果を保存しました: {surrogate_dir}")
+    return grid_df
+
+
+def _column_name(column: Any) -> str:  # noqa: ANN401
+    """CSVの列名. パラメータは "launch.ground_wind_speed" の形式にする."""
+    return parameter_name(column) if isinstance(column, tuple) else str(column)
+
+
+def _with_landing_coordinates(grid_df: pd.DataFrame, samples_df: pd.DataFrame) -> pd.DataFrame:
+    """着地点の北・東の距離から、着地点の緯度・経度を加える. 射点は格子の点のパラメータか、標本点の値を使う."""
+    launch_position = []
+    for key in ("latitude", "longitude"):
+        column = ("launch", key)
+        launch_position.append(grid_df[column] if column in grid_df.columns else samples_df[column].iloc[0])
+    lat_diff, lon_diff = offset_to_degrees(launch_position[0], grid_df["landed_lat_m"], grid_df["landed_long_m"])
+    grid_df["landed_latitude"] = launch_position[0] + lat_diff
+    grid_df["landed_longitude"] = launch_position[1] + lon_diff
+    return grid_df
@@ -0,0 +1,261 @@
+"""処理時間とリソースの計測.
+
+段階(設定の読み込み、XMLのレンダリング、シミュレーション、集計など)ごとの経過時間、CPU時間、メモリと、
+シミュレーション1回ごとの指標(積分のステップ数、シミュレーション時間、出力の行数など)を記録し、
+出力ディレクトリにJSONのレポートとして保存する.
+
+ワーカープロセスでの計測は run_with_stages で包んで親プロセスに返し、Telemetry.merge_worker_stages で合算する.
+profile_dir を指定すると、ワーカーごとに cProfile の結果を保存し、merge_profiles で1つにまとめられる.
+"""
+
+import contextlib
+import cProfile
+import json
+import os
+import pstats
+import sys
+import time
+from collections.abc import Callable, Generator, Iterable, Iterator
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import Any, TypeVar
+
+# resource は POSIX にしかない. Windows では psutil があればそれを使い、どちらもなければメモリは計測しない
+try:
+    import resource
+
+    RESOURCE_AVAILABLE = True
+except ImportError:
+    RESOURCE_AVAILABLE = False
+try:
+    import psutil
+
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
+
+T = TypeVar("T")
+
+TELEMETRY_FILE_NAME = "telemetry.json"
+PROFILE_FILE_NAME = "profile.prof"
+WORKER_PROFILE_PREFIX = "worker-"
+
+
+def max_rss_mb() -> float:
+    """このプロセスの最大RSS[MB]. ru_maxrss は Linux では KB、macOS では bytes.
+
+    resource がない場合(Windows)は psutil の最大ワーキングセット(なければ現在のRSS)、psutil もなければ 0.0.
+    """
+    if RESOURCE_AVAILABLE:
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss / 1024**2 if sys.platform == "darwin" else max_rss / 1024
+    if PSUTIL_AVAILABLE:
+        memory_info = psutil.Process().memory_info()
+        return getattr(memory_info, "peak_wset", memory_info.rss) / 1024**2
+    return 0.0
+
+
+def _empty_stage() -> dict[str, float]:
+    return {"calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0, "max_rss_mb": 0.0, "rss_increase_mb": 0.0}
+
+
+def _add_stage(stages: dict[str, dict[str, float]], name: str, record: dict[str, float]) -> None:
+    """段階の計測結果を合算する. 最大RSSは最大値、それ以外は合計."""
+    total = stages.setdefault(name, _empty_stage())
+    for key, value in record.items():
+        total[key] = max(total[key], value) if key == "max_rss_mb" else total[key] + value
+
+
+class Telemetry:
+    """段階ごとの処理時間とメモリを記録する."""
+
+    def __init__(self) -> None:
+        """初期化"""
+        self.stages: dict[str, dict[str, float]] = {}
+        self.worker_stages: dict[str, dict[str, float]] = {}
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Generator[None, None, None]:
+        """ブロックの処理時間とメモリを name の段階として記録する. 同じ名前の段階は合算する.
+
+        Args:
+            name (str): 段階の名前.
+        """
+        start_rss = max_rss_mb()
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        try:
+            yield
+        finally:
+            end_rss = max_rss_mb()
+            _add_stage(
+                self.stages,
+                name,
+                {
+                    "calls": 1,
+                    "wall_seconds": time.perf_counter() - start_wall,
+                    "cpu_seconds": time.process_time() - start_cpu,
+                    "max_rss_mb": end_rss,
+                    "rss_increase_mb": end_rss - start_rss,
+                },
+            )
+
+    def iterate(self, name: str, iterable: Iterable[T]) -> Iterator[T]:
+        """要素を取り出す時間を name の段階として記録しながら繰り返す. ジェネレーターの計測に使う.
+
+        Args:
+            name (str): 段階の名前.
+            iterable (Iterable[T]): 繰り返すもの.
+
+        Yields:
+            T: 要素.
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def merge_worker_stages(self, stages: dict[str, dict[str, float]]) -> None:
+        """ワーカーで記録した段階を合算する. 並列に実行した時間の合計になる."""
+        for name, record in stages.items():
+            _add_stage(self.worker_stages, name, record)
+
+    def write_report(
+        self, path: Path, run_metrics: dict[str, dict[str, Any]], extra: dict[str, Any] | None = None
+    ) -> Path:
+        """レポートをJSONとして保存する.
+
+        Args:
+            path (Path): 保存先.
+            run_metrics (dict[str, dict[str, Any]]): シミュレーション1回ごとの指標 (組み合わせ: 指標).
+            extra (dict[str, Any] | None): レポートに追加する情報.
+
+        Returns:
+            Path: 保存先.
+        """
+        report = {
+            "created_at": datetime.now(UTC).isoformat(timespec="seconds"),
+            "pid": os.getpid(),
+            **(extra or {}),
+            "stages": self.stages,
+            "worker_stages": self.worker_stages,
+            "runs": summarize_run_metrics(list(run_metrics.values())),
+            "per_run": run_metrics,
+        }
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(report, indent=2, ensure_ascii=False, default=str))
+        return path
+
+
+def summarize_run_metrics(run_metrics: list[dict[str, Any]]) -> dict[str, Any]:
+    """シミュレーション1回ごとの指標を合計する.
+
+    Args:
+        run_metrics (list[dict[str, Any]]): シミュレーション1回ごとの指標.
+
+    Returns:
+        dict[str, Any]: 合計と、積分のステップ数と経過時間から計算したスループット.
+    """
+    summary: dict[str, Any] = {"count": len(run_metrics)}
+    for key in sorted({key for metrics in run_metrics for key in metrics}):
+        values = [metrics[key] for metrics in run_metrics if isinstance(metrics.get(key), int | float)]
+        if values:
+            summary[f"total_{key}"] = sum(values)
+    simulation_wall_seconds = summary.get("total_simulation_wall_seconds", 0.0)
+    if simulation_wall_seconds > 0:
+        summary["steps_per_wall_second"] = summary.get("total_integration_steps", 0) / simulation_wall_seconds
+        summary["simulated_seconds_per_wall_second"] = (
+            summary.get("total_simulated_seconds", 0.0) / simulation_wall_seconds
+        )
+    return summary
+
+
+_TELEMETRY: Telemetry | None = None
+
+
+def get_telemetry() -> Telemetry:
+    """このプロセスのTelemetryを取得する.
+
+    Returns:
+        Telemetry: プロセスごとに1つのTelemetry.
+    """
+    global _TELEMETRY  # noqa: PLW0603
+    if _TELEMETRY is None:
+        _TELEMETRY = Telemetry()
+    return _TELEMETRY
+
+
+_WORKER_PROFILE: cProfile.Profile | None = None
+
+
+@contextlib.contextmanager
+def worker_profile(profile_dir: Path | None) -> Generator[None, None, None]:
+    """ブロックを cProfile で計測し、このプロセスの結果に加えて profile_dir に保存する.
+
+    Args:
+        profile_dir (Path | None): 保存先のディレクトリ. Noneの場合は計測しない.
+    """
+    global _WORKER_PROFILE  # noqa: PLW0603
+    if profile_dir is None:
+        yield
+        return
+    if _WORKER_PROFILE is None:
+        _WORKER_PROFILE = cProfile.Profile()
+    _WORKER_PROFILE.enable()
+    try:
+        yield
+    finally:
+        _WORKER_PROFILE.disable()
+        profile_dir.mkdir(parents=True, exist_ok=True)
+        _WORKER_PROFILE.dump_stats(profile_dir / f"{WORKER_PROFILE_PREFIX}{os.getpid()}.prof")
+
+
+def run_with_stages(
+    func: Callable[..., T], *args: Any, profile_dir: Path | None = None, **kwargs: Any
+) -> tuple[T, dict[str, dict[str, float]]]:
+    """ワーカーで関数を実行し、その間に記録した段階を戻り値と一緒に返す.
+
+    joblib などで別プロセスに送る処理を包み、親プロセスで Telemetry.merge_worker_stages に渡す.
+
+    Args:
+        func (Callable[..., T]): 実行する関数.
+        *args (Any): 関数の引数.
+        profile_dir (Path | None): cProfile の結果の保存先. Noneの場合は計測しない.
+        **kwargs (Any): 関数のキーワード引数.
+
+    Returns:
+        tuple[T, dict[str, dict[str, float]]]: 関数の戻り値と、記録した段階.
+    """
+    global _TELEMETRY  # noqa: PLW0603
+    # 親プロセスで実行された場合(n_jobs=1)も、親の記録と混ざらないように一時的に入れ替える
+    parent_telemetry, _TELEMETRY = _TELEMETRY, Telemetry()
+    try:
+        with worker_profile(profile_dir):
+            result = func(*args, **kwargs)
+        return result, _TELEMETRY.stages
+    finally:
+        _TELEMETRY = parent_telemetry
+
+
+def merge_profiles(profile_dir: Path, output_path: Path) -> Path | None:
+    """ワーカーごとの cProfile の結果を1つにまとめる.
+
+    Args:
+        profile_dir (Path): ワーカーごとの結果のディレクトリ.
+        output_path (Path): まとめた結果の保存先. snakeviz や pstats で開ける.
+
+    Returns:
+        Path | None: 保存先. 結果がない場合はNone.
+    """
+    profile_paths = sorted(profile_dir.glob(f"{WORKER_PROFILE_PREFIX}*.prof"))
+    if not profile_paths:
+        return None
+    stats = pstats.Stats(str(profile_paths[0]))
+    for profile_path in profile_paths[1:]:
+        stats.add(str(profile_path))
+    stats.dump_stats(output_path)
+    return output_path
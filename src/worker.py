@@ -0,0 +1,50 @@
+"""共有ファイルシステムのキューからタスクを取り出して実行するワーカー.
+
+misc.executor.backend が shared_fs の場合に、本体(src/main.py)と同じ作業ディレクトリで起動する.
+複数のマシン、複数のプロセスで起動できる.
+
+    uv run src/worker.py --queue_dir temp/executor-queue
+"""
+
+import argparse
+import logging
+
+from trajecsim.util.executor import run_worker
+from trajecsim.util.logger import PROJECT_NAME
+
+
+def get_arguments() -> argparse.Namespace:
+    """コマンドライン引数をパース
+
+    Returns:
+        args: 取得した引数
+    """
+    parser = argparse.ArgumentParser(description="Trajectory Simulation worker")
+    parser.add_argument(
+        "--queue_dir",
+        type=str,
+        default="temp/executor-queue",
+        help="Queue directory (misc.executor.queue_dir)",
+    )
+    parser.add_argument(
+        "--idle_timeout",
+        type=float,
+        default=None,
+        help="Exit after this many seconds without tasks (never by default)",
+    )
+    parser.add_argument(
+        "--poll_interval",
+        type=float,
+        default=0.2,
+        help="Seconds between queue checks while idle",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_arguments()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    logger = logging.getLogger(PROJECT_NAME)
+    logger.info(f"ワーカーを開始します: {args.queue_dir}")
+    num_tasks = run_worker(args.queue_dir, idle_timeout_s=args.idle_timeout, poll_interval_s=args.poll_interval)
+    logger.info(f"ワーカーを終了します: {num_tasks}件のタスクを実行しました")